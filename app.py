@@ -5,9 +5,25 @@ st.set_page_config(page_title="Sistema de Inventário", layout="wide")
 
 # Agora sim, faça os imports
 import pandas as pd
+import numpy as np
 import gspread
+import io
+import os
+import hmac
+import hashlib
+import json
+import bisect
+import random
+import unicodedata
+import sqlite3
+import time
+import tempfile
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from google.oauth2 import service_account
-from datetime import datetime
+from datetime import date, datetime
 
 # --- VERIFICAÇÃO DAS CREDENCIAIS ---
 if 'google_creds' not in st.secrets:
@@ -62,59 +78,1124 @@ SHEET_NAMES = {
 }
 
 # --- FUNÇÕES PRINCIPAIS ---
-@st.cache_resource(ttl=300)
+HTTP_CONEXOES = 10  # conexões mantidas abertas (keep-alive) com a API
+TOKEN_RENOVAR_ANTES = 300  # segundos antes de expirar em que o token é renovado
+
+class RenovadorToken:
+    """Renova o token OAuth em segundo plano antes de ele expirar, para que
+    nenhuma chamada à API espere pela renovação"""
+
+    def __init__(self, credenciais, requisicao, antecedencia=TOKEN_RENOVAR_ANTES):
+        self._credenciais = credenciais
+        self._requisicao = requisicao  # transporte usado para falar com o servidor de tokens
+        self.antecedencia = antecedencia
+        self._lock = threading.Lock()
+        self.renovacoes = 0
+        self.tempo_renovacao = 0.0  # segundos da última renovação
+        self.erro = None
+        threading.Thread(target=self._executar, daemon=True).start()
+
+    def segundos_restantes(self):
+        expira = self._credenciais.expiry  # UTC, sem fuso (google-auth)
+        if expira is None or not self._credenciais.token:
+            return 0.0
+        return (expira - datetime.utcnow()).total_seconds()
+
+    def renovar(self):
+        inicio = time.perf_counter()
+        with self._lock:
+            self._credenciais.refresh(self._requisicao)
+            self.renovacoes += 1
+            self.tempo_renovacao = time.perf_counter() - inicio
+            self.erro = None
+
+    def _executar(self):
+        while True:
+            espera = self.segundos_restantes() - self.antecedencia
+            if espera > 0:
+                time.sleep(min(espera, 60))
+                continue
+            try:
+                self.renovar()
+            except Exception as e:
+                # A sessão autorizada ainda renova sozinha se o token vencer
+                self.erro = e
+                time.sleep(30)
+
+def _sessao_http(sessao):
+    """Monta na sessão um pool de conexões persistentes para a API"""
+    from requests.adapters import HTTPAdapter
+    sessao.mount('https://', HTTPAdapter(pool_connections=HTTP_CONEXOES, pool_maxsize=HTTP_CONEXOES))
+    return sessao
+
+@st.cache_resource
+def get_renovador_token():
+    """Renovador único das credenciais da conta de serviço"""
+    import requests
+    from google.auth.transport.requests import Request
+    return RenovadorToken(CREDS, Request(_sessao_http(requests.Session())))
+
+@st.cache_resource
 def get_gs_client():
-    """Retorna o cliente autenticado do Google Sheets"""
+    """Cliente autenticado do Google Sheets, criado uma vez por processo:
+    conexões HTTP reaproveitadas (keep-alive) e token renovado em segundo plano"""
     try:
-        return gspread.authorize(CREDS)
+        get_renovador_token()
+        gc = gspread.Client(CREDS)
+        # O gspread 6 cria a própria AuthorizedSession; só monta o pool nela
+        _sessao_http(gc.http_client.session)
+        return gc
     except Exception as e:
         st.error(f"❌ Falha na autenticação: {str(e)}")
         st.stop()
 
-def load_sheet_data():
-    """Carrega todos os dados das planilhas com tratamento robusto de erros"""
-    try:
-        gc = get_gs_client()
-        
+# --- CLIENTE DO SHEETS: COTAS E REPETIÇÕES ---
+# Cota padrão da API por usuário: 60 leituras e 60 escritas por minuto
+SHEETS_CHAMADAS_POR_MINUTO = {'leitura': 60, 'escrita': 60}
+SHEETS_RAJADA = 10  # chamadas seguidas antes de o ritmo ser imposto
+SHEETS_MAX_TENTATIVAS = 6
+SHEETS_ESPERA_INICIAL = 1.0  # segundos; dobra a cada nova tentativa
+SHEETS_ESPERA_MAXIMA = 32.0
+SHEETS_ERROS_REPETIVEIS = {429, 500, 502, 503, 504}
+SHEETS_ABAS_TTL = 300  # segundos até reler os metadados das abas (a grade pode ter sido editada fora do app)
+SHEETS_METODOS_ESCRITA = {
+    'batch_update', 'add_worksheet', 'del_worksheet', 'update', 'append_rows',
+    'values_update', 'values_append', 'values_clear', 'clear', 'delete_rows'
+}
+
+def _status_api(erro):
+    resposta = getattr(erro, 'response', None)
+    return getattr(resposta, 'status_code', None) or getattr(erro, 'code', None)
+
+def _erro_repetivel(erro):
+    """Cota excedida (429) ou falha temporária do servidor (5xx)"""
+    return isinstance(erro, gspread.exceptions.APIError) and _status_api(erro) in SHEETS_ERROS_REPETIVEIS
+
+class TokenBucket:
+    """Balde de fichas: até `capacidade` chamadas seguidas e reposição de
+    `por_segundo` fichas por segundo. retirar() espera a ficha se preciso"""
+
+    def __init__(self, por_segundo, capacidade, relogio=time.monotonic, dormir=time.sleep):
+        self.por_segundo = por_segundo
+        self.capacidade = capacidade
+        self._relogio = relogio
+        self._dormir = dormir
+        self._fichas = float(capacidade)
+        self._atualizado = relogio()
+        self._lock = threading.Lock()
+
+    def retirar(self):
+        """Consome uma ficha; retorna os segundos de espera"""
+        with self._lock:
+            agora = self._relogio()
+            self._fichas = min(self.capacidade, self._fichas + (agora - self._atualizado) * self.por_segundo)
+            self._atualizado = agora
+            self._fichas -= 1
+            espera = -self._fichas / self.por_segundo if self._fichas < 0 else 0.0
+        # A ficha já está reservada: a espera acontece fora do lock
+        if espera:
+            self._dormir(espera)
+        return espera
+
+class _ChamadasLimitadas:
+    """Envolve uma planilha ou aba do gspread: cada método passa pelo cliente"""
+
+    def __init__(self, alvo, cliente):
+        self._alvo = alvo
+        self._cliente = cliente
+
+    def __getattr__(self, nome):
+        atributo = getattr(self._alvo, nome)
+        if not callable(atributo):
+            return atributo
+        tipo = 'escrita' if nome in SHEETS_METODOS_ESCRITA else 'leitura'
+
+        def chamada(*args, **kwargs):
+            return self._cliente.chamar(tipo, atributo, *args, **kwargs)
+        return chamada
+
+class _Planilha(_ChamadasLimitadas):
+    """Planilha com as abas já abertas guardadas; escritas descartam as abas
+    que alteraram (tamanho da grade muda)"""
+
+    def worksheet(self, titulo):
+        return self._cliente.aba(titulo)
+
+    def add_worksheet(self, title, rows, cols, **kwargs):
+        aba = self._cliente.chamar('escrita', self._alvo.add_worksheet, title=title, rows=rows, cols=cols, **kwargs)
+        return self._cliente.guardar_aba(title, aba)
+
+    def batch_update(self, corpo):
+        """A resposta já traz os metadados atualizados das abas (tamanho da
+        grade), que substituem os guardados sem uma nova leitura"""
+        ids = _ids_de_abas(corpo)
+        corpo = dict(corpo, includeSpreadsheetInResponse=True, responseIncludeGridData=False)
         try:
-            spreadsheet = gc.open_by_key(SPREADSHEET_ID)
-            st.session_state['spreadsheet_title'] = spreadsheet.title
-        except gspread.SpreadsheetNotFound:
-            st.error(f"📌 Planilha não encontrada. Verifique:")
-            st.error(f"1. ID correto: {SPREADSHEET_ID}")
-            st.error(f"2. Compartilhada com: {CLIENT_EMAIL}")
-            st.error(f"3. Não está na lixeira")
-            st.stop()
-        
-        data = {}
-        for key, sheet_name in SHEET_NAMES.items():
+            resposta = self._cliente.chamar('escrita', self._alvo.batch_update, corpo)
+        except Exception:
+            self._cliente.esquecer_abas(ids)
+            raise
+        abas = (resposta or {}).get('updatedSpreadsheet', {}).get('sheets')
+        if not self._cliente.atualizar_abas(abas):
+            self._cliente.esquecer_abas(ids)
+        return resposta
+
+def _ids_de_abas(corpo):
+    """sheetIds citados nas requisições de um batch_update"""
+    ids = set()
+    pendentes = [corpo]
+    while pendentes:
+        item = pendentes.pop()
+        if isinstance(item, dict):
+            if 'sheetId' in item:
+                ids.add(item['sheetId'])
+            pendentes.extend(item.values())
+        elif isinstance(item, list):
+            pendentes.extend(item)
+    return ids
+
+class SheetsClient:
+    """Acesso ao Google Sheets compartilhado pelas sessões.
+
+    Reaproveita a planilha e as abas já abertas, limita o ritmo das chamadas
+    às cotas (um balde de fichas para leituras e outro para escritas) e
+    repete erros 429/5xx com espera exponencial com jitter, respeitando o
+    Retry-After quando a API o envia. Conta chamadas, repetições e o tempo
+    de espera imposto pelo limite.
+    """
+
+    def __init__(self, autorizar, spreadsheet_id, por_minuto=None, rajada=SHEETS_RAJADA,
+                 max_tentativas=SHEETS_MAX_TENTATIVAS, espera_inicial=SHEETS_ESPERA_INICIAL,
+                 dormir=time.sleep, relogio=time.monotonic):
+        self._autorizar = autorizar  # () -> cliente do gspread
+        self.spreadsheet_id = spreadsheet_id
+        por_minuto = por_minuto or SHEETS_CHAMADAS_POR_MINUTO
+        self._baldes = {
+            tipo: TokenBucket(limite / 60, rajada, relogio=relogio, dormir=dormir)
+            for tipo, limite in por_minuto.items()
+        }
+        self.max_tentativas = max_tentativas
+        self.espera_inicial = espera_inicial
+        self._dormir = dormir
+        self._relogio = relogio
+        self._lock = threading.Lock()
+        self._planilha = None
+        self._abas = {}  # título -> (aba envolvida, aberta em)
+        self.chamadas = {tipo: 0 for tipo in por_minuto}
+        self.repeticoes = 0
+        self.falhas = 0
+        self.tempo_limitado = 0.0  # segundos esperando fichas
+        self.tempo_repeticoes = 0.0  # segundos esperando para repetir
+        self.tempos = {}  # método -> [chamadas bem-sucedidas, segundos]
+
+    def chamar(self, tipo, funcao, *args, **kwargs):
+        """Executa uma chamada à API ('leitura' ou 'escrita') dentro da cota"""
+        espera = self.espera_inicial
+        for tentativa in range(1, self.max_tentativas + 1):
+            limitado = self._baldes[tipo].retirar()
+            with self._lock:
+                self.chamadas[tipo] += 1
+                self.tempo_limitado += limitado
             try:
-                worksheet = spreadsheet.worksheet(sheet_name)
-                records = worksheet.get_all_records()
-                data[key] = pd.DataFrame(records)
-            except gspread.WorksheetNotFound:
-                st.warning(f"⚠️ Aba '{sheet_name}' não encontrada - Criando DataFrame vazio")
-                data[key] = pd.DataFrame()
+                inicio = time.perf_counter()
+                resultado = funcao(*args, **kwargs)
+                with self._lock:
+                    tempo = self.tempos.setdefault(getattr(funcao, '__name__', 'chamada'), [0, 0.0])
+                    tempo[0] += 1
+                    tempo[1] += time.perf_counter() - inicio
+                return resultado
             except Exception as e:
-                st.error(f"Erro na aba {sheet_name}: {str(e)}")
-                data[key] = pd.DataFrame()
-        
-        return data
+                if not _erro_repetivel(e) or tentativa == self.max_tentativas:
+                    with self._lock:
+                        self.falhas += 1
+                    raise
+                pausa = self._retry_after(e)
+                if pausa is None:
+                    pausa = min(espera, SHEETS_ESPERA_MAXIMA) * (0.5 + random.random())
+                with self._lock:
+                    self.repeticoes += 1
+                    self.tempo_repeticoes += pausa
+                self._dormir(pausa)
+                espera *= 2
+
+    @staticmethod
+    def _retry_after(erro):
+        cabecalhos = getattr(getattr(erro, 'response', None), 'headers', None) or {}
+        try:
+            return min(float(cabecalhos.get('Retry-After')), SHEETS_ESPERA_MAXIMA)
+        except (TypeError, ValueError):
+            return None
+
+    def planilha(self):
+        """Planilha aberta uma única vez (open_by_key só na primeira chamada)"""
+        with self._lock:
+            planilha = self._planilha
+        if planilha is None:
+            aberta = self.chamar('leitura', self._autorizar().open_by_key, self.spreadsheet_id)
+            planilha = _Planilha(aberta, self)
+            with self._lock:
+                self._planilha = planilha
+        return planilha
+
+    def aba(self, titulo):
+        """Aba pelo título. Os metadados de todas as abas vêm de uma única
+        chamada e ficam guardados por SHEETS_ABAS_TTL"""
+        with self._lock:
+            aba, aberta_em = self._abas.get(titulo, (None, 0.0))
+        if aba is None or self._relogio() - aberta_em > SHEETS_ABAS_TTL:
+            for aberta in self.chamar('leitura', self.planilha()._alvo.worksheets):
+                self.guardar_aba(aberta.title, aberta)
+            with self._lock:
+                aba, _ = self._abas.get(titulo, (None, 0.0))
+            if aba is None:
+                raise gspread.WorksheetNotFound(titulo)
+        return aba
+
+    def atualizar_abas(self, propriedades):
+        """Aplica às abas abertas os metadados devolvidos por uma escrita;
+        retorna False se não foi possível (as abas devem ser relidas)"""
+        if not propriedades:
+            return False
+        with self._lock:
+            por_id = {item[0].id: item[0] for item in self._abas.values()}
+            for folha in propriedades:
+                props = folha.get('properties', {})
+                aba = por_id.get(props.get('sheetId'))
+                if aba is None:
+                    continue
+                atuais = getattr(aba._alvo, '_properties', None)
+                if not isinstance(atuais, dict):
+                    return False
+                atuais.update(props)
+        return True
+
+    def guardar_aba(self, titulo, aba):
+        aba = _ChamadasLimitadas(aba, self)
+        with self._lock:
+            self._abas[titulo] = (aba, self._relogio())
+        return aba
+
+    def esquecer_abas(self, ids=None):
+        """Descarta as abas abertas (todas ou as dos sheetIds informados)"""
+        with self._lock:
+            self._abas = {
+                titulo: item for titulo, item in self._abas.items()
+                if ids is not None and item[0].id not in ids
+            }
+
+    def metricas(self):
+        with self._lock:
+            return {
+                'chamadas': dict(self.chamadas),
+                'repeticoes': self.repeticoes,
+                'falhas': self.falhas,
+                'tempo_limitado': round(self.tempo_limitado, 2),
+                'tempo_repeticoes': round(self.tempo_repeticoes, 2),
+                'abas_abertas': sorted(self._abas),
+                'tempos': {nome: (n, total / n) for nome, (n, total) in self.tempos.items()}
+            }
+
+@st.cache_resource
+def get_sheets_client():
+    """Cliente único, compartilhado por todas as sessões (as cotas são por usuário da API)"""
+    return SheetsClient(get_gs_client, SPREADSHEET_ID)
+
+# Parâmetros de leitura: números chegam como números e datas como texto,
+# equivalente ao que o get_all_records entregava
+VALUE_RENDER_PARAMS = {
+    'valueRenderOption': 'UNFORMATTED_VALUE',
+    'dateTimeRenderOption': 'FORMATTED_STRING',
+}
+
+def _sheet_range(sheet_name):
+    """Intervalo A1 que cobre a aba inteira"""
+    return "'{}'".format(sheet_name.replace("'", "''"))
+
+def grid_to_dataframe(values):
+    """Monta um DataFrame a partir da grade bruta (cabeçalho na primeira linha)"""
+    if not values:
+        return pd.DataFrame()
+    header = [str(col).strip() for col in values[0]]
+    width = len(header)
+    # A API omite células vazias no fim da linha; completamos até o cabeçalho
+    rows = [list(row[:width]) + [''] * (width - len(row)) for row in values[1:]]
+    return pd.DataFrame(rows, columns=header)
+
+def _fetch_grid(spreadsheet, sheet_name):
+    """Busca uma aba isolada. Retorna (valores, segundos, erro)"""
+    start = time.perf_counter()
+    try:
+        values = spreadsheet.worksheet(sheet_name).get_all_values(
+            value_render_option=VALUE_RENDER_PARAMS['valueRenderOption'],
+            date_time_render_option=VALUE_RENDER_PARAMS['dateTimeRenderOption']
+        )
+        return values, time.perf_counter() - start, None
+    except gspread.WorksheetNotFound:
+        return None, time.perf_counter() - start, None
+    except Exception as e:
+        return None, time.perf_counter() - start, e
+
+def fetch_sheet_grids(spreadsheet, sheet_names, max_workers=5):
+    """Busca as grades de valores de várias abas.
+
+    Tenta uma única chamada values_batch_get. Se o lote falhar (por exemplo,
+    uma aba inexistente invalida a requisição inteira), busca as abas em
+    paralelo. Retorna (grades, tempos, erros); grades[aba] é None quando a
+    aba não existe.
+    """
+    sheet_names = list(sheet_names)
+    start = time.perf_counter()
+    try:
+        response = spreadsheet.values_batch_get(
+            [_sheet_range(name) for name in sheet_names],
+            params=VALUE_RENDER_PARAMS
+        )
+        value_ranges = response.get('valueRanges', [])
+        if len(value_ranges) != len(sheet_names):
+            raise ValueError("Resposta do lote incompleta")
+        elapsed = time.perf_counter() - start
+        grids = {name: vr.get('values', []) for name, vr in zip(sheet_names, value_ranges)}
+        # No lote todas as abas compartilham a mesma ida e volta
+        return grids, {name: elapsed for name in sheet_names}, {}
+    except (gspread.exceptions.APIError, ValueError) as e:
+        if _erro_repetivel(e):
+            raise  # cota esgotada mesmo após as repetições: buscar aba por aba só pioraria
+
+    grids, timings, errors = {}, {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sheet_names)))) as pool:
+        futures = {name: pool.submit(_fetch_grid, spreadsheet, name) for name in sheet_names}
+        for name, future in futures.items():
+            values, elapsed, error = future.result()
+            grids[name] = values
+            timings[name] = elapsed
+            if error is not None:
+                errors[name] = error
+    return grids, timings, errors
+
+def load_tables(spreadsheet, keys=None):
+    """Carrega as abas pedidas (chaves de SHEET_NAMES) como DataFrames.
+
+    Retorna (dados, tempos, faltantes, erros). tempos[chave] traz 'fetch'
+    (ida e volta à API), 'parse' (montagem do DataFrame) e 'rows'.
+    """
+    keys = list(SHEET_NAMES) if keys is None else list(keys)
+    grids, fetch_times, fetch_errors = fetch_sheet_grids(
+        spreadsheet, [SHEET_NAMES[key] for key in keys]
+    )
+
+    data, timings, missing, errors = {}, {}, [], {}
+    for key in keys:
+        sheet_name = SHEET_NAMES[key]
+        start = time.perf_counter()
+        if sheet_name in fetch_errors:
+            errors[key] = fetch_errors[sheet_name]
+            data[key] = pd.DataFrame()
+        elif grids.get(sheet_name) is None:
+            missing.append(key)
+            data[key] = pd.DataFrame()
+        else:
+            data[key] = tipar_tabela(key, grid_to_dataframe(grids[sheet_name]))
+        timings[key] = {
+            'fetch': fetch_times.get(sheet_name, 0.0),
+            'parse': time.perf_counter() - start,
+            'rows': len(data[key])
+        }
+    return data, timings, missing, errors
+
+# --- ESQUEMA DAS TABELAS ---
+# 'id': inteiro de 64 bits; 'int': inteiro de 32 bits; 'category': texto repetido;
+# 'datetime': datetime64. Colunas fora do esquema ficam como vieram.
+ESQUEMA_TABELAS = {
+    'movimentacoes': {
+        'ID Movimentação': 'id', 'ID Produto': 'id', 'ID Responsável': 'id', 'ID Responsavel': 'id',
+        'ID Unidade': 'id', 'Quantidade': 'int', 'Tipo': 'category', 'Fornecedor': 'category',
+        'Razão': 'category', 'Data': 'datetime'
+    },
+    'produtos': {
+        'ID Produto': 'id', 'Quantidade em Estoque': 'int', 'Unidade de Medida': 'category', 'Categoria': 'category'
+    },
+    'responsaveis': {'ID Responsavel': 'id', 'ID Unidade': 'id', 'Cargo': 'category'},
+    'unidades': {'ID Unidade': 'id', 'Cidade': 'category', 'Estado': 'category'},
+    'usuarios': {'nivel_acesso': 'category'}
+}
+LIMITE_CATEGORIA = 0.5  # acima desta fração de valores distintos, o texto não vira categoria
+
+def _texto_livre(serie):
+    return not (pd.api.types.is_numeric_dtype(serie.dtype) or pd.api.types.is_datetime64_any_dtype(serie.dtype)
+                or isinstance(serie.dtype, pd.CategoricalDtype))
+
+def _vazios(serie):
+    """NaN/None e, em colunas de texto, células em branco"""
+    if _texto_livre(serie):
+        return serie.isna() | (serie.astype(str).str.strip() == '')
+    return serie.isna()
+
+FORMATOS_DATA = ('%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y')  # fora do ISO, sempre dia/mês
+
+def _ler_datas(serie):
+    """Datas ISO (inclusive células de data do Excel e as gravadas pelo app)
+    ou no formato dia/mês/ano; NaT onde não há data legível.
+
+    O formato nunca é inferido do primeiro valor: '05/02/2024' é 5 de
+    fevereiro em qualquer linha, mesmo ao lado de datas com dia > 12.
+    """
+    texto = serie.fillna('').astype(str).str.strip()
+    datas = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+    iso = texto.str.match(r'^\d{4}-\d{1,2}-\d{1,2}')
+    if iso.any():
+        datas[iso] = pd.to_datetime(texto[iso], format='ISO8601', errors='coerce')
+    restantes = ~iso & (texto != '')
+    for formato in FORMATOS_DATA + ('mixed',):
+        if not restantes.any():
+            break
+        lidas = pd.to_datetime(texto[restantes], format=formato, dayfirst=True, errors='coerce').dropna()
+        datas[lidas.index] = lidas
+        restantes[lidas.index] = False
+    return datas
+
+def _converter_coluna(serie, tipo):
+    """Converte a coluna para o tipo do esquema, sem perda: se algum valor
+    preenchido não couber (ex.: ID 'DESCONHECIDO'), a coluna fica como está"""
+    if tipo in ('id', 'int'):
+        if serie.dtype == ('int64' if tipo == 'id' else 'int32'):
+            return serie
+        numeros = pd.to_numeric(serie, errors='coerce')
+        if (numeros.isna() & ~_vazios(serie)).any() or (numeros.dropna() % 1 != 0).any():
+            return serie
+        largura = 'int64'
+        if tipo == 'int' and (numeros.dropna().abs() < 2 ** 31).all():
+            largura = 'int32'
+        if numeros.isna().any():
+            return numeros.astype(largura.capitalize())  # inteiro com valores vazios (pd.NA)
+        return numeros.astype(largura)
+    if tipo == 'category':
+        if not _texto_livre(serie) or pd.api.types.infer_dtype(serie, skipna=True) != 'string':
+            return serie  # categorias de tipos mistos não passam pelo Arrow/SQLite
+        if serie.nunique(dropna=True) > LIMITE_CATEGORIA * len(serie):
+            return serie
+        return serie.astype('category')
+    if tipo == 'datetime':
+        if pd.api.types.is_datetime64_any_dtype(serie.dtype):
+            return serie
+        datas = _ler_datas(serie)
+        if (datas.isna() & ~_vazios(serie)).any():
+            return serie
+        return datas
+    raise ValueError(f"Tipo de coluna desconhecido: {tipo}")
+
+def tipar_tabela(key, df):
+    """Aplica ESQUEMA_TABELAS na ingestão; colunas já no tipo certo saem rápido"""
+    convertidas = {}
+    for coluna, tipo in ESQUEMA_TABELAS.get(key, {}).items():
+        if coluna in df.columns and len(df):
+            convertida = _converter_coluna(df[coluna], tipo)
+            if convertida.dtype != df[coluna].dtype:
+                convertidas[coluna] = convertida
+    return df.assign(**convertidas) if convertidas else df
+
+def tipar_tabelas(tabelas):
+    return {key: tipar_tabela(key, df) for key, df in tabelas.items()}
+
+def relatorio_memoria(tabelas):
+    """Bytes de cada tabela tipada comparados à mesma tabela só com colunas object"""
+    linhas = []
+    for key, df in tabelas.items():
+        depois = int(df.memory_usage(index=False, deep=True).sum())
+        antes = int(df.astype(object).memory_usage(index=False, deep=True).sum())
+        linhas.append({
+            'Tabela': key,
+            'Linhas': len(df),
+            'Sem esquema (MB)': round(antes / 2 ** 20, 2),
+            'Com esquema (MB)': round(depois / 2 ** 20, 2),
+            'Economia (MB)': round((antes - depois) / 2 ** 20, 2),
+            'Economia (%)': round(100 * (antes - depois) / antes, 1) if antes else 0.0
+        })
+    return pd.DataFrame(linhas)
+
+def relatorio_versoes(snapshots):
+    """Versões residentes do armazém; tabelas compartilhadas entre versões
+    são contadas uma vez só, na versão mais antiga que as usa"""
+    tamanhos = {}  # id do DataFrame -> bytes
+    linhas = []
+    for snapshot in snapshots:
+        proprias = [df for df in snapshot.tabelas.values() if id(df) not in tamanhos]
+        for df in proprias:
+            tamanhos[id(df)] = int(df.memory_usage(index=False, deep=True).sum())
+        linhas.append({
+            'Versão': snapshot.versao,
+            'Tabelas próprias': len(proprias),
+            'Total (MB)': round(sum(tamanhos[id(df)] for df in snapshot.tabelas.values()) / 2 ** 20, 2),
+            'Próprias (MB)': round(sum(tamanhos[id(df)] for df in proprias) / 2 ** 20, 2)
+        })
+    return pd.DataFrame(linhas)
+
+def mostrar_memoria_tabelas(snapshot):
+    """Relatório de memória das tabelas compartilhadas (barra lateral, só gerentes)"""
+    if st.session_state.get('nivel_acesso') != "Gerente":
+        return
+    with st.sidebar.expander("Memória das tabelas"):
+        if st.button("Medir", key="btn_medir_memoria"):
+            relatorio = relatorio_memoria(snapshot.tabelas)
+            st.dataframe(relatorio, hide_index=True)
+            st.caption(f"Economia do esquema: {relatorio['Economia (MB)'].sum():.2f} MB")
+            versoes = relatorio_versoes(get_table_store().residentes())
+            st.dataframe(versoes, hide_index=True)
+            st.caption(f"{len(versoes)} versão(ões) residente(s), {versoes['Próprias (MB)'].sum():.2f} MB "
+                       f"no total, compartilhados por todas as sessões")
+
+# --- CACHE DAS ABAS ---
+TABLE_CACHE_TTL = 300  # segundos
+
+class TableCache:
+    """Cache das abas compartilhado entre sessões, com TTL e versão por aba.
+
+    Cada escrita incrementa a versão apenas das abas que alterou; entradas
+    com versão defasada ou TTL vencido são buscadas de novo, as demais nunca.
+    """
+
+    def __init__(self, ttl=TABLE_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.tempos = {}     # aba -> segundos da última busca na planilha
+        self._lock = threading.Lock()
+        self._entries = {}   # aba -> (DataFrame, versão, instante da carga)
+        self._versions = {}  # aba -> versão atual
+
+    def version(self, key):
+        return self._versions.get(key, 0)
+
+    def get_many(self, keys, loader):
+        """Retorna {aba: DataFrame}; loader(abas) busca só as ausentes ou vencidas"""
+        now = time.monotonic()
+        result, stale = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry and entry[1] == self.version(key) and now - entry[2] < self.ttl:
+                    result[key] = entry[0]
+                    self.hits += 1
+                else:
+                    stale.append(key)
+                    self.misses += 1
+            versions = {key: self.version(key) for key in stale}
+
+        if stale:
+            loaded = loader(stale)
+            with self._lock:
+                for key in stale:
+                    if key not in loaded:
+                        result[key] = pd.DataFrame()
+                        continue
+                    # Se a aba foi invalidada durante a busca, não guarda o dado antigo
+                    if versions[key] == self.version(key):
+                        self._entries[key] = (loaded[key], versions[key], time.monotonic())
+                    result[key] = loaded[key]
+        return result
+
+    def invalidate(self, keys):
+        """Descarta apenas as abas informadas"""
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self.version(key) + 1
+                self._entries.pop(key, None)
+
+    def stamp(self, key):
+        """Identifica o conteúdo em cache da aba; muda a cada nova carga ou gravação"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return (self.version(key), entry[2] if entry else None)
+
+    def snapshot(self, key):
+        """Último conteúdo conhecido da aba, mesmo com TTL vencido (ou None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry else None
+
+    def publish(self, tables):
+        """Registra o conteúdo recém-gravado, sem precisar buscar de novo"""
+        now = time.monotonic()
+        with self._lock:
+            for key, df in tables.items():
+                self._versions[key] = self.version(key) + 1
+                self._entries[key] = (df, self._versions[key], now)
+
+    def registrar_tempos(self, timings):
+        with self._lock:
+            self.tempos.update(timings)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'versions': dict(self._versions),
+                'cached': sorted(self._entries),
+                'tempos': dict(self.tempos)
+            }
+
+@st.cache_resource
+def get_table_cache():
+    """Instância única do cache, compartilhada por todas as sessões"""
+    return TableCache()
+
+def invalidate_tables(keys):
+    """Invalida no cache apenas as abas alteradas por uma escrita"""
+    get_table_cache().invalidate(keys)
+
+# --- ARMAZÉM DE TABELAS COMPARTILHADO ---
+TABLE_STORE_TTL = TABLE_CACHE_TTL  # segundos até reler o backend
+MAX_ALTERACOES = 1000  # alterações lembradas por tabela, para detectar conflitos
+
+class ConflitoEdicao(RuntimeError):
+    """Registro alterado por outra sessão depois de lido por esta"""
+
+class TableSnapshot:
+    """Versão imutável das cinco tabelas. Ninguém altera os DataFrames de um
+    snapshot: cada escrita publica um novo, que reaproveita as tabelas que
+    não mudaram"""
+
+    __slots__ = ('versao', 'tabelas', 'versoes', '__weakref__')
+
+    def __init__(self, versao, tabelas, versoes):
+        self.versao = versao
+        self.tabelas = tabelas
+        self.versoes = versoes  # tabela -> versão do snapshot em que mudou
+
+    def __getitem__(self, key):
+        return self.tabelas.get(key, pd.DataFrame())
+
+class TableStore:
+    """Tabelas do inventário compartilhadas por todas as sessões.
+
+    As sessões guardam só o número da versão que estão lendo; escritas
+    publicam um novo snapshot (copy-on-write por tabela). Snapshots antigos
+    ficam em memória apenas enquanto alguma execução ainda os usa.
+    """
+
+    def __init__(self, carregar, ttl=TABLE_STORE_TTL):
+        self._carregar = carregar  # lista de tabelas -> {tabela: DataFrame}
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self._atual = None
+        self._residentes = weakref.WeakValueDictionary()
+        self._lidas = {}  # tabela -> quando foi lida do backend
+        self._invalidas = set()
+        self._alteracoes = {}  # tabela -> [(versão, chaves tocadas ou None)]
+        self._esquecida = {}  # tabela -> última versão que saiu do histórico
+
+    def atual(self, keys=None):
+        """Snapshot mais recente; relê do backend as tabelas invalidadas, as
+        nunca lidas e as de TTL vencido, publicando só as que mudaram.
+
+        Com keys, só essas tabelas são garantidas (a tela de login lê apenas
+        os usuários); as demais do snapshot podem estar ausentes.
+        """
+        with self.lock:
+            agora = time.time()
+            pedidas = list(SHEET_NAMES) if keys is None else list(keys)
+            keys = [key for key in pedidas
+                    if key in self._invalidas or key not in self._lidas or agora - self._lidas[key] > self.ttl]
+            if keys:
+                novas = self._carregar(keys)
+                self._lidas.update(dict.fromkeys(novas, agora))
+                self._invalidas.difference_update(novas)
+                if self._atual is not None:
+                    novas = {key: df for key, df in novas.items() if not _mesmo_conteudo(df, self._atual[key])}
+                if novas:
+                    self._publicar(novas)
+            return self._atual
+
+    def obter(self, versao):
+        """Snapshot da versão pedida, se ainda residente; senão o mais recente"""
+        snapshot = self._residentes.get(versao) if versao is not None else None
+        return snapshot if snapshot is not None else self.atual()
+
+    def alterar(self, funcao, chaves=None):
+        """Publica o resultado de funcao(snapshot atual) -> {tabela: DataFrame}.
+
+        chaves indica, por tabela, os registros tocados (None: a tabela toda).
+        Tabelas ainda não carregadas ficam de fora: a primeira leitura delas
+        já trará a escrita (fila e diário).
+        """
+        with self.lock:
+            if self._atual is None:
+                return None
+            novas = {key: df for key, df in (funcao(self._atual) or {}).items() if key in self._lidas}
+            if novas:
+                self._publicar(tipar_tabelas(novas), chaves or {})
+            return self._atual
+
+    def conflita(self, key, revisao, chaves, so_anexos=False):
+        """Se alguma alteração de key posterior à revisão tocou as chaves.
+
+        Alterações de outros registros não conflitam (a gravação é mesclada);
+        chaves None é uma operação sobre a tabela inteira. Alterações de
+        extensão desconhecida (releituras) só não conflitam com anexos.
+        """
+        with self.lock:
+            if self._atual is None or revisao >= self._atual.versoes.get(key, 0):
+                return False
+            if revisao < self._esquecida.get(key, 0):
+                return not so_anexos
+            for versao, tocadas in self._alteracoes.get(key, []):
+                if versao <= revisao:
+                    continue
+                if tocadas is None:
+                    if not so_anexos:
+                        return True
+                elif chaves is None or chaves & tocadas:
+                    return True
+            return False
+
+    def invalidar(self, keys):
+        """Marca tabelas para serem relidas do backend no próximo acesso"""
+        with self.lock:
+            self._invalidas.update(keys)
+
+    def _publicar(self, tabelas, chaves=None):
+        base = self._atual
+        versao = base.versao + 1 if base else 1
+        todas = dict(base.tabelas) if base else {}
+        versoes = dict(base.versoes) if base else {}
+        for key, df in tabelas.items():
+            todas[key] = df
+            versoes[key] = versao
+            if base is not None:
+                historico = self._alteracoes.setdefault(key, [])
+                historico.append((versao, (chaves or {}).get(key)))
+                if len(historico) > MAX_ALTERACOES:
+                    self._esquecida[key] = historico.pop(0)[0]
+        self._atual = TableSnapshot(versao, todas, versoes)
+        self._residentes[versao] = self._atual
+
+    def residentes(self):
+        """Snapshots ainda em memória, do mais antigo ao atual"""
+        with self.lock:
+            return [self._residentes[v] for v in sorted(self._residentes.keys())]
+
+@st.cache_resource
+def get_table_store():
+    """Armazém único, compartilhado por todas as sessões"""
+    return TableStore(_carregar_tabelas)
+
+def tabelas_sessao():
+    """Snapshot usado nesta execução; a sessão guarda apenas a sua versão e
+    as revisões das tabelas (as desta execução e as da tela anterior, que
+    foi a que o usuário viu ao enviar um formulário)"""
+    try:
+        snapshot = get_table_store().atual()
+    except Exception as e:
+        st.error(f"Erro ao carregar planilhas: {e}")
+        return TableSnapshot(0, {}, {})
+    st.session_state['revisoes_lidas'] = st.session_state.get('revisoes_tabelas', snapshot.versoes)
+    st.session_state['revisoes_tabelas'] = snapshot.versoes
+    st.session_state['versao_tabelas'] = snapshot.versao
+    return snapshot
+
+def versao_tabela(key):
+    """Versão da tabela no snapshot lido por esta sessão"""
+    snapshot = get_table_store().obter(st.session_state.get('versao_tabelas'))
+    return snapshot.versoes.get(key, 0)
+
+def revisao_lida(key):
+    """Revisão da tabela que o usuário tinha na tela; base das gravações condicionais"""
+    revisoes = st.session_state.get('revisoes_lidas')
+    return revisoes[key] if revisoes and key in revisoes else versao_tabela(key)
+
+class IndexCache:
+    """Estruturas derivadas das tabelas (índices), compartilhadas entre sessões
+    e reconstruídas apenas quando a versão da tabela de origem muda"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._itens = {}  # nome -> (versão, valor)
+        self.construcoes = 0
+
+    def obter(self, nome, versao, construir, atualizar=None):
+        """Retorna o valor da versão pedida; com `atualizar`, o valor novo é
+        derivado do anterior em vez de reconstruído.
+
+        `atualizar(anterior)` deve devolver um objeto novo, sem alterar o
+        anterior: sessões ainda na versão antiga continuam a usá-lo.
+        """
+        with self._lock:
+            item = self._itens.get(nome)
+            if item and item[0] == versao:
+                return item[1]
+        valor = atualizar(item[1]) if item and atualizar else construir()
+        with self._lock:
+            self._itens[nome] = (versao, valor)
+            self.construcoes += 1
+        return valor
+
+@st.cache_resource
+def get_index_cache():
+    """Instância única, compartilhada por todas as sessões"""
+    return IndexCache()
+
+def _load_from_spreadsheet(keys):
+    """Busca as abas informadas na planilha (usado pelo cache nas faltas)"""
+    try:
+        spreadsheet = get_sheets_client().planilha()
+        st.session_state['spreadsheet_title'] = spreadsheet.title
+    except gspread.SpreadsheetNotFound:
+        st.error(f"📌 Planilha não encontrada. Verifique:")
+        st.error(f"1. ID correto: {SPREADSHEET_ID}")
+        st.error(f"2. Compartilhada com: {CLIENT_EMAIL}")
+        st.error(f"3. Não está na lixeira")
+        st.stop()
+    
+    data, timings, missing, errors = load_tables(spreadsheet, keys)
+    for key in missing:
+        st.warning(f"⚠️ Aba '{SHEET_NAMES[key]}' não encontrada - Criando DataFrame vazio")
+    for key, error in errors.items():
+        st.error(f"Erro na aba {SHEET_NAMES[key]}: {str(error)}")
+        # Abas com erro não entram no cache
+        data.pop(key)
+    get_table_cache().registrar_tempos(timings)
+    return data
+
+def load_sheet_data(keys=None):
+    """Carrega os dados das planilhas com tratamento robusto de erros.
+
+    Passa pelo cache compartilhado; cada sessão recebe cópias, para que
+    edições locais não alterem o dado em cache.
+    """
+    keys = list(SHEET_NAMES) if keys is None else list(keys)
+    try:
+        data = get_table_cache().get_many(keys, _load_from_spreadsheet)
+        return {key: df.copy() for key, df in data.items()}
     
+    except gspread.exceptions.APIError as e:
+        if not _erro_repetivel(e):
+            raise
+        st.warning("⏳ O Google Sheets está limitando as requisições. Tente novamente em alguns instantes.")
+        st.stop()
     except Exception as e:
         st.error(f"🚨 Erro crítico: {str(e)}")
         st.stop()
 
+# --- ESCRITA INCREMENTAL ---
+# Coluna usada para casar linhas entre o snapshot e o DataFrame novo; sem ela
+# (ou com chaves repetidas) a comparação é feita por posição
+TABLE_KEYS = {
+    'movimentacoes': 'ID Movimentação',
+    'produtos': 'ID Produto',
+    'responsaveis': 'ID Responsavel',
+    'unidades': 'ID Unidade',
+    'usuarios': 'username'
+}
+
+def _cell_value(value):
+    """Normaliza um valor do DataFrame para o formato gravado na planilha"""
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        if pd.isna(value):
+            return ''
+        if isinstance(value, datetime) and (value.hour or value.minute or value.second):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        if value != value:  # NaN
+            return ''
+        if value.is_integer():
+            return int(value)
+    if value is pd.NA or value is pd.NaT:
+        return ''
+    return value
+
+def _table_rows(df):
+    return [tuple(_cell_value(v) for v in row) for row in df.itertuples(index=False, name=None)]
+
+def _cell_data(value):
+    if value == '' and not isinstance(value, bool):
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+def _row_data(row):
+    return {'values': [_cell_data(v) for v in row]}
+
+def _runs(positions):
+    """Agrupa posições ordenadas em intervalos contíguos [início, fim)"""
+    runs = []
+    for pos in positions:
+        if runs and runs[-1][1] == pos:
+            runs[-1][1] = pos + 1
+        else:
+            runs.append([pos, pos + 1])
+    return runs
+
+def diff_table(old_df, new_df, key=None):
+    """Compara o snapshot com o DataFrame novo.
+
+    Retorna (excluidas, alteradas, novas, resultado): posições de linhas do
+    snapshot a excluir, pares (posição após exclusões, linha) a reescrever,
+    linhas a anexar e o DataFrame que a aba terá após a gravação.
+    """
+    old_rows = _table_rows(old_df)
+    new_rows = _table_rows(new_df)
+    columns = list(new_df.columns)
+
+    use_key = (
+        key in columns
+        and new_df[key].is_unique
+        and old_df[key].is_unique
+    )
+    if use_key:
+        idx = columns.index(key)
+        new_by_key = {str(row[idx]): row for row in new_rows}
+        old_keys = [str(row[idx]) for row in old_rows]
+        old_key_set = set(old_keys)
+
+        deleted = [i for i, k in enumerate(old_keys) if k not in new_by_key]
+        kept = [new_by_key[k] for k in old_keys if k in new_by_key]
+        kept_old = [row for row, k in zip(old_rows, old_keys) if k in new_by_key]
+        changed = [(pos, row) for pos, (row, old) in enumerate(zip(kept, kept_old)) if row != old]
+        appended = [row for row in new_rows if str(row[idx]) not in old_key_set]
+        result_rows = kept + appended
+    else:
+        common = min(len(old_rows), len(new_rows))
+        deleted = list(range(common, len(old_rows)))
+        changed = [(i, new_rows[i]) for i in range(common) if new_rows[i] != old_rows[i]]
+        appended = new_rows[common:]
+        result_rows = new_rows
+
+    return deleted, changed, appended, pd.DataFrame(result_rows, columns=columns)
+
+def plan_table_write(sheet_id, snapshot, df, key=None, grid_rows=0, grid_cols=0):
+    """Monta as requisições de um único batch_update para gravar df na aba.
+
+    Com snapshot de mesmo cabeçalho, envia só exclusões, trechos alterados e
+    linhas novas. Sem snapshot (ou com cabeçalho diferente), reescreve a aba
+    inteira numa só requisição, limpando o excedente sem passar por clear().
+    Retorna (requisições, DataFrame resultante).
+    """
+    columns = [str(col) for col in df.columns]
+    width = len(columns)
+
+    if snapshot is not None and [str(col) for col in snapshot.columns] == columns:
+        deleted, changed, appended, result = diff_table(snapshot, df, key)
+        requests = []
+        # Exclusões de baixo para cima, para não deslocar os índices seguintes
+        for start, end in reversed(_runs(deleted)):
+            requests.append({'deleteDimension': {'range': {
+                'sheetId': sheet_id, 'dimension': 'ROWS',
+                'startIndex': start + 1, 'endIndex': end + 1
+            }}})
+        changed_by_pos = dict(changed)
+        for start, end in _runs(sorted(changed_by_pos)):
+            requests.append({'updateCells': {
+                'range': {
+                    'sheetId': sheet_id,
+                    'startRowIndex': start + 1, 'endRowIndex': end + 1,
+                    'startColumnIndex': 0, 'endColumnIndex': width
+                },
+                'rows': [_row_data(changed_by_pos[pos]) for pos in range(start, end)],
+                'fields': 'userEnteredValue'
+            }})
+        if appended:
+            requests.append({'appendCells': {
+                'sheetId': sheet_id,
+                'rows': [_row_data(row) for row in appended],
+                'fields': 'userEnteredValue'
+            }})
+        return requests, result
+
+    rows = [tuple(columns)] + _table_rows(df)
+    requests = []
+    if len(rows) > grid_rows:
+        requests.append({'appendDimension': {
+            'sheetId': sheet_id, 'dimension': 'ROWS', 'length': len(rows) - grid_rows
+        }})
+    if width > grid_cols:
+        requests.append({'appendDimension': {
+            'sheetId': sheet_id, 'dimension': 'COLUMNS', 'length': width - grid_cols
+        }})
+    # O intervalo cobre a grade inteira: o que não vier em 'rows' é apagado
+    requests.append({'updateCells': {
+        'range': {
+            'sheetId': sheet_id,
+            'startRowIndex': 0, 'endRowIndex': max(len(rows), grid_rows),
+            'startColumnIndex': 0, 'endColumnIndex': max(width, grid_cols)
+        },
+        'rows': [_row_data(row) for row in rows],
+        'fields': 'userEnteredValue'
+    }})
+    return requests, pd.DataFrame(rows[1:], columns=columns)
+
+def _coluna_a1(posicao):
+    """Letra da coluna (A, B, ..., AA) da posição 0-based"""
+    letras = ''
+    posicao += 1
+    while posicao:
+        posicao, resto = divmod(posicao - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+def conferir_snapshots(spreadsheet, snapshots):
+    """Confere os snapshots em cache com as linhas atuais da planilha.
+
+    Lê só a coluna chave de cada aba (uma chamada para todas). Se as chaves
+    não batem, na mesma ordem, com as do snapshot (linhas incluídas,
+    excluídas ou movidas por fora do app), as exclusões e alterações por
+    posição atingiriam as linhas erradas: a aba é relida inteira. Retorna
+    {aba: snapshot válido ou None}.
+    """
+    colunas = {}
+    for key, snapshot in snapshots.items():
+        if snapshot is None or snapshot.columns.empty:
+            continue
+        chave = TABLE_KEYS.get(key)
+        colunas[key] = list(snapshot.columns).index(chave) if chave in snapshot.columns else 0
+    if not colunas:
+        return snapshots
+    
+    resultado = dict(snapshots)
+    response = spreadsheet.values_batch_get(
+        [f"{_sheet_range(SHEET_NAMES[key])}!{_coluna_a1(pos)}:{_coluna_a1(pos)}" for key, pos in colunas.items()],
+        params=VALUE_RENDER_PARAMS
+    )
+    defasadas = []
+    for (key, pos), value_range in zip(colunas.items(), response.get('valueRanges', [])):
+        na_planilha = [str(linha[0]) if linha else '' for linha in value_range.get('values', [])[1:]]
+        no_snapshot = [str(_cell_value(v)) for v in snapshots[key].iloc[:, pos]]
+        # A API omite as linhas vazias no fim da coluna
+        while no_snapshot and no_snapshot[-1] == '' and len(no_snapshot) > len(na_planilha):
+            no_snapshot.pop()
+        if na_planilha != no_snapshot:
+            defasadas.append(key)
+    
+    if defasadas:
+        grids, _, errors = fetch_sheet_grids(spreadsheet, [SHEET_NAMES[key] for key in defasadas])
+        for key in defasadas:
+            values = grids.get(SHEET_NAMES[key])
+            # Sem a grade atual, a aba é reescrita inteira
+            resultado[key] = grid_to_dataframe(values) if values and SHEET_NAMES[key] not in errors else None
+    return resultado
+
 def save_data(dataframes):
-    """Salva dados nas planilhas com verificação em tempo real"""
+    """Salva dados nas planilhas enviando apenas as diferenças de cada aba"""
     try:
-        gc = get_gs_client()
-        spreadsheet = gc.open_by_key(SPREADSHEET_ID)
+        spreadsheet = get_sheets_client().planilha()
+        cache = get_table_cache()
+        written = {}
+        snapshots = conferir_snapshots(spreadsheet, {
+            key: cache.snapshot(key) for key in dataframes if key in SHEET_NAMES
+        })
         
         for sheet_name, df in dataframes.items():
             if sheet_name not in SHEET_NAMES:
                 continue
                 
+            snapshot = snapshots[sheet_name]
             try:
                 worksheet = spreadsheet.worksheet(SHEET_NAMES[sheet_name])
             except gspread.WorksheetNotFound:
@@ -123,42 +1204,109 @@ def save_data(dataframes):
                     rows=100, 
                     cols=len(df.columns)
                 )  # Fechamento correto dos parênteses aqui
+                snapshot = None
             
-            worksheet.clear()
-            worksheet.update(
-                [df.columns.values.tolist()] + df.fillna('').values.tolist(),
-                value_input_option='USER_ENTERED'
+            requests, written[sheet_name] = plan_table_write(
+                worksheet.id, snapshot, df, TABLE_KEYS.get(sheet_name),
+                grid_rows=worksheet.row_count, grid_cols=worksheet.col_count
             )
+            if requests:
+                spreadsheet.batch_update({'requests': requests})
         
+        # O que foi gravado vira o novo snapshot, sem nova leitura
+        cache.publish(written)
         st.toast("✅ Dados salvos com sucesso!", icon="✅")
         return True
         
     except Exception as e:
+        invalidate_tables([key for key in dataframes if key in SHEET_NAMES])
         st.error(f"❌ Falha ao salvar: {str(e)}")
         return False
 
 # --- SISTEMA DE LOGIN ---
-def check_login(username, password, users_df):
+PREFIXO_HASH = 'pbkdf2_sha256'
+ITERACOES_HASH = 200_000
+
+def gerar_hash_senha(senha):
+    """Hash PBKDF2 com sal aleatório, no formato pbkdf2_sha256$iterações$sal$hash"""
+    sal = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', str(senha).strip().encode(), sal, ITERACOES_HASH)
+    return f"{PREFIXO_HASH}${ITERACOES_HASH}${sal.hex()}${digest.hex()}"
+
+def _senha_confere(protegida, senha, sal):
+    """Compara em tempo constante com o hash armazenado"""
+    if protegida.startswith(PREFIXO_HASH + '$'):
+        _, iteracoes, sal_hex, hash_hex = protegida.split('$')
+        digest = hashlib.pbkdf2_hmac('sha256', senha.encode(), bytes.fromhex(sal_hex), int(iteracoes))
+        return hmac.compare_digest(digest.hex(), hash_hex)
+    return hmac.compare_digest(hashlib.sha256(sal + senha.encode()).hexdigest(), protegida)
+
+class UserIndex:
+    """Usuários indexados pelo username normalizado (sem espaços, minúsculo).
+
+    Senhas em texto puro da planilha são guardadas apenas como SHA-256 com
+    um sal aleatório do índice; senhas já em PBKDF2 são mantidas como estão.
+    """
+
+    def __init__(self, usuarios):
+        self.erro = None
+        self._sal = os.urandom(16)
+        self._usuarios = {}
+        
+        faltantes = [col for col in ['username', 'senha', 'nivel_acesso'] if col not in usuarios.columns]
+        if faltantes:
+            self.erro = f"Colunas obrigatórias não encontradas: {', '.join(faltantes)}"
+            return
+        for username, senha, nivel in zip(usuarios['username'], usuarios['senha'], usuarios['nivel_acesso']):
+            chave = str(username).strip().lower()
+            self._usuarios.setdefault(chave, []).append((username, nivel, self._proteger(senha)))
+
+    def __len__(self):
+        return len(self._usuarios)
+
+    def _proteger(self, senha):
+        senha = str(_cell_value(senha)).strip()
+        if senha.startswith(PREFIXO_HASH + '$'):
+            return senha
+        return hashlib.sha256(self._sal + senha.encode()).hexdigest()
+
+    def verificar(self, username, senha):
+        """Retorna (username, nivel_acesso) se as credenciais conferem, senão None"""
+        for nome, nivel, protegida in self._usuarios.get(username.strip().lower(), []):
+            if _senha_confere(protegida, senha.strip(), self._sal):
+                return nome, nivel
+        return None
+
+def indice_usuarios_planilha():
+    """Índice de usuários da planilha; carrega só a aba de usuários e
+    reconstrói o índice apenas quando ela muda"""
+    usuarios = load_sheet_data(['usuarios'])['usuarios']
+    versao = get_table_cache().stamp('usuarios')
+    return get_index_cache().obter('usuarios_planilha', versao, lambda: UserIndex(usuarios))
+
+def indice_usuarios():
+    """Índice de usuários do snapshot compartilhado, por versão da tabela;
+    antes do login só a aba de usuários é lida"""
+    snapshot = get_table_store().atual(['usuarios'])
+    return get_index_cache().obter('usuarios', snapshot.versoes.get('usuarios', 0), lambda: UserIndex(snapshot['usuarios']))
+
+def check_login(username, password, indice):
     """Valida credenciais com tratamento seguro"""
     try:
-        if users_df.empty:
-            st.warning("Nenhum usuário cadastrado")
+        if indice.erro:
+            st.error("Estrutura inválida na planilha de usuários")
             return False
             
-        required_cols = ['username', 'senha', 'nivel_acesso']
-        if not all(col in users_df.columns for col in required_cols):
-            st.error("Estrutura inválida na planilha de usuários")
+        if not len(indice):
+            st.warning("Nenhum usuário cadastrado")
             return False
             
-        user = users_df[
-            (users_df['username'].str.strip().str.lower() == username.strip().lower()) &
-            (users_df['senha'].astype(str).str.strip() == password.strip())
-        ]
+        user = indice.verificar(username, password)
         
-        if not user.empty:
+        if user:
             st.session_state['user'] = {
-                'name': user.iloc[0]['username'],
-                'level': user.iloc[0]['nivel_acesso']
+                'name': user[0],
+                'level': user[1]
             }
             return True
             
@@ -172,19 +1320,20 @@ def check_login(username, password, users_df):
 # --- INTERFACE ---
 def show_login():
     st.title("🔒 Login do Sistema")
-    _, _, _, _, users_df = load_sheet_data()
+    indice = indice_usuarios_planilha()
     
     with st.form("login_form"):
         username = st.text_input("Usuário")
         password = st.text_input("Senha", type="password")
         
         if st.form_submit_button("Entrar"):
-            if check_login(username, password, users_df):
+            if check_login(username, password, indice):
                 st.rerun()
 
 def main_app():
     st.title(f"📦 Sistema de Inventário - {st.session_state['user']['name']}")
-    mov, prod, resp, uni, _ = load_sheet_data()
+    data = load_sheet_data()
+    prod = data['produtos']
     
     # Sua lógica de inventário aqui
     st.dataframe(prod)
@@ -199,26 +1348,20 @@ if 'user' not in st.session_state:
 else:
     main_app()
 # Função para verificar o login
-def verificar_login(username, senha, usuarios):
+def verificar_login(username, senha, indice):
     try:
         # Verificação mais robusta das colunas
-        required_columns = ['username', 'senha', 'nivel_acesso']
-        missing_columns = [col for col in required_columns if col not in usuarios.columns]
-        
-        if missing_columns:
-            st.error(f"Colunas obrigatórias não encontradas: {', '.join(missing_columns)}")
+        if indice.erro:
+            st.error(indice.erro)
             return None
         
-        # Verificação com tratamento de casos nulos e normalização
-        usuario = usuarios.loc[
-            (usuarios['username'].str.strip().str.lower() == username.strip().lower()) & 
-            (usuarios['senha'].astype(str).str.strip() == senha.strip())
-        ]
+        # Busca O(1) pelo username normalizado
+        usuario = indice.verificar(username, senha)
         
-        if not usuario.empty:
+        if usuario:
             st.session_state['user_authenticated'] = True  # Adiciona estado de autenticação
-            st.session_state['user_level'] = usuario.iloc[0]['nivel_acesso']  # Armazena nível de acesso
-            return usuario.iloc[0]['nivel_acesso']
+            st.session_state['user_level'] = usuario[1]  # Armazena nível de acesso
+            return usuario[1]
         
         st.warning("Credenciais inválidas")  # Feedback mais amigável
         return None
@@ -231,14 +1374,14 @@ def verificar_login(username, senha, usuarios):
 def adicionar_usuario(usuarios, username, senha, nivel_acesso):
     try:
         # Verificar se o username já está em uso
-        if username in usuarios['username'].values:
+        if indice_chave('usuarios', usuarios).contem(username):
             st.error(f"Username {username} já está em uso. Escolha outro username.")
             return usuarios
         
         # Criar novo usuário
         novo_usuario = {
             'username': username,
-            'senha': senha,
+            'senha': gerar_hash_senha(senha),
             'nivel_acesso': nivel_acesso
         }
         usuarios = pd.concat([usuarios, pd.DataFrame([novo_usuario])], ignore_index=True)
@@ -252,14 +1395,18 @@ def adicionar_usuario(usuarios, username, senha, nivel_acesso):
 def editar_usuario(usuarios, username_antigo, username_novo, senha_nova, nivel_acesso_novo):
     try:
         # Verificar se o username novo já está em uso
-        if username_novo != username_antigo and username_novo in usuarios['username'].values:
+        indice = indice_chave('usuarios', usuarios)
+        if username_novo != username_antigo and indice.contem(username_novo):
             st.error(f"Username {username_novo} já está em uso. Escolha outro username.")
             return usuarios
         
-        # Atualizar os dados do usuário
-        usuarios.loc[usuarios['username'] == username_antigo, 'username'] = username_novo
-        usuarios.loc[usuarios['username'] == username_novo, 'senha'] = senha_nova
-        usuarios.loc[usuarios['username'] == username_novo, 'nivel_acesso'] = nivel_acesso_novo
+        # Atualizar os dados do usuário (numa cópia: a tabela é compartilhada)
+        usuarios = usuarios.copy()
+        indice.atualizar(usuarios, username_antigo, {
+            'username': username_novo,
+            'senha': gerar_hash_senha(senha_nova),
+            'nivel_acesso': nivel_acesso_novo
+        })
         st.success("Usuário atualizado com sucesso!")
         return usuarios
     except Exception as e:
@@ -285,10 +1432,12 @@ def adicionar_produto(produtos, nome_produto, id_produto, quantidade_estoque, un
 # Função para editar produto
 def editar_produto(produtos, id_produto, nome_produto, quantidade_estoque, unidade_medida, categoria):
     try:
-        produtos.loc[produtos['ID Produto'] == id_produto, 'Nome do Produto'] = nome_produto
-        produtos.loc[produtos['ID Produto'] == id_produto, 'Quantidade em Estoque'] = quantidade_estoque
-        produtos.loc[produtos['ID Produto'] == id_produto, 'Unidade de Medida'] = unidade_medida
-        produtos.loc[produtos['ID Produto'] == id_produto, 'Categoria'] = categoria
+        indice_chave('produtos', produtos).atualizar(produtos, id_produto, {
+            'Nome do Produto': nome_produto,
+            'Quantidade em Estoque': quantidade_estoque,
+            'Unidade de Medida': unidade_medida,
+            'Categoria': categoria
+        })
         return produtos
     except Exception as e:
         st.error(f"Erro ao editar produto: {e}")
@@ -297,12 +1446,40 @@ def editar_produto(produtos, id_produto, nome_produto, quantidade_estoque, unida
 # Função para excluir produto
 def excluir_produto(produtos, id_produto):
     try:
-        produtos = produtos[produtos['ID Produto'] != id_produto]
-        return produtos
+        return indice_chave('produtos', produtos).excluir(produtos, [id_produto])
     except Exception as e:
         st.error(f"Erro ao excluir produto: {e}")
         return produtos
 
+# Função para adicionar movimentação
+def adicionar_movimentacao(movimentacoes, produtos, responsaveis, unidades, produto_nome, responsavel_nome, unidade_nome, tipo, quantidade, fornecedor, razao, data):
+    """Monta a movimentação; o estoque é ajustado por registrar_movimentacao.
+
+    Retorna o movimento, ou None em caso de erro.
+    """
+    try:
+        produto = produtos[produtos['Nome do Produto'] == produto_nome].iloc[0]
+        responsavel = responsaveis[responsaveis['Nome do Responsável'] == responsavel_nome].iloc[0]
+        unidade = unidades[unidades['Nome da Unidade'] == unidade_nome].iloc[0]
+        
+        novo_id = get_id_allocator().alocar('movimentacoes', movimentacoes)
+        
+        movimento = {
+            'ID Movimentação': novo_id,
+            'ID Produto': produto['ID Produto'],
+            'ID Responsavel': responsavel['ID Responsavel'],
+            'ID Unidade': unidade['ID Unidade'],
+            'Tipo': tipo,
+            'Quantidade': quantidade,
+            'Fornecedor': fornecedor,
+            'Razão': razao,
+            'Data': data
+        }
+        return movimento
+    except Exception as e:
+        st.error(f"Erro ao adicionar movimentação: {e}")
+        return None
+
 # Função para o menu de navegação
 def menu():
     if st.button("..."):
@@ -320,6 +1497,9 @@ def menu():
             if st.button("Usuários"):
                 st.session_state['pagina'] = 'usuarios'
                 st.session_state['menu_aberto'] = False
+            if st.button("Importar"):
+                st.session_state['pagina'] = 'importacao'
+                st.session_state['menu_aberto'] = False
         if st.session_state['nivel_acesso'] in ["Gerente", "Operador"]:
             if st.button("Histórico"):
                 st.session_state['pagina'] = 'historico'
@@ -335,14 +1515,63 @@ def menu():
             st.session_state['pagina'] = 'principal'
             st.rerun()
 
+# Tabela paginada: só a página visível é serializada e enviada ao navegador
+TAMANHOS_PAGINA = [25, 50, 100, 250]
+
+def tabela_paginada(tabela, chave, posicoes=None, colunas=None, column_config=None, filtro=None):
+    """Exibe `tabela` em páginas, com tamanho e página guardados em st.session_state.
+
+    `posicoes` (resultado de filtros/ordenação já feitos no servidor) evita
+    montar o DataFrame filtrado inteiro: só as linhas da página são copiadas.
+    Quando `filtro` muda, volta para a primeira página.
+    """
+    chave_pagina, chave_tamanho, chave_filtro = f'{chave}_pagina', f'{chave}_tamanho', f'{chave}_filtro'
+    total = len(tabela) if posicoes is None else len(posicoes)
+    
+    tamanho = st.session_state.get(chave_tamanho, TAMANHOS_PAGINA[1])
+    paginas = max(1, -(-total // tamanho))
+    if st.session_state.get(chave_filtro) != filtro:
+        st.session_state[chave_filtro] = filtro
+        st.session_state[chave_pagina] = 1
+    # Ajusta antes de criar o widget: o total pode ter diminuído desde a última execução
+    st.session_state[chave_pagina] = min(max(1, st.session_state.get(chave_pagina, 1)), paginas)
+    
+    def mudar_pagina(passo):
+        st.session_state[chave_pagina] = min(max(1, st.session_state[chave_pagina] + passo), paginas)
+    
+    def voltar_ao_inicio():
+        st.session_state[chave_pagina] = 1
+    
+    pagina = st.session_state[chave_pagina]
+    inicio, fim = (pagina - 1) * tamanho, min(pagina * tamanho, total)
+    linhas = posicoes[inicio:fim] if posicoes is not None else slice(inicio, fim)
+    visivel = tabela.iloc[linhas]
+    if colunas is not None:
+        visivel = visivel[colunas]
+    
+    st.dataframe(visivel, use_container_width=True, hide_index=True, column_config=column_config)
+    
+    col1, col2, col3, col4, col5 = st.columns([1, 1, 2, 2, 3])
+    with col1:
+        st.button("◀", key=f'{chave}_anterior', disabled=pagina <= 1, on_click=mudar_pagina, args=(-1,))
+    with col2:
+        st.button("▶", key=f'{chave}_proxima', disabled=pagina >= paginas, on_click=mudar_pagina, args=(1,))
+    with col3:
+        st.number_input("Página", min_value=1, max_value=paginas, step=1, key=chave_pagina)
+    with col4:
+        st.selectbox("Linhas por página", TAMANHOS_PAGINA, key=chave_tamanho,
+                     index=TAMANHOS_PAGINA.index(tamanho), on_change=voltar_ao_inicio)
+    with col5:
+        st.caption(f"Mostrando {inicio + 1 if total else 0}–{fim} de {total} (página {pagina} de {paginas})")
+
 # Página de Login
-def tela_login(usuarios):
+def tela_login(indice):
     st.title("Login")
     username = st.text_input("Username")
     senha = st.text_input("Senha", type="password")
     
     if st.button("Entrar"):
-        nivel_acesso = verificar_login(username, senha, usuarios)
+        nivel_acesso = verificar_login(username, senha, indice)
         if nivel_acesso:
             st.session_state['logado'] = True
             st.session_state['username'] = username
@@ -359,10 +1588,10 @@ def pagina_usuarios(usuarios):
     
     # Exibir lista de usuários (ocultando a senha)
     st.markdown("### Lista de Usuários")
-    st.dataframe(
-        usuarios[['username', 'nivel_acesso']],  # Não exibir a coluna 'senha'
-        use_container_width=True,
-        hide_index=True,
+    tabela_paginada(
+        usuarios,
+        'tabela_usuarios',
+        colunas=['username', 'nivel_acesso'],  # Não exibir a coluna 'senha'
         column_config={
             "username": "Username",
             "nivel_acesso": "Nível de Acesso"
@@ -376,11 +1605,14 @@ def pagina_usuarios(usuarios):
         senha = st.text_input("Senha", type="password")
         nivel_acesso = st.selectbox("Nível de Acesso", ["Gerente", "Operador", "Visualizador"])
         if st.form_submit_button("Adicionar Usuário"):
+            quantidade_antes = len(usuarios)
             usuarios = adicionar_usuario(usuarios, username, senha, nivel_acesso)
-            salvar_planilhas(st.session_state['movimentacoes'], st.session_state['produtos'], st.session_state['responsaveis'], st.session_state['unidades'], usuarios)
-            st.session_state['usuarios'] = usuarios
-            time.sleep(1)  # Delay de 1 segundo
-            st.cache_data.clear()  # Limpar o cache
+            if len(usuarios) > quantidade_antes:
+                try:
+                    salvar_linhas('usuarios', novas=usuarios.iloc[quantidade_antes:])
+                except ConflitoEdicao as e:
+                    st.error(str(e))
+                    return
             st.rerun()  # Recarregar a página
     
     # Formulário para editar usuário
@@ -392,47 +1624,218 @@ def pagina_usuarios(usuarios):
         nivel_acesso_novo = st.selectbox("Novo Nível de Acesso", ["Gerente", "Operador", "Visualizador"])
         if st.form_submit_button("Editar Usuário"):
             usuarios = editar_usuario(usuarios, username_antigo, username_novo, senha_nova, nivel_acesso_novo)
-            salvar_planilhas(st.session_state['movimentacoes'], st.session_state['produtos'], st.session_state['responsaveis'], st.session_state['unidades'], usuarios)
-            st.session_state['usuarios'] = usuarios
-            time.sleep(1)  # Delay de 1 segundo
-            st.cache_data.clear()  # Limpar o cache
+            indice = indice_chave('usuarios', usuarios)
+            if indice.contem(username_novo) and (username_novo == username_antigo or not indice.contem(username_antigo)):
+                try:
+                    salvar_linhas('usuarios', alteradas=indice.linha(usuarios, username_novo), ids=[username_antigo])
+                except ConflitoEdicao as e:
+                    st.error(str(e))
+                    return
             st.rerun()  # Recarregar a página
     
     # Botão para voltar à página principal
     if st.button("Voltar à Página Principal"):
         st.session_state['pagina'] = 'principal'
 
+# Índice de busca de produtos
+def _dobrar(texto):
+    """Minúsculas e sem acentos ('Açúcar' -> 'acucar')"""
+    if texto is None or (isinstance(texto, float) and texto != texto):
+        return ''
+    decomposto = unicodedata.normalize('NFKD', str(texto))
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).lower().strip()
+
+class ProductSearchIndex:
+    """Índice de prefixos de palavras sobre Nome do Produto e Categoria.
+
+    Guarda uma lista ordenada de (palavra, chave, campo): cada termo da
+    busca vira uma busca binária pelo prefixo. A atualização compara com a
+    versão anterior e reindexa só os produtos cujo nome ou categoria mudou.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = {}   # chave -> (nome, categoria, nome dobrado, categoria dobrada)
+        self._palavras = []   # (palavra, chave, campo) ordenado; campo 0 = nome, 1 = categoria
+        self._chaves = pd.Index([])
+
+    @staticmethod
+    def _chaves_de(produtos):
+        if 'ID Produto' in produtos.columns and produtos['ID Produto'].is_unique:
+            return produtos['ID Produto'].astype(str).tolist()
+        return [str(i) for i in range(len(produtos))]
+
+    def copiar(self):
+        """Índice independente com o mesmo conteúdo (as entradas, tuplas, são compartilhadas)"""
+        copia = ProductSearchIndex()
+        with self._lock:
+            copia._entradas = dict(self._entradas)
+            copia._palavras = list(self._palavras)
+            copia._chaves = self._chaves
+        return copia
+
+    def _palavras_de(self, chave, entrada):
+        return [(p, chave, 0) for p in entrada[2].split()] + [(p, chave, 1) for p in entrada[3].split()]
+
+    def _remover(self, chave):
+        for item in self._palavras_de(chave, self._entradas.pop(chave)):
+            i = bisect.bisect_left(self._palavras, item)
+            if i < len(self._palavras) and self._palavras[i] == item:
+                del self._palavras[i]
+
+    def atualizar(self, produtos):
+        """Sincroniza o índice com a tabela; retorna o próprio índice"""
+        chaves = self._chaves_de(produtos)
+        nomes = produtos['Nome do Produto'].tolist() if 'Nome do Produto' in produtos.columns else [''] * len(produtos)
+        categorias = produtos['Categoria'].tolist() if 'Categoria' in produtos.columns else [''] * len(produtos)
+        
+        with self._lock:
+            atuais = set(chaves)
+            removidas = [c for c in self._entradas if c not in atuais]
+            alteradas = [
+                (chave, nome, categoria) for chave, nome, categoria in zip(chaves, nomes, categorias)
+                if self._entradas.get(chave, (None, None))[:2] != (nome, categoria)
+            ]
+            
+            # Poucas mudanças: remove/insere na lista ordenada; muitas: reordena tudo de uma vez
+            incremental = len(removidas) + len(alteradas) <= max(100, len(self._entradas) // 20)
+            for chave in removidas + [c for c, _, _ in alteradas if c in self._entradas]:
+                if incremental:
+                    self._remover(chave)
+                else:
+                    del self._entradas[chave]
+            novas = []
+            for chave, nome, categoria in alteradas:
+                entrada = (nome, categoria, _dobrar(nome), _dobrar(categoria))
+                self._entradas[chave] = entrada
+                novas.extend(self._palavras_de(chave, entrada))
+            if incremental:
+                for item in novas:
+                    bisect.insort(self._palavras, item)
+            else:
+                self._palavras = sorted(
+                    item for chave, entrada in self._entradas.items() for item in self._palavras_de(chave, entrada)
+                )
+            self._chaves = pd.Index(chaves)
+        return self
+
+    def buscar(self, consulta):
+        """Retorna as posições das linhas encontradas, da mais para a menos relevante.
+
+        Relevância: nome igual à busca, nome começando pela busca, todos os
+        termos no nome, termos também na categoria e, se nenhum prefixo de
+        palavra casar, trechos no meio das palavras.
+        """
+        consulta = _dobrar(consulta)
+        termos = consulta.split()
+        with self._lock:
+            if not termos:
+                return np.arange(len(self._chaves))
+            
+            candidatos = None  # chave -> pior campo em que algum termo casou
+            for termo in termos:
+                achados = {}
+                i = bisect.bisect_left(self._palavras, (termo,))
+                while i < len(self._palavras) and self._palavras[i][0].startswith(termo):
+                    _, chave, campo = self._palavras[i]
+                    achados[chave] = min(achados.get(chave, 1), campo)
+                    i += 1
+                if candidatos is None:
+                    candidatos = achados
+                else:
+                    candidatos = {c: max(candidatos[c], achados[c]) for c in candidatos if c in achados}
+                if not candidatos:
+                    break
+            
+            if candidatos:
+                def relevancia(chave):
+                    nome = self._entradas[chave][2]
+                    if nome == consulta:
+                        return (0, nome)
+                    if nome.startswith(consulta):
+                        return (1, nome)
+                    return (2 + candidatos[chave], nome)
+                ordenadas = sorted(candidatos, key=relevancia)
+            else:
+                ordenadas = sorted(
+                    (c for c, e in self._entradas.items() if consulta in e[2] or consulta in e[3]),
+                    key=lambda c: self._entradas[c][2]
+                )
+            return self._chaves.get_indexer(ordenadas)
+
+def indice_busca_produtos(produtos):
+    """Índice de busca compartilhado: um por versão da tabela de produtos,
+    derivado de uma cópia do anterior"""
+    return get_index_cache().obter(
+        'busca_produtos', versao_tabela('produtos'),
+        lambda: ProductSearchIndex().atualizar(produtos),
+        lambda anterior: anterior.copiar().atualizar(produtos)
+    )
+
+# Ordenações pré-calculadas da listagem de produtos
+ORDENACOES_PRODUTOS = ["Nome (A-Z)", "Nome (Z-A)", "Quantidade (Menor para Maior)", "Quantidade (Maior para Menor)"]
+
+def _colacao(texto):
+    """Chave de ordenação para nomes em português: primeiro sem acento e sem
+    caixa ('água' junto de 'agua', antes de 'b'), depois o texto original
+    para desempatar de forma estável"""
+    return (_dobrar(texto), '' if texto is None or texto != texto else str(texto))
+
+def _calcular_ordenacao(produtos, opcao):
+    """Permutação de posições (np.ndarray) que ordena a tabela pela opção"""
+    if opcao in ("Nome (A-Z)", "Nome (Z-A)"):
+        nomes = produtos['Nome do Produto'].tolist()
+        chaves = [_colacao(nome) for nome in nomes]
+        ordem = np.array(sorted(range(len(chaves)), key=chaves.__getitem__), dtype=np.intp)
+        return ordem if opcao == "Nome (A-Z)" else ordem[::-1].copy()
+    quantidades = pd.to_numeric(produtos['Quantidade em Estoque'], errors='coerce').astype('float64').to_numpy()
+    if opcao == "Quantidade (Maior para Menor)":
+        quantidades = -quantidades
+    return np.argsort(quantidades, kind='stable')  # valores inválidos (NaN) ficam no fim
+
+def ordenacao_produtos(produtos, opcao):
+    """Permutação cacheada por versão da tabela de produtos; mudar a opção ou
+    pesquisar não reordena a tabela"""
+    ordem = get_index_cache().obter(
+        f'ordem_produtos:{opcao}', versao_tabela('produtos'),
+        lambda: _calcular_ordenacao(produtos, opcao)
+    )
+    if len(ordem) != len(produtos):
+        # Tabela da sessão fora de sincronia com a versão: ordena só desta vez
+        ordem = _calcular_ordenacao(produtos, opcao)
+    return ordem
+
 # Página Principal
 def pagina_principal(produtos, movimentacoes, responsaveis, unidades):
     st.title("Inventário de Produtos")
     menu()  # Adicionar o menu aqui
     
+    todos_produtos = produtos
+    
     # Campo de pesquisa
     pesquisa = st.text_input("Pesquisar Produto", "")
     
     # Filtros de ordenação
-    ordenar_por = st.selectbox("Ordenar por", ["Nome (A-Z)", "Nome (Z-A)", "Quantidade (Menor para Maior)", "Quantidade (Maior para Menor)"])
+    ordenar_por = st.selectbox("Ordenar por", ORDENACOES_PRODUTOS + ["Relevância"])
     
-    # Aplicar ordenação
-    if ordenar_por == "Nome (A-Z)":
-        produtos = produtos.sort_values(by="Nome do Produto", ascending=True)
-    elif ordenar_por == "Nome (Z-A)":
-        produtos = produtos.sort_values(by="Nome do Produto", ascending=False)
-    elif ordenar_por == "Quantidade (Menor para Maior)":
-        produtos = produtos.sort_values(by="Quantidade em Estoque", ascending=True)
-    elif ordenar_por == "Quantidade (Maior para Menor)":
-        produtos = produtos.sort_values(by="Quantidade em Estoque", ascending=False)
-    
-    # Filtrar por pesquisa
-    if pesquisa:
-        produtos = produtos[produtos['Nome do Produto'].str.contains(pesquisa, case=False)]
+    # Pesquisa e ordenação viram seleção de posições sobre permutações já calculadas
+    encontrados = indice_busca_produtos(produtos).buscar(pesquisa) if pesquisa else None
+    if ordenar_por == "Relevância":
+        posicoes = encontrados if encontrados is not None else np.arange(len(produtos))
+    else:
+        posicoes = ordenacao_produtos(produtos, ordenar_por)
+        if encontrados is not None:
+            selecionados = np.zeros(len(produtos), dtype=bool)
+            selecionados[encontrados] = True
+            posicoes = posicoes[selecionados[posicoes]]
     
-    # Exibir lista de produtos de forma fluida e sem bordas
+    # Exibir lista de produtos de forma fluida e sem bordas (só a página visível)
     st.markdown("### Lista de Produtos")
-    st.dataframe(
+    tabela_paginada(
         produtos,
-        use_container_width=True,  # Ajusta a largura ao contêiner
-        hide_index=True,  # Remove o índice
+        'tabela_produtos',
+        posicoes=posicoes,
+        filtro=(pesquisa, ordenar_por),
         column_config={
             "ID Produto": "ID Produto",  # Mostra o ID do Produto
             "Nome do Produto": "Produto",
@@ -441,6 +1844,26 @@ def pagina_principal(produtos, movimentacoes, responsaveis, unidades):
             "Categoria": "Categoria"
         }
     )
+    
+    # Conferência do estoque armazenado com o saldo das movimentações
+    if st.session_state.get('nivel_acesso') == "Gerente":
+        with st.expander("Conferir estoque com as movimentações"):
+            # O corpo do expander roda a cada execução, mesmo fechado: a conferência só sob demanda
+            if st.button("Conferir", key="btn_conferir_estoque"):
+                divergentes = get_stock_ledger().verificar(todos_produtos, movimentacoes)
+                if divergentes.empty:
+                    st.success("Estoque consistente com as movimentações.")
+                else:
+                    st.warning(f"{len(divergentes)} produto(s) com estoque diferente do saldo das movimentações.")
+                    st.dataframe(divergentes, use_container_width=True, hide_index=True)
+        
+        if st.button("Preparar exportação (.xlsx)"):
+            st.download_button(
+                "⬇️ Baixar inventário",
+                data=exportar_inventario_xlsx(),
+                file_name="inventario.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
 
 # Página de Movimentação
 def pagina_movimentacao(movimentacoes, produtos, responsaveis, unidades):
@@ -475,24 +1898,20 @@ def pagina_movimentacao(movimentacoes, produtos, responsaveis, unidades):
         
         # Botão para salvar
         if st.form_submit_button("Salvar Movimentação"):
-            movimentacoes, produtos = adicionar_movimentacao(movimentacoes, produtos, responsaveis, unidades, produto_nome, responsavel_nome, unidade_nome, tipo, quantidade, fornecedor, razao, data)
-            salvar_planilhas(movimentacoes, produtos, responsaveis, unidades, st.session_state['usuarios'])
+            movimento = adicionar_movimentacao(movimentacoes, produtos, responsaveis, unidades, produto_nome, responsavel_nome, unidade_nome, tipo, quantidade, fornecedor, razao, data)
+            if movimento is None:
+                return
             
-            # Recarregar as planilhas após salvar
-            movimentacoes, produtos, responsaveis, unidades, usuarios = carregar_planilhas()
-            
-            # Atualizar o estado da aplicação
-            st.session_state['movimentacoes'] = movimentacoes
-            st.session_state['produtos'] = produtos
-            st.session_state['responsaveis'] = responsaveis
-            st.session_state['unidades'] = unidades
-            st.session_state['usuarios'] = usuarios
+            # Só o diário e a linha do produto mudam: custo constante, independente do histórico
+            try:
+                saldo = registrar_movimentacao(movimento)
+            except (EstoqueInsuficiente, KeyError, ValueError) as e:
+                st.error(f"Erro ao adicionar movimentação: {e}")
+                return
             
-            st.success("Movimentação salva com sucesso!")
+            # Exibida por main() depois do rerun; um st.success aqui sumiria com ele
+            st.session_state['mensagem_sucesso'] = f"Movimentação salva com sucesso! Estoque de {produto_nome}: {saldo}"
             
-                       # Limpar o cache antes de recarregar a página
-            time.sleep(1)  # Delay de 1 segundo
-            st.cache_data.clear()
             st.session_state['pagina'] = 'principal'  # Redirecionar para a tela inicial
             st.rerun()  # Forçar atualização da página
     
@@ -505,28 +1924,6 @@ import pandas as pd
 import streamlit as st
 import time
 
-def gerar_novo_id(produtos):
-    """Gera um novo ID automaticamente baseado no maior ID existente + 1, evitando conflitos"""
-    if produtos.empty:
-        return 1
-    
-    # Garante que estamos trabalhando com números inteiros
-    ids_existentes = pd.to_numeric(produtos['ID Produto'], errors='coerce').dropna()
-    
-    if ids_existentes.empty:
-        return 1
-    
-    max_id = int(ids_existentes.max())
-    
-    # Verifica se há algum número faltante na sequência
-    todos_ids = set(range(1, max_id + 1))
-    ids_atuais = set(ids_existentes.astype(int))
-    ids_disponiveis = todos_ids - ids_atuais
-    
-    if ids_disponiveis:
-        return min(ids_disponiveis)
-    return max_id + 1
-
 def pagina_editar(movimentacoes, produtos, responsaveis, unidades):
     st.title("Editar Cadastro de Produtos")
     menu()  # Adicionar o menu aqui
@@ -538,9 +1935,8 @@ def pagina_editar(movimentacoes, produtos, responsaveis, unidades):
         with st.form("form_adicionar", clear_on_submit=True):
             st.markdown("### Adicionar Novo Produto")
             
-            # Gerar novo ID automaticamente (garantindo que não haja conflitos)
-            novo_id = gerar_novo_id(produtos)
-            st.write(f"**ID do Produto atribuído automaticamente:** {novo_id}")
+            # O ID só é reservado ao salvar; outra sessão pode usar o previsto antes
+            st.write(f"**ID do Produto atribuído automaticamente:** {get_id_allocator().proximo('produtos', produtos)}")
             
             col1, col2 = st.columns(2)
             
@@ -572,12 +1968,12 @@ def pagina_editar(movimentacoes, produtos, responsaveis, unidades):
                     st.error("Erro: O nome do produto é obrigatório.")
                 else:
                     # Verificar se o nome do produto já existe
-                    if nome_produto in produtos['Nome do Produto'].values:
+                    if indice_chave('produtos', produtos, por=['Nome do Produto']).existe('Nome do Produto', nome_produto):
                         st.error("Erro: Já existe um produto com este nome.")
                     else:
                         # Adicionar o novo produto
                         novo_produto = {
-                            'ID Produto': novo_id,
+                            'ID Produto': get_id_allocator().alocar('produtos', produtos),
                             'Nome do Produto': nome_produto,
                             'Quantidade em Estoque': quantidade_estoque,
                             'Unidade de Medida': unidade_medida,
@@ -585,11 +1981,9 @@ def pagina_editar(movimentacoes, produtos, responsaveis, unidades):
                         }
                         
                         produtos = pd.concat([produtos, pd.DataFrame([novo_produto])], ignore_index=True)
-                        salvar_planilhas(movimentacoes, produtos, responsaveis, unidades, st.session_state['usuarios'])
+                        salvar_linhas('produtos', novas=pd.DataFrame([novo_produto]))
                         
                         st.success("Produto adicionado com sucesso!")
-                        time.sleep(1.5)
-                        st.cache_data.clear()
                         st.rerun()
 
     elif acao == "Editar":
@@ -602,7 +1996,8 @@ def pagina_editar(movimentacoes, produtos, responsaveis, unidades):
                                             help="Selecione o produto que deseja editar")
             
             # Obter os dados atuais do produto selecionado
-            produto_info = produtos[produtos['Nome do Produto'] == produto_selecionado].iloc[0]
+            indice = indice_chave('produtos', produtos, por=['Nome do Produto'])
+            produto_info = indice.linha(produtos, indice.chaves('Nome do Produto', produto_selecionado)[0]).iloc[0]
             
             col1, col2 = st.columns(2)
             
@@ -649,21 +2044,24 @@ def pagina_editar(movimentacoes, produtos, responsaveis, unidades):
                 else:
                     # Verificar se o novo nome já existe (exceto para o próprio produto)
                     if (novo_nome != produto_selecionado and 
-                        novo_nome in produtos['Nome do Produto'].values):
+                        indice.existe('Nome do Produto', novo_nome)):
                         st.error("Erro: Já existe outro produto com este nome.")
                     else:
-                        # Atualizar os dados do produto
-                        produtos.loc[produtos['ID Produto'] == produto_info['ID Produto'], 'Nome do Produto'] = novo_nome
-                        produtos.loc[produtos['ID Produto'] == produto_info['ID Produto'], 'Quantidade em Estoque'] = nova_quantidade
-                        produtos.loc[produtos['ID Produto'] == produto_info['ID Produto'], 'Unidade de Medida'] = nova_unidade
-                        produtos.loc[produtos['ID Produto'] == produto_info['ID Produto'], 'Categoria'] = nova_categoria
+                        # Atualizar os dados do produto (pela chave, sem varrer a tabela)
+                        alterada = indice.atualizar(produtos.copy(), produto_info['ID Produto'], {
+                            'Nome do Produto': novo_nome,
+                            'Quantidade em Estoque': nova_quantidade,
+                            'Unidade de Medida': nova_unidade,
+                            'Categoria': nova_categoria
+                        })
                         
-                        salvar_planilhas(movimentacoes, produtos, responsaveis, unidades, st.session_state['usuarios'])
-                        
-                        st.success("Produto atualizado com sucesso!")
-                        time.sleep(1.5)
-                        st.cache_data.clear()
-                        st.rerun()
+                        try:
+                            salvar_linhas('produtos', alteradas=alterada)
+                        except ConflitoEdicao as e:
+                            st.error(str(e))
+                        else:
+                            st.success("Produto atualizado com sucesso!")
+                            st.rerun()
 
     elif acao == "Excluir":
         with st.form("form_excluir", clear_on_submit=True):
@@ -675,7 +2073,8 @@ def pagina_editar(movimentacoes, produtos, responsaveis, unidades):
                                              help="Selecione o produto que deseja excluir")
             
             # Obter informações do produto
-            produto_info = produtos[produtos['Nome do Produto'] == produto_selecionado].iloc[0]
+            indice = indice_chave('produtos', produtos, por=['Nome do Produto'])
+            produto_info = indice.linha(produtos, indice.chaves('Nome do Produto', produto_selecionado)[0]).iloc[0]
             id_produto = produto_info['ID Produto']
             
             # Verificar se há movimentações associadas
@@ -701,21 +2100,27 @@ def pagina_editar(movimentacoes, produtos, responsaveis, unidades):
             if submitted and confirmacao:
                 try:
                     # Excluir o produto
-                    produtos = produtos[produtos['ID Produto'] != id_produto]
+                    produtos = indice.excluir(produtos, [id_produto])
                     
                     # Tratar movimentações - sempre substituir por 'DESCONHECIDO'
+                    afetadas = movimentacoes['ID Produto'] == id_produto
                     if tem_movimentacoes:
+                        movimentacoes = movimentacoes.copy()
+                        movimentacoes['ID Produto'] = movimentacoes['ID Produto'].astype(object)  # coluna inteira recebe texto
                         movimentacoes.loc[movimentacoes['ID Produto'] == id_produto, 'ID Produto'] = 'DESCONHECIDO'
                         movimentacoes.loc[movimentacoes['ID Produto'] == id_produto, 'Nome do Produto'] = 'PRODUTO DESCONHECIDO'
                     
-                    salvar_planilhas(movimentacoes, produtos, responsaveis, unidades, st.session_state['usuarios'])
+                    salvar_linhas('produtos', excluidas=[id_produto])
+                    if tem_movimentacoes:
+                        if TABLE_KEYS['movimentacoes'] in movimentacoes.columns:
+                            salvar_linhas('movimentacoes', alteradas=movimentacoes[afetadas])
+                        else:
+                            salvar_linhas('movimentacoes', tabela=movimentacoes)
                     
                     st.success("Produto excluído com sucesso!")
                     if tem_movimentacoes:
                         st.info("As movimentações foram mantidas com o produto marcado como 'DESCONHECIDO'.")
                     
-                    time.sleep(1.5)
-                    st.cache_data.clear()
                     st.rerun()
                     
                 except Exception as e:
@@ -726,7 +2131,260 @@ def pagina_editar(movimentacoes, produtos, responsaveis, unidades):
     # Botão para voltar à página principal (única instância)
     if st.button("⏎ Voltar à Página Principal"):
         st.session_state['pagina'] = 'principal'
-# Página de Histórico
+# Histórico materializado
+class DateIndex:
+    """Posições de linhas ordenadas por data, particionadas por mês.
+
+    Um período vira busca binária (searchsorted) nos meses das pontas e
+    fatias inteiras nos meses do meio. Linhas novas só reordenam os meses
+    em que caem. As partições são substituídas, nunca alteradas, para que
+    cópias (`copiar`) possam ser compartilhadas entre sessões.
+    """
+
+    def __init__(self):
+        self.meses = {}   # mês (meses desde 1970) -> (datas ordenadas, posições)
+        self._ordem = []  # meses presentes, ordenados
+
+    def copiar(self):
+        copia = DateIndex()
+        copia.meses, copia._ordem = dict(self.meses), list(self._ordem)
+        return copia
+
+    def adicionar(self, datas, posicoes):
+        """Inclui linhas (datas datetime64[ns] e posições); datas vazias (NaT) ficam de fora"""
+        validas = ~np.isnat(datas)
+        datas, posicoes = datas[validas], posicoes[validas]
+        ordem = np.argsort(datas, kind='stable')
+        datas, posicoes = datas[ordem], posicoes[ordem]
+        meses = datas.astype('datetime64[M]').astype(np.int64)
+        cortes = np.flatnonzero(np.diff(meses)) + 1
+        for inicio, fim in zip(np.r_[0, cortes], np.r_[cortes, len(datas)]):
+            if inicio == fim:
+                continue
+            mes = int(meses[inicio])
+            novas_datas, novas_posicoes = datas[inicio:fim], posicoes[inicio:fim]
+            if mes in self.meses:
+                antigas_datas, antigas_posicoes = self.meses[mes]
+                novas_datas = np.concatenate([antigas_datas, novas_datas])
+                novas_posicoes = np.concatenate([antigas_posicoes, novas_posicoes])
+                ordem = np.argsort(novas_datas, kind='stable')
+                novas_datas, novas_posicoes = novas_datas[ordem], novas_posicoes[ordem]
+            else:
+                bisect.insort(self._ordem, mes)
+            self.meses[mes] = (novas_datas, novas_posicoes)
+        return self
+
+    def intervalo(self):
+        """(menor data, maior data) ou None se não houver datas"""
+        if not self._ordem:
+            return None
+        return self.meses[self._ordem[0]][0][0], self.meses[self._ordem[-1]][0][-1]
+
+    def posicoes(self, data_inicio, data_fim):
+        """Posições com data entre os dois dias (inclusive), em ordem de data"""
+        inicio = np.datetime64(data_inicio, 'D').astype('datetime64[ns]')
+        fim = (np.datetime64(data_fim, 'D') + 1).astype('datetime64[ns]')  # exclusivo
+        primeiro = bisect.bisect_left(self._ordem, int(inicio.astype('datetime64[M]').astype(np.int64)))
+        ultimo = bisect.bisect_right(self._ordem, int((fim - 1).astype('datetime64[M]').astype(np.int64)))
+        partes = []
+        for mes in self._ordem[primeiro:ultimo]:
+            datas, posicoes = self.meses[mes]
+            a = np.searchsorted(datas, inicio, side='left') if datas[0] < inicio else 0
+            b = np.searchsorted(datas, fim, side='left') if datas[-1] >= fim else len(datas)
+            partes.append(posicoes[a:b])
+        return np.concatenate(partes) if partes else np.empty(0, dtype=np.intp)
+
+FONTES_HISTORICO = ('movimentacoes', 'produtos', 'responsaveis', 'unidades')
+COLUNAS_NOMES_HISTORICO = ['Nome do Produto', 'Nome do Responsável', 'Nome da Unidade']
+COLUNAS_JUNCAO_HISTORICO = {
+    'produtos': ['ID Produto', 'Nome do Produto'],
+    'responsaveis': ['ID Responsavel', 'Nome do Responsável'],
+    'unidades': ['ID Unidade', 'Nome da Unidade'],
+}
+
+def _versao_juncao(key, df):
+    """Versão de uma tabela de nomes do ponto de vista do histórico: só as
+    colunas unidas contam (o estoque de produtos muda a cada movimento, os
+    nomes não)"""
+    colunas = [c for c in COLUNAS_JUNCAO_HISTORICO[key] if c in df.columns]
+    impressao = _fingerprint(df[colunas])
+    return impressao if impressao is not None else ('versao', versao_tabela(key))
+
+class HistoryView:
+    """Movimentações já unidas a produtos, responsáveis e unidades, com a
+    coluna Data convertida e os nomes como categorias.
+
+    Quando só chegam movimentações novas (as antigas continuam iguais, na
+    mesma ordem), apenas as linhas novas são unidas e anexadas.
+    """
+
+    def __init__(self, versoes, movimentacoes, produtos, responsaveis, unidades):
+        self.versoes = versoes
+        self._produtos = produtos[COLUNAS_JUNCAO_HISTORICO['produtos']]
+        self._responsaveis = responsaveis[COLUNAS_JUNCAO_HISTORICO['responsaveis']]
+        self._unidades = unidades[COLUNAS_JUNCAO_HISTORICO['unidades']]
+        self._ids = self._ids_de(movimentacoes)
+        self._colunas = list(movimentacoes.columns)
+        tabela = self._juntar(movimentacoes)
+        for coluna in COLUNAS_NOMES_HISTORICO:
+            tabela[coluna] = tabela[coluna].astype('category')
+        self.tabela = tabela
+        self.datas = DateIndex()
+        self.por_unidade = {}  # nome da unidade -> DateIndex só com as linhas dela
+        self._indexar(tabela, 0, self.por_unidade)
+
+    def _indexar(self, linhas, deslocamento, por_unidade):
+        """Inclui `linhas` (posições a partir de `deslocamento`) nos índices de data e de unidade"""
+        datas = linhas['Data'].to_numpy(dtype='datetime64[ns]')
+        posicoes = np.arange(deslocamento, deslocamento + len(linhas), dtype=np.intp)
+        self.datas.adicionar(datas, posicoes)
+        
+        unidade = linhas['Nome da Unidade']
+        codigos = unidade.cat.codes.to_numpy()
+        nomes = [str(nome) for nome in unidade.cat.categories]
+        ordem = np.argsort(codigos, kind='stable')
+        cortes = np.flatnonzero(np.diff(codigos[ordem])) + 1
+        for grupo in np.split(ordem, cortes):
+            if not len(grupo):
+                continue
+            codigo = codigos[grupo[0]]
+            nome = nomes[codigo] if codigo >= 0 else 'nan'  # mesmo rótulo de astype(str) para vazios
+            indice = por_unidade[nome].copiar() if nome in por_unidade else DateIndex()
+            por_unidade[nome] = indice.adicionar(datas[grupo], posicoes[grupo])
+
+    @staticmethod
+    def _ids_de(movimentacoes):
+        coluna = 'ID Movimentação' if 'ID Movimentação' in movimentacoes.columns else movimentacoes.columns[0]
+        return movimentacoes[coluna].to_numpy(dtype=object)
+
+    def _juntar(self, movimentacoes):
+        juntado = movimentacoes.merge(
+            self._produtos, on='ID Produto', how='left'
+        ).merge(
+            self._responsaveis, on='ID Responsavel', how='left'
+        ).merge(
+            self._unidades, on='ID Unidade', how='left'
+        )
+        if not pd.api.types.is_datetime64_any_dtype(juntado['Data']):
+            juntado['Data'] = _ler_datas(juntado['Data'])
+        return juntado
+
+    def atualizar(self, versoes, movimentacoes, produtos, responsaveis, unidades):
+        """Retorna a visão para as novas versões: anexando as movimentações
+        novas quando possível, ou reconstruindo"""
+        n = len(self._ids)
+        ids = self._ids_de(movimentacoes)
+        so_anexos = (
+            versoes[1:] == self.versoes[1:]
+            and len(ids) >= n
+            and list(movimentacoes.columns) == self._colunas
+            and np.array_equal(ids[:n], self._ids)
+        )
+        if not so_anexos:
+            return HistoryView(versoes, movimentacoes, produtos, responsaveis, unidades)
+        
+        novas = self._juntar(movimentacoes.iloc[n:])
+        tabela = self.tabela
+        if len(novas):
+            tabela = tabela.copy(deep=False)
+            for coluna in COLUNAS_NOMES_HISTORICO:
+                categorias = tabela[coluna].cat.categories
+                faltando = pd.Index(novas[coluna].dropna().unique()).difference(categorias)
+                if len(faltando):
+                    tabela[coluna] = tabela[coluna].cat.add_categories(faltando)
+                novas[coluna] = pd.Categorical(novas[coluna], categories=tabela[coluna].cat.categories)
+            tabela = pd.concat([tabela, novas[tabela.columns]], ignore_index=True)
+        
+        vista = HistoryView.__new__(HistoryView)
+        vista.__dict__.update(self.__dict__)
+        vista.versoes, vista._ids, vista.tabela = versoes, ids, tabela
+        vista.datas, vista.por_unidade = self.datas.copiar(), dict(self.por_unidade)
+        if len(novas):
+            vista._indexar(tabela.iloc[n:], n, vista.por_unidade)
+        return vista
+
+def historico_materializado(movimentacoes, produtos, responsaveis, unidades):
+    """Histórico compartilhado, cacheado pela versão das movimentações e pelo
+    conteúdo das colunas unidas das outras três tabelas"""
+    versoes = (versao_tabela('movimentacoes'),) + tuple(
+        _versao_juncao(key, df) for key, df in zip(FONTES_HISTORICO[1:], (produtos, responsaveis, unidades)))
+    return get_index_cache().obter(
+        'historico', versoes,
+        lambda: HistoryView(versoes, movimentacoes, produtos, responsaveis, unidades),
+        lambda anterior: anterior.atualizar(versoes, movimentacoes, produtos, responsaveis, unidades)
+    )
+
+# Exportação do histórico filtrado
+TAMANHO_BLOCO_EXPORTACAO = 50_000  # linhas montadas por vez
+PASTA_EXPORTACOES = os.path.join(tempfile.gettempdir(), 'inventario_exportacoes')
+VALIDADE_EXPORTACAO = 3600  # segundos até um arquivo gerado ser apagado
+
+def blocos_historico(tabela, posicoes, colunas, tamanho=TAMANHO_BLOCO_EXPORTACAO):
+    """Gera o histórico filtrado em blocos, direto da visão materializada"""
+    for inicio in range(0, len(posicoes), tamanho):
+        yield tabela.iloc[posicoes[inicio:inicio + tamanho]][colunas]
+
+def _coluna_texto(serie):
+    return not (pd.api.types.is_numeric_dtype(serie.dtype) or pd.api.types.is_datetime64_any_dtype(serie.dtype)) \
+        or isinstance(serie.dtype, pd.CategoricalDtype)
+
+def limpar_exportacoes(validade=VALIDADE_EXPORTACAO):
+    """Apaga os arquivos exportados há mais de `validade` segundos.
+
+    Sessões encerradas (aba fechada, servidor reiniciado) não removem o
+    próprio arquivo; a varredura roda a cada nova exportação.
+    """
+    limite = time.time() - validade
+    try:
+        nomes = os.listdir(PASTA_EXPORTACOES)
+    except FileNotFoundError:
+        return
+    for nome in nomes:
+        caminho = os.path.join(PASTA_EXPORTACOES, nome)
+        try:
+            if os.path.getmtime(caminho) < limite:
+                os.remove(caminho)
+        except OSError:
+            pass  # já removido por outra sessão
+
+def exportar_historico(tabela, posicoes, colunas, formato):
+    """Grava o histórico filtrado num arquivo temporário, bloco a bloco.
+
+    A geração usa a memória de um bloco, nunca a do histórico filtrado
+    inteiro. O download não: o st.download_button lê o arquivo todo e o
+    Streamlit guarda os bytes enquanto o botão estiver na tela. Retorna o
+    caminho do arquivo (CSV ou Parquet).
+    """
+    limpar_exportacoes()
+    os.makedirs(PASTA_EXPORTACOES, exist_ok=True)
+    descritor, caminho = tempfile.mkstemp(prefix='historico_', suffix=f'.{formato}', dir=PASTA_EXPORTACOES)
+    os.close(descritor)
+    blocos = blocos_historico(tabela, posicoes, colunas)
+    
+    if formato == 'csv':
+        with open(caminho, 'w', encoding='utf-8-sig', newline='') as f:
+            tabela.iloc[:0][colunas].to_csv(f, index=False)
+            for bloco in blocos:
+                bloco.to_csv(f, index=False, header=False)
+        return caminho
+    
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    texto = [c for c in colunas if _coluna_texto(tabela[c])]
+    # Esquema fixo: colunas de texto como string, para que blocos só com vazios não mudem o tipo;
+    # as demais seguem o pandas (inclusive Int64/Int32 com vazios, que o numpy não representa)
+    schema = pa.Schema.from_pandas(tabela.iloc[:0][colunas], preserve_index=False)
+    for c in texto:
+        schema = schema.set(schema.get_field_index(c), pa.field(c, pa.string()))
+    with pq.ParquetWriter(caminho, schema) as writer:
+        for bloco in blocos:
+            bloco = bloco.copy()
+            for c in texto:
+                bloco[c] = bloco[c].astype(str).astype(object).where(bloco[c].notna(), None)
+            writer.write_table(pa.Table.from_pandas(bloco, schema=schema, preserve_index=False))
+    return caminho
+
+# Página de Histórico
 def pagina_historico(movimentacoes, produtos, responsaveis, unidades):
     st.title("Histórico de Movimentações")
     menu()  # Adicionar o menu aqui
@@ -736,20 +2394,9 @@ def pagina_historico(movimentacoes, produtos, responsaveis, unidades):
         st.error("A coluna 'ID Responsavel' não foi encontrada na planilha 'responsaveis'.")
         return
     
-    # Mesclar dados para exibir nomes em vez de IDs
-    historico_completo = movimentacoes.merge(
-        produtos[['ID Produto', 'Nome do Produto']],
-        on='ID Produto',
-        how='left'
-    ).merge(
-        responsaveis[['ID Responsavel', 'Nome do Responsável']],
-        on='ID Responsavel',
-        how='left'
-    ).merge(
-        unidades[['ID Unidade', 'Nome da Unidade']],
-        on='ID Unidade',
-        how='left'
-    )
+    # Histórico já unido (nomes em vez de IDs) e com datas convertidas; não alterar
+    historico = historico_materializado(movimentacoes, produtos, responsaveis, unidades)
+    historico_completo = historico.tabela
     
     # Verificar se as colunas esperadas existem após o merge
     colunas_esperadas = ['Nome do Produto', 'Nome do Responsável', 'Nome da Unidade', 'Tipo', 'Quantidade', 'Fornecedor', 'Razão', 'Data']
@@ -758,16 +2405,12 @@ def pagina_historico(movimentacoes, produtos, responsaveis, unidades):
     # Apenas incluir colunas que existem no DataFrame
     colunas_para_exibir = [col for col in colunas_esperadas if col in colunas_disponiveis]
     
-    # Converter coluna de Data para datetime se não estiver no formato correto
-    if not pd.api.types.is_datetime64_any_dtype(historico_completo['Data']):
-        historico_completo['Data'] = pd.to_datetime(historico_completo['Data'], errors='coerce')
-    
     # Filtros
     st.subheader("Filtros")
     
-    # Filtro por Unidade - Corrigindo o erro de tipos mistos
+    # Filtro por Unidade (nomes vêm do índice por unidade)
     unidades_disponiveis = ['Todas'] + sorted(
-        historico_completo['Nome da Unidade'].astype(str).unique().tolist(),
+        historico.por_unidade,
         key=lambda x: x.lower()  # Ordena case-insensitive
     )
     
@@ -778,42 +2421,38 @@ def pagina_historico(movimentacoes, produtos, responsaveis, unidades):
     )
     
     # Filtro por Período
+    intervalo = historico.datas.intervalo()
+    if intervalo is None:
+        st.info("Nenhuma movimentação com data registrada.")
+        return
+    data_min, data_max = (pd.Timestamp(d).date() for d in intervalo)
     col1, col2 = st.columns(2)
     with col1:
         data_inicio = st.date_input(
             "Data de início:",
-            value=historico_completo['Data'].min().date(),
-            min_value=historico_completo['Data'].min().date(),
-            max_value=historico_completo['Data'].max().date()
+            value=data_min,
+            min_value=data_min,
+            max_value=data_max
         )
     with col2:
         data_fim = st.date_input(
             "Data de fim:",
-            value=historico_completo['Data'].max().date(),
-            min_value=historico_completo['Data'].min().date(),
-            max_value=historico_completo['Data'].max().date()
+            value=data_max,
+            min_value=data_min,
+            max_value=data_max
         )
     
-    # Aplicar filtros
-    historico_filtrado = historico_completo.copy()
+    # Aplicar filtros: busca binária no índice de datas (da unidade, se escolhida)
+    indice_datas = historico.datas if unidade_selecionada == 'Todas' else historico.por_unidade[unidade_selecionada]
+    posicoes = indice_datas.posicoes(data_inicio, data_fim)
     
-    # Filtrar por unidade
-    if unidade_selecionada != 'Todas':
-        historico_filtrado = historico_filtrado[
-            historico_filtrado['Nome da Unidade'].astype(str) == unidade_selecionada
-        ]
-    
-    # Filtrar por período
-    historico_filtrado = historico_filtrado[
-        (historico_filtrado['Data'].dt.date >= data_inicio) & 
-        (historico_filtrado['Data'].dt.date <= data_fim)
-    ]
-    
-    # Exibir o histórico de movimentações filtrado
-    st.dataframe(
-        historico_filtrado[colunas_para_exibir],
-        use_container_width=True,
-        hide_index=True,
+    # Exibir o histórico de movimentações filtrado (só a página visível é montada)
+    tabela_paginada(
+        historico_completo,
+        'tabela_historico',
+        posicoes=posicoes,
+        colunas=colunas_para_exibir,
+        filtro=(unidade_selecionada, data_inicio, data_fim),
         column_config={
             "Nome do Produto": "Produto",
             "Nome do Responsável": "Responsável",
@@ -826,6 +2465,32 @@ def pagina_historico(movimentacoes, produtos, responsaveis, unidades):
         }
     )
     
+    # Exportação do resultado filtrado (gerada em blocos, sem copiar o histórico)
+    with st.expander("Exportar histórico filtrado"):
+        formato = st.radio("Formato", ["CSV", "Parquet"], horizontal=True, key="formato_exportacao_historico")
+        if st.button("Preparar exportação"):
+            anterior = st.session_state.pop('exportacao_historico', None)
+            if anterior and os.path.exists(anterior[0]):
+                os.remove(anterior[0])
+            colunas = [c for c in ['ID Movimentação'] + colunas_para_exibir if c in colunas_disponiveis]
+            with st.spinner("Gerando arquivo..."):
+                caminho = exportar_historico(historico_completo, posicoes, colunas, formato.lower())
+            st.session_state['exportacao_historico'] = (caminho, formato)
+        
+        exportacao = st.session_state.get('exportacao_historico')
+        if exportacao and os.path.exists(exportacao[0]):
+            caminho, formato_gerado = exportacao
+            # O arquivo inteiro vai para a memória do servidor ao montar o botão
+            st.caption(f"Arquivo de {os.path.getsize(caminho) / 2 ** 20:.1f} MB; "
+                       f"disponível por {VALIDADE_EXPORTACAO // 60} minutos.")
+            with open(caminho, 'rb') as f:
+                st.download_button(
+                    f"Baixar histórico ({formato_gerado})",
+                    data=f,
+                    file_name=f"historico_movimentacoes.{formato_gerado.lower()}",
+                    mime="text/csv" if formato_gerado == "CSV" else "application/vnd.apache.parquet"
+                )
+    
     # Botão para voltar à página principal
     if st.button("Voltar à Página Principal"):
         st.session_state['pagina'] = 'principal'
@@ -835,16 +2500,9 @@ def pagina_responsaveis_unidades(responsaveis, unidades):
     st.title("📋 Responsáveis e Unidades")
     menu()  # Adicionar o menu aqui
 
-    # Função para gerar o próximo ID disponível
-    def proximo_id(df, coluna_id):
-        if df.empty:
-            return 1
-        else:
-            return df[coluna_id].max() + 1
-
     # Função para adicionar responsável
     def adicionar_responsavel(responsaveis, nome_responsavel, id_unidade, cargo, telefone):
-        novo_id = proximo_id(responsaveis, 'ID Responsavel')
+        novo_id = get_id_allocator().alocar('responsaveis', responsaveis)
         novo_responsavel = {
             'ID Responsavel': novo_id,
             'Nome do Responsável': nome_responsavel,
@@ -856,20 +2514,25 @@ def pagina_responsaveis_unidades(responsaveis, unidades):
 
     # Função para editar responsável
     def editar_responsavel(responsaveis, nome_antigo, nome_novo, id_unidade, cargo, telefone):
-        mask = responsaveis['Nome do Responsável'] == nome_antigo
-        responsaveis.loc[mask, 'Nome do Responsável'] = nome_novo
-        responsaveis.loc[mask, 'ID Unidade'] = id_unidade
-        responsaveis.loc[mask, 'Cargo'] = cargo
-        responsaveis.loc[mask, 'Telefone'] = telefone
+        indice = indice_chave('responsaveis', responsaveis, por=['Nome do Responsável'])
+        responsaveis = responsaveis.copy()
+        for chave in indice.chaves('Nome do Responsável', nome_antigo):
+            indice.atualizar(responsaveis, chave, {
+                'Nome do Responsável': nome_novo,
+                'ID Unidade': id_unidade,
+                'Cargo': cargo,
+                'Telefone': telefone
+            })
         return responsaveis
 
     # Função para excluir responsável
     def excluir_responsavel(responsaveis, nome_responsavel):
-        return responsaveis[responsaveis['Nome do Responsável'] != nome_responsavel]
+        indice = indice_chave('responsaveis', responsaveis, por=['Nome do Responsável'])
+        return indice.excluir(responsaveis, indice.chaves('Nome do Responsável', nome_responsavel))
 
     # Função para adicionar unidade
     def adicionar_unidade(unidades, nome_unidade, endereco, cidade, estado):
-        novo_id = proximo_id(unidades, 'ID Unidade')
+        novo_id = get_id_allocator().alocar('unidades', unidades)
         nova_unidade = {
             'ID Unidade': novo_id,
             'Nome da Unidade': nome_unidade,
@@ -881,16 +2544,21 @@ def pagina_responsaveis_unidades(responsaveis, unidades):
 
     # Função para editar unidade
     def editar_unidade(unidades, nome_antigo, nome_novo, endereco, cidade, estado):
-        mask = unidades['Nome da Unidade'] == nome_antigo
-        unidades.loc[mask, 'Nome da Unidade'] = nome_novo
-        unidades.loc[mask, 'Endereço'] = endereco
-        unidades.loc[mask, 'Cidade'] = cidade
-        unidades.loc[mask, 'Estado'] = estado
+        indice = indice_chave('unidades', unidades, por=['Nome da Unidade'])
+        unidades = unidades.copy()
+        for chave in indice.chaves('Nome da Unidade', nome_antigo):
+            indice.atualizar(unidades, chave, {
+                'Nome da Unidade': nome_novo,
+                'Endereço': endereco,
+                'Cidade': cidade,
+                'Estado': estado
+            })
         return unidades
 
     # Função para excluir unidade
     def excluir_unidade(unidades, nome_unidade):
-        return unidades[unidades['Nome da Unidade'] != nome_unidade]
+        indice = indice_chave('unidades', unidades, por=['Nome da Unidade'])
+        return indice.excluir(unidades, indice.chaves('Nome da Unidade', nome_unidade))
 
     # --- SEÇÃO DE RESPONSÁVEIS ---
     st.markdown("## 👥 Responsáveis")
@@ -925,12 +2593,9 @@ def pagina_responsaveis_unidades(responsaveis, unidades):
             if st.form_submit_button("💾 Salvar Responsável"):
                 try:
                     responsaveis = adicionar_responsavel(responsaveis, nome, id_unidade, cargo, telefone)
-                    st.session_state['responsaveis'] = responsaveis
-                    salvar_planilhas(st.session_state['movimentacoes'], st.session_state['produtos'], 
-                                    responsaveis, st.session_state['unidades'], st.session_state['usuarios'])
+                    salvar_linhas('responsaveis', novas=responsaveis.tail(1))
                     st.success("✅ Responsável adicionado com sucesso!")
                     st.session_state['mostrar_adicionar_responsavel'] = False
-                    st.cache_data.clear()
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ Erro: {str(e)}")
@@ -948,13 +2613,12 @@ def pagina_responsaveis_unidades(responsaveis, unidades):
             
             if st.form_submit_button("💾 Salvar Alterações"):
                 try:
+                    indice = indice_chave('responsaveis', responsaveis, por=['Nome do Responsável'])
+                    ids = indice.chaves('Nome do Responsável', nome_antigo)
                     responsaveis = editar_responsavel(responsaveis, nome_antigo, novo_nome, id_unidade, cargo, telefone)
-                    st.session_state['responsaveis'] = responsaveis
-                    salvar_planilhas(st.session_state['movimentacoes'], st.session_state['produtos'], 
-                                    responsaveis, st.session_state['unidades'], st.session_state['usuarios'])
+                    salvar_linhas('responsaveis', alteradas=responsaveis.iloc[[indice.posicao(chave) for chave in ids]])
                     st.success("✅ Responsável atualizado com sucesso!")
                     st.session_state['mostrar_editar_responsavel'] = False
-                    st.cache_data.clear()
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ Erro: {str(e)}")
@@ -968,22 +2632,19 @@ def pagina_responsaveis_unidades(responsaveis, unidades):
             
             if st.form_submit_button("❌ Confirmar Exclusão"):
                 try:
+                    ids = indice_chave('responsaveis', responsaveis, por=['Nome do Responsável']).chaves('Nome do Responsável', nome)
                     responsaveis = excluir_responsavel(responsaveis, nome)
-                    st.session_state['responsaveis'] = responsaveis
-                    salvar_planilhas(st.session_state['movimentacoes'], st.session_state['produtos'], 
-                                    responsaveis, st.session_state['unidades'], st.session_state['usuarios'])
+                    salvar_linhas('responsaveis', excluidas=ids)
                     st.success("✅ Responsável removido com sucesso!")
                     st.session_state['mostrar_excluir_responsavel'] = False
-                    st.cache_data.clear()
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ Erro: {str(e)}")
 
     # Tabela de responsáveis
-    st.dataframe(
+    tabela_paginada(
         responsaveis,
-        use_container_width=True,
-        hide_index=True,
+        'tabela_responsaveis',
         column_config={
             "ID Responsavel": st.column_config.NumberColumn("ID"),
             "Nome do Responsável": "Responsável",
@@ -1026,12 +2687,9 @@ def pagina_responsaveis_unidades(responsaveis, unidades):
             if st.form_submit_button("💾 Salvar Unidade"):
                 try:
                     unidades = adicionar_unidade(unidades, nome, endereco, cidade, estado)
-                    st.session_state['unidades'] = unidades
-                    salvar_planilhas(st.session_state['movimentacoes'], st.session_state['produtos'], 
-                                   st.session_state['responsaveis'], unidades, st.session_state['usuarios'])
+                    salvar_linhas('unidades', novas=unidades.tail(1))
                     st.success("✅ Unidade adicionada com sucesso!")
                     st.session_state['mostrar_adicionar_unidade'] = False
-                    st.cache_data.clear()
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ Erro: {str(e)}")
@@ -1049,13 +2707,12 @@ def pagina_responsaveis_unidades(responsaveis, unidades):
             
             if st.form_submit_button("💾 Salvar Alterações"):
                 try:
+                    indice = indice_chave('unidades', unidades, por=['Nome da Unidade'])
+                    ids = indice.chaves('Nome da Unidade', nome_antigo)
                     unidades = editar_unidade(unidades, nome_antigo, novo_nome, endereco, cidade, estado)
-                    st.session_state['unidades'] = unidades
-                    salvar_planilhas(st.session_state['movimentacoes'], st.session_state['produtos'], 
-                                   st.session_state['responsaveis'], unidades, st.session_state['usuarios'])
+                    salvar_linhas('unidades', alteradas=unidades.iloc[[indice.posicao(chave) for chave in ids]])
                     st.success("✅ Unidade atualizada com sucesso!")
                     st.session_state['mostrar_editar_unidade'] = False
-                    st.cache_data.clear()
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ Erro: {str(e)}")
@@ -1069,22 +2726,19 @@ def pagina_responsaveis_unidades(responsaveis, unidades):
             
             if st.form_submit_button("❌ Confirmar Exclusão"):
                 try:
+                    ids = indice_chave('unidades', unidades, por=['Nome da Unidade']).chaves('Nome da Unidade', nome)
                     unidades = excluir_unidade(unidades, nome)
-                    st.session_state['unidades'] = unidades
-                    salvar_planilhas(st.session_state['movimentacoes'], st.session_state['produtos'], 
-                                   st.session_state['responsaveis'], unidades, st.session_state['usuarios'])
+                    salvar_linhas('unidades', excluidas=ids)
                     st.success("✅ Unidade removida com sucesso!")
                     st.session_state['mostrar_excluir_unidade'] = False
-                    st.cache_data.clear()
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ Erro: {str(e)}")
 
     # Tabela de unidades
-    st.dataframe(
+    tabela_paginada(
         unidades,
-        use_container_width=True,
-        hide_index=True,
+        'tabela_unidades',
         column_config={
             "ID Unidade": st.column_config.NumberColumn("ID"),
             "Nome da Unidade": "Unidade",
@@ -1097,11 +2751,55 @@ def pagina_responsaveis_unidades(responsaveis, unidades):
     # Botão de voltar
     if st.button("← Voltar à Página Principal", key="btn_voltar_principal_rpu"):
         st.session_state['pagina'] = 'principal'
+
+# Página de Importação em Lote
+def pagina_importacao(movimentacoes, produtos, responsaveis, unidades):
+    st.title("Importação em Lote")
+    menu()  # Adicionar o menu aqui
+    
+    tipo = st.radio("Importar:", ["Produtos", "Movimentações"], horizontal=True)
+    key = 'produtos' if tipo == "Produtos" else 'movimentacoes'
+    st.caption(
+        f"Colunas: {', '.join(COLUNAS_IMPORTACAO[key])}. "
+        f"Obrigatórias: {', '.join(OBRIGATORIAS_IMPORTACAO[key])}. "
+        "Produto, Responsável e Unidade podem ser o nome ou o ID."
+    )
+    
+    arquivo = st.file_uploader("Arquivo CSV ou XLSX", type=['csv', 'xlsx'])
+    if arquivo is not None and st.button("Importar arquivo"):
+        try:
+            importacao = ImportacaoLote(key, produtos, responsaveis, unidades)
+            progresso = st.empty()
+            for bloco in ler_em_blocos(arquivo, arquivo.name):
+                importacao.processar(bloco)
+                progresso.caption(f"{importacao.linhas_lidas} linhas validadas...")
+            
+            movimentacoes, produtos = importacao.concluir(movimentacoes, produtos)
+            st.session_state['importacao_rejeitadas'] = importacao.relatorio()
+            
+            rejeitadas = importacao.linhas_lidas - importacao.total_aceitas
+            st.success(f"{importacao.total_aceitas} linha(s) importada(s), {rejeitadas} rejeitada(s).")
+        except Exception as e:
+            st.error(f"Erro ao importar arquivo: {str(e)}")
+    
+    # Relatório da última importação
+    rejeitadas = st.session_state.get('importacao_rejeitadas')
+    if rejeitadas is not None and not rejeitadas.empty:
+        st.markdown("### Linhas Rejeitadas")
+        tabela_paginada(rejeitadas, 'tabela_rejeitadas')
+        st.download_button(
+            "Baixar relatório (.csv)",
+            data=rejeitadas.to_csv(index=False).encode('utf-8-sig'),
+            file_name="importacao_rejeitadas.csv",
+            mime="text/csv"
+        )
+    
+    # Botão para voltar à página principal
+    if st.button("Voltar à Página Principal"):
+        st.session_state['pagina'] = 'principal'
+
 # Função principal
 def main():
-    # Carregar planilhas
-    movimentacoes, produtos, responsaveis, unidades, usuarios = carregar_planilhas()
-    
     # Inicializar estado da página
     if 'pagina' not in st.session_state:
         st.session_state['pagina'] = 'principal'
@@ -1116,48 +2814,2047 @@ def main():
     if 'nivel_acesso' not in st.session_state:
         st.session_state['nivel_acesso'] = None
     
-    # Inicializar estado das planilhas
-    if 'movimentacoes' not in st.session_state:
-        st.session_state['movimentacoes'] = movimentacoes
-    if 'produtos' not in st.session_state:
-        st.session_state['produtos'] = produtos
-    if 'responsaveis' not in st.session_state:
-        st.session_state['responsaveis'] = responsaveis
-    if 'unidades' not in st.session_state:
-        st.session_state['unidades'] = unidades
-    if 'usuarios' not in st.session_state:
-        st.session_state['usuarios'] = usuarios
-    
-    # Verificar se o usuário está logado
+    # Na tela de login só os usuários são carregados (pelo índice)
     if not st.session_state['logado']:
-        tela_login(usuarios)
-    else:
-        # Navegação entre páginas
-        if st.session_state['pagina'] == 'principal':
-            pagina_principal(produtos, movimentacoes, responsaveis, unidades)
-        elif st.session_state['pagina'] == 'movimentacao':
-            pagina_movimentacao(movimentacoes, produtos, responsaveis, unidades)
-        elif st.session_state['pagina'] == 'editar':
-            pagina_editar(movimentacoes, produtos, responsaveis, unidades)
-        elif st.session_state['pagina'] == 'responsaveis_unidades':
-            pagina_responsaveis_unidades(responsaveis, unidades)
-        elif st.session_state['pagina'] == 'historico':
-            pagina_historico(movimentacoes, produtos, responsaveis, unidades)
-        elif st.session_state['pagina'] == 'usuarios':
-            pagina_usuarios(usuarios)
+        tela_login(indice_usuarios())
+        return
+    
+    # Snapshot compartilhado desta execução (a sessão guarda só a versão)
+    snapshot = tabelas_sessao()
+    movimentacoes, produtos, responsaveis, unidades, usuarios = (snapshot[key] for key in SHEET_NAMES)
+    
+    mostrar_status_gravacao()
+    mostrar_status_replica()
+    mostrar_metricas_sheets()
+    mostrar_memoria_tabelas(snapshot)
+    
+    # Mensagem deixada por uma página antes do st.rerun()
+    mensagem = st.session_state.pop('mensagem_sucesso', None)
+    if mensagem:
+        st.success(mensagem)
+    
+    # Navegação entre páginas
+    if st.session_state['pagina'] == 'principal':
+        pagina_principal(produtos, movimentacoes, responsaveis, unidades)
+    elif st.session_state['pagina'] == 'movimentacao':
+        pagina_movimentacao(movimentacoes, produtos, responsaveis, unidades)
+    elif st.session_state['pagina'] == 'editar':
+        pagina_editar(movimentacoes, produtos, responsaveis, unidades)
+    elif st.session_state['pagina'] == 'responsaveis_unidades':
+        pagina_responsaveis_unidades(responsaveis, unidades)
+    elif st.session_state['pagina'] == 'historico':
+        pagina_historico(movimentacoes, produtos, responsaveis, unidades)
+    elif st.session_state['pagina'] == 'usuarios':
+        pagina_usuarios(usuarios)
+    elif st.session_state['pagina'] == 'importacao':
+        pagina_importacao(movimentacoes, produtos, responsaveis, unidades)
 
-# Função para salvar as planilhas
-def salvar_planilhas(movimentacoes, produtos, responsaveis, unidades, usuarios):
+# --- DIÁRIO DE MOVIMENTAÇÕES ---
+ARQUIVO_INVENTARIO = 'inventario.xlsx'
+ARQUIVO_JOURNAL = 'movimentacoes.journal.jsonl'
+JOURNAL_COMPACTAR_A_CADA = 500  # entradas
+
+def _delta_estoque(tipo, quantidade):
+    return quantidade if tipo == 'Entrada' else -quantidade
+
+class MovementJournal:
+    """Diário append-only das movimentações (uma linha JSON por movimento).
+
+    Gravar um movimento é um append no fim do arquivo, com custo constante.
+    A compactação incorpora o diário à aba 'movimentacoes' e o esvazia.
+    """
+
+    def __init__(self, path=ARQUIVO_JOURNAL):
+        self.path = path
+        self._lock = threading.Lock()
+        self._count = None
+
+    def append(self, movimento):
+        self.estender([movimento])
+
+    def estender(self, movimentos):
+        """Grava vários movimentos com uma só escrita (e um só fsync)"""
+        lines = ''.join(
+            json.dumps({k: _cell_value(v) for k, v in movimento.items()}, ensure_ascii=False, default=str) + '\n'
+            for movimento in movimentos
+        )
+        with self._lock:
+            # A contagem é lida sob o lock: um truncate da fila não pode cair no meio
+            size = self._contar()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self._count = size + len(movimentos)
+
+    def _ler(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as f:
+            # Uma última linha incompleta (queda no meio da escrita) é ignorada
+            entries = []
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+            return entries
+
+    def _contar(self):
+        """Entradas no arquivo; chamar com o lock"""
+        if self._count is None:
+            self._count = len(self._ler())
+        return self._count
+
+    def read(self):
+        """Retorna as entradas pendentes, na ordem em que foram gravadas"""
+        with self._lock:
+            return self._ler()
+
+    def __len__(self):
+        with self._lock:
+            return self._contar()
+
+    def truncate(self, count):
+        """Remove as primeiras `count` entradas, preservando as gravadas depois"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, encoding='utf-8') as f:
+                restantes = f.readlines()[count:]
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(restantes)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._count = len(restantes)
+
+@st.cache_resource
+def get_movement_journal():
+    """Diário único, compartilhado por todas as sessões"""
+    return MovementJournal()
+
+def aplicar_journal(movimentacoes, produtos, entradas):
+    """Acrescenta as entradas do diário e aplica seus efeitos no estoque.
+
+    Entradas cujo ID já está na aba (compactação interrompida antes de
+    esvaziar o diário) são ignoradas, para não contar o movimento duas vezes.
+    """
+    if not entradas:
+        return movimentacoes, produtos
+    pendentes = pd.DataFrame(entradas)
+    if 'ID Movimentação' in movimentacoes.columns:
+        # Texto em colunas object: o hash é bem mais rápido que o de strings Arrow
+        ja_gravados = movimentacoes['ID Movimentação'].astype(str).astype(object)
+        pendentes = pendentes[~pendentes['ID Movimentação'].astype(str).astype(object).isin(ja_gravados)]
+    if pendentes.empty:
+        return movimentacoes, produtos
+    
+    if 'Data' in pendentes.columns:
+        pendentes['Data'] = _ler_datas(pendentes['Data'])
+    movimentacoes = pd.concat([movimentacoes, pendentes], ignore_index=True)
+    
+    if not produtos.empty:
+        deltas = pendentes['Quantidade'].where(pendentes['Tipo'] == 'Entrada', -pendentes['Quantidade'])
+        deltas = deltas.groupby(pendentes['ID Produto'].astype(str)).sum()
+        produtos = produtos.copy()
+        chave = produtos['ID Produto'].astype(str)
+        delta = chave.map(deltas)
+        estoque = produtos['Quantidade em Estoque']
+        # Estoque em branco conta como zero nos produtos movimentados, como em registrar_movimentacao
+        estoque = estoque.mask(delta.notna() & estoque.isna(), 0) + delta.fillna(0)
+        if estoque.notna().all() and (estoque % 1 == 0).all():
+            estoque = estoque.astype('int64')
+        produtos['Quantidade em Estoque'] = estoque
+    return movimentacoes, produtos
+
+class EstoqueInsuficiente(ValueError):
+    """Saída maior que o saldo atual do produto"""
+
+def _posicao_produto(produtos, id_produto):
+    ids = produtos['ID Produto']
+    posicoes = np.flatnonzero((ids == id_produto).to_numpy(dtype=bool, na_value=False))
+    if not len(posicoes):
+        # IDs guardados como texto (ou o contrário)
+        posicoes = np.flatnonzero((ids.astype(str).astype(object) == str(id_produto)).to_numpy())
+    return int(posicoes[0]) if len(posicoes) else None
+
+def _estoque_atual(produtos, posicao, id_produto):
+    """Estoque armazenado do produto; em branco conta como zero"""
+    estoque = produtos['Quantidade em Estoque'].iat[posicao]
+    if _vazios(pd.Series([estoque], dtype=object)).iat[0]:
+        return 0
+    if isinstance(estoque, str):
+        raise ValueError(f"Estoque do produto {id_produto} não é numérico: {estoque!r}")
+    return estoque
+
+def _ajustar_estoque(produtos, saldos):
+    """Cópia de produtos com só o estoque das linhas em saldos (posição -> saldo) alterado"""
+    produtos = produtos.copy()
+    if pd.api.types.is_integer_dtype(produtos['Quantidade em Estoque'].dtype) and any(s % 1 != 0 for s in saldos.values()):
+        produtos['Quantidade em Estoque'] = produtos['Quantidade em Estoque'].astype('float64')
+    coluna = produtos.columns.get_loc('Quantidade em Estoque')
+    for posicao, saldo in saldos.items():
+        produtos.iat[posicao, coluna] = saldo
+    return produtos
+
+def _anexar_movimentos(movimentacoes, linhas):
+    if 'Data' in linhas.columns:
+        linhas = linhas.assign(Data=_ler_datas(linhas['Data']))
+    return _anexar_linhas(movimentacoes, linhas)
+
+def _agendar_compactacao(journal):
+    # A compactação roda na thread da fila, nunca na requisição de quem registrou.
+    # O diário fica no disco deste servidor (possivelmente efêmero) e outros
+    # processos não o leem: com a planilha, cada movimento segue pela fila
+    if not get_storage_backend().local or len(journal) >= JOURNAL_COMPACTAR_A_CADA:
+        get_write_queue().pedir_compactacao()
+
+def registrar_movimentacao(movimento):
+    """Ajusta o estoque do produto e grava o movimento no diário, atomicamente.
+
+    Como um UPDATE ... WHERE estoque >= quantidade: sob o lock do armazém,
+    a saída só é aceita se o saldo mais recente (de todas as sessões) a
+    cobre; só a linha do produto muda. Retorna o novo saldo; levanta
+    EstoqueInsuficiente, KeyError (produto inexistente) ou ValueError
+    (estoque armazenado não numérico). Estoque em branco conta como zero.
+    """
+    journal = get_movement_journal()
+    store = get_table_store()
+    delta = _delta_estoque(movimento['Tipo'], movimento['Quantidade'])
+    with store.lock:
+        produtos = store.atual()['produtos']
+        posicao = _posicao_produto(produtos, movimento['ID Produto']) if 'ID Produto' in produtos.columns else None
+        if posicao is None:
+            raise KeyError(f"Produto {movimento['ID Produto']} não encontrado")
+        saldo = _estoque_atual(produtos, posicao, movimento['ID Produto']) + delta
+        if delta < 0 and saldo < 0:
+            raise EstoqueInsuficiente(
+                f"Estoque insuficiente: saldo {saldo - delta}, saída de {movimento['Quantidade']}"
+            )
+        journal.append(movimento)
+        # Movimentos só somam ao estoque: mesclam com qualquer outra escrita
+        store.alterar(lambda snapshot: {
+            'movimentacoes': _anexar_movimentos(snapshot['movimentacoes'], pd.DataFrame([movimento])),
+            'produtos': _ajustar_estoque(produtos, {posicao: saldo})
+        }, {'movimentacoes': {str(movimento['ID Movimentação'])}, 'produtos': {str(movimento['ID Produto'])}})
+    _agendar_compactacao(journal)
+    return saldo
+
+def registrar_movimentacoes(novas):
+    """registrar_movimentacao em lote (importação), com as mesmas garantias.
+
+    Sob o lock do armazém, cada saída é conferida na ordem de `novas` contra
+    o saldo mais recente somado às linhas anteriores do lote; as aceitas vão
+    ao diário numa só escrita e movimentos e estoque são publicados juntos.
+    Retorna o motivo de cada linha recusada (índice de `novas`; None nas aceitas).
+    """
+    journal = get_movement_journal()
+    store = get_table_store()
+    motivos, saldos, posicoes, ilegiveis = {}, {}, {}, {}
+    with store.lock:
+        produtos = store.atual()['produtos']
+        for i, id_produto, tipo, quantidade in zip(novas.index, novas['ID Produto'], novas['Tipo'], novas['Quantidade']):
+            if id_produto not in posicoes:
+                posicoes[id_produto] = _posicao_produto(produtos, id_produto) if 'ID Produto' in produtos.columns else None
+                if posicoes[id_produto] is not None:
+                    try:
+                        saldos[id_produto] = _estoque_atual(produtos, posicoes[id_produto], id_produto)
+                    except ValueError as e:
+                        posicoes[id_produto], ilegiveis[id_produto] = None, str(e)
+            if posicoes[id_produto] is None:
+                # Excluído durante a importação, ou estoque ilegível
+                motivos[i] = ilegiveis.get(id_produto, "Produto não encontrado")
+                continue
+            delta = _delta_estoque(tipo, quantidade)
+            if delta < 0 and saldos[id_produto] + delta < 0:
+                motivos[i] = f"Estoque insuficiente: saldo {saldos[id_produto]}, saída de {quantidade}"
+                continue
+            saldos[id_produto] += delta
+        
+        motivo = pd.Series([motivos.get(i) for i in novas.index], index=novas.index, dtype=object)
+        aceitas = novas[motivo.isna()]
+        if aceitas.empty:
+            return motivo
+        journal.estender(aceitas.to_dict('records'))
+        movidos = set(aceitas['ID Produto'])
+        store.alterar(lambda snapshot: {
+            'movimentacoes': _anexar_movimentos(snapshot['movimentacoes'], aceitas.reset_index(drop=True)),
+            'produtos': _ajustar_estoque(produtos, {posicoes[p]: saldos[p] for p in movidos})
+        }, {'movimentacoes': set(aceitas['ID Movimentação'].astype(str)), 'produtos': {str(p) for p in movidos}})
+    _agendar_compactacao(journal)
+    return motivo
+
+def compactar_journal(journal=None):
+    """Incorpora o diário ao inventário e remove as entradas incorporadas.
+
+    Deve ser chamada com o lock_gravacao da fila: assim nenhuma recarga lê o
+    backend antes da gravação e o diário depois de truncado. Levanta a
+    exceção do backend se a gravação falhar; o diário fica intacto.
+    """
+    journal = journal or get_movement_journal()
+    entradas = journal.read()
+    if not entradas:
+        return
+    backend = get_storage_backend()
+    tabelas = backend.load_tables(['movimentacoes', 'produtos'])
+    movimentacoes, produtos = aplicar_journal(tabelas['movimentacoes'], tabelas['produtos'], entradas)
+    # Só as duas tabelas afetadas, numa única gravação
+    backend.save_tables({'movimentacoes': movimentacoes, 'produtos': produtos})
+    journal.truncate(len(entradas))
+
+def _carregar_tabelas(keys):
+    """Lê as tabelas do backend com a fila de gravação, o diário e o esquema"""
+    keys = set(keys)
+    if keys & {'movimentacoes', 'produtos'}:
+        keys |= {'movimentacoes', 'produtos'}  # o diário altera as duas
+    fila = get_write_queue()
+    # Backend, fila e diário lidos sem gravação no meio: uma operação gravada
+    # ou compactada entre as leituras apareceria duas vezes (ou nenhuma)
+    with fila.lock_gravacao:
+        tabelas = fila.aplicar_pendentes(get_storage_backend().load_tables(sorted(keys)))
+        entradas = get_movement_journal().read() if 'movimentacoes' in keys else []
+    tabelas = {key: tabelas.get(key, pd.DataFrame()) for key in keys}
+    if 'movimentacoes' in keys:
+        tabelas['movimentacoes'], tabelas['produtos'] = aplicar_journal(
+            tabelas['movimentacoes'], tabelas['produtos'], entradas)
+    return tipar_tabelas(tabelas)
+
+def _ler_xlsx(caminho=ARQUIVO_INVENTARIO):
+    try:
+        return pd.read_excel(caminho, sheet_name=None, engine='openpyxl')
+    except FileNotFoundError:
+        return {}
+
+def exportar_xlsx(tables, destino=ARQUIVO_INVENTARIO):
+    """Exporta as tabelas para um arquivo .xlsx legível por pessoas"""
+    with pd.ExcelWriter(destino, engine='openpyxl') as writer:
+        for key, df in tables.items():
+            df.to_excel(writer, sheet_name=SHEET_NAMES.get(key, key), index=False)
+    return destino
+
+# --- SNAPSHOT COLUNAR ---
+PASTA_SNAPSHOT = 'inventario_snapshot'
+
+def _para_arrow(df):
+    """Prepara o DataFrame para o Arrow: índice simples e sem colunas de tipos mistos"""
+    df = df.reset_index(drop=True)
+    df.columns = [str(col) for col in df.columns]
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) in ('mixed', 'mixed-integer'):
+            # Ex.: IDs numéricos misturados com 'DESCONHECIDO'
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+def _fingerprint(df):
+    """Impressão digital do conteúdo, usada para pular tabelas sem alteração"""
+    try:
+        valores = int(pd.util.hash_pandas_object(df, index=False).sum())
+    except TypeError:
+        return None
+    return (tuple(map(str, df.columns)), tuple(map(str, df.dtypes)), len(df), valores)
+
+def _mesmo_conteudo(a, b):
+    impressao = _fingerprint(a)
+    return impressao is not None and impressao == _fingerprint(b)
+
+class SnapshotStore:
+    """Uma tabela por arquivo Feather (Arrow IPC), com tipos preservados.
+
+    A leitura é feita por memory-map; a gravação reescreve apenas as tabelas
+    cujo conteúdo mudou desde a última leitura ou gravação.
+    """
+
+    def __init__(self, pasta=PASTA_SNAPSHOT):
+        self.pasta = pasta
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+
+    def _path(self, key):
+        return os.path.join(self.pasta, f'{key}.feather')
+
+    def load(self, keys=None):
+        import pyarrow.feather as feather
+        
+        keys = list(SHEET_NAMES) if keys is None else list(keys)
+        if not os.path.isdir(self.pasta) and os.path.exists(ARQUIVO_INVENTARIO):
+            # Primeira execução: importa o inventario.xlsx existente
+            self.save(_ler_xlsx())
+        
+        data = {}
+        with self._lock:
+            for key in keys:
+                path = self._path(key)
+                if not os.path.exists(path):
+                    data[key] = pd.DataFrame()
+                    continue
+                data[key] = feather.read_table(path, memory_map=True).to_pandas()
+                self._fingerprints[key] = _fingerprint(data[key])
+        return data
+
+    def save(self, tables):
+        """Grava as tabelas alteradas e retorna a lista das que foram escritas"""
+        import pyarrow.feather as feather
+        
+        os.makedirs(self.pasta, exist_ok=True)
+        written = []
+        with self._lock:
+            for key, df in tables.items():
+                df = _para_arrow(df)
+                fingerprint = _fingerprint(df)
+                if fingerprint is not None and self._fingerprints.get(key) == fingerprint:
+                    continue
+                path = self._path(key)
+                tmp_path = path + '.tmp'
+                # Sem compressão, para que a leitura por memory-map não copie os dados
+                feather.write_feather(df, tmp_path, compression='uncompressed')
+                os.replace(tmp_path, path)
+                self._fingerprints[key] = fingerprint
+                written.append(key)
+        return written
+
+def exportar_inventario_xlsx():
+    """Gera o inventário atual como .xlsx em memória, para download"""
+    movimentacoes, produtos, responsaveis, unidades, usuarios = carregar_planilhas()
+    tables = dict(zip(SHEET_NAMES, (movimentacoes, produtos, responsaveis, unidades, usuarios)))
+    return exportar_xlsx(tables, io.BytesIO()).getvalue()
+
+# --- BACKENDS DE ARMAZENAMENTO ---
+# 'xlsx' (inventario.xlsx), 'feather' (snapshot colunar), 'sqlite'
+# (inventario.db, indexado e transacional), 'sheets' (Google Sheets) ou
+# 'replica' (réplica SQLite local sincronizada com o Google Sheets)
+STORAGE_BACKEND = st.secrets.get("STORAGE_BACKEND", "xlsx")
+ARQUIVO_SQLITE = 'inventario.db'
+ARQUIVO_REPLICA = 'replica.db'
+
+def _coluna_chave(key, df):
+    coluna = TABLE_KEYS.get(key)
+    if coluna is None or coluna not in df.columns:
+        raise KeyError(f"Tabela '{key}' sem a coluna chave '{coluna}'")
+    return coluna
+
+def _atualizar_por_chave(df, key, rows, ids=None):
+    """Copia os valores de rows para as linhas de df com as chaves em ids"""
+    coluna = _coluna_chave(key, rows)
+    ids = rows[coluna].tolist() if ids is None else list(ids)
+    df = df.copy()
+    for col in rows.columns:
+        if col not in df.columns:
+            df[col] = None
+        if df[col].dtype != rows[col].dtype:
+            df[col] = df[col].astype(object)
+    
+    posicoes = {str(v): i for i, v in enumerate(df[coluna])}
+    destino = [df.columns.get_loc(col) for col in rows.columns]
+    for id_, valores in zip(ids, rows.itertuples(index=False, name=None)):
+        pos = posicoes.get(str(id_))
+        if pos is None:
+            continue
+        for col, valor in zip(destino, valores):
+            df.iat[pos, col] = valor
+    return df
+
+def _anexar_linhas(df, linhas):
+    """Concatena linhas a df mantendo as categorias e larguras inteiras de df
+    quando os novos valores cabem nelas (a tabela não precisa ser retipada)"""
+    linhas = linhas.copy()
+    for coluna in linhas.columns.intersection(df.columns):
+        tipo = df[coluna].dtype
+        if linhas[coluna].dtype == tipo:
+            continue
+        if isinstance(tipo, pd.CategoricalDtype):
+            valores = linhas[coluna].dropna()
+            if not all(isinstance(v, str) for v in valores):
+                continue
+            faltando = pd.Index(valores.unique()).difference(tipo.categories)
+            if len(faltando):
+                df = df.assign(**{coluna: df[coluna].cat.add_categories(faltando)})
+            linhas[coluna] = linhas[coluna].astype(df[coluna].dtype)
+        elif isinstance(tipo, np.dtype) and tipo.kind == 'i' and linhas[coluna].dtype.kind == 'i':
+            limites = np.iinfo(tipo)
+            if linhas[coluna].between(limites.min, limites.max).all():
+                linhas[coluna] = linhas[coluna].astype(tipo)
+    return pd.concat([df, linhas], ignore_index=True)
+
+def _aplicar_operacao(df, key, operacao):
+    """Aplica uma operação ('append', 'update', 'delete' ou 'replace') sobre df.
+
+    Formatos: ('append', linhas), ('update', linhas, ids), ('delete', ids)
+    e ('replace', tabela).
+    """
+    tipo = operacao[0]
+    if tipo == 'append':
+        return _anexar_linhas(df, operacao[1])
+    if tipo == 'update':
+        return _atualizar_por_chave(df, key, operacao[1], operacao[2])
+    if tipo == 'delete':
+        coluna = _coluna_chave(key, df)
+        ids = {str(i) for i in operacao[1]}
+        return df[~df[coluna].astype(str).isin(ids)].reset_index(drop=True)
+    if tipo == 'replace':
+        return operacao[1]
+    raise ValueError(f"Operação desconhecida: {tipo}")
+
+def _chaves_tocadas(key, operacoes):
+    """Chaves (como texto) dos registros afetados pelas operações; None se
+    alguma operação alcança a tabela inteira"""
+    coluna = TABLE_KEYS.get(key)
+    chaves = set()
+    for operacao in operacoes:
+        tipo = operacao[0]
+        if tipo == 'delete':
+            chaves.update(map(str, operacao[1]))
+            continue
+        if tipo not in ('append', 'update') or coluna not in operacao[1].columns:
+            return None
+        chaves.update(map(str, operacao[1][coluna]))
+        if tipo == 'update' and operacao[2] is not None:
+            chaves.update(map(str, operacao[2]))
+    return chaves
+
+def _aplicar_operacoes(df, key, operacoes):
+    for operacao in operacoes:
+        df = _aplicar_operacao(df, key, operacao)
+    return df
+
+class StorageBackend:
+    """Interface comum de persistência das tabelas do inventário.
+
+    Toda escrita passa por apply_batch. A implementação genérica lê a
+    tabela, aplica as operações em memória e grava uma única vez; backends
+    com escrita parcial a sobrescrevem. `local` indica se os dados ficam no
+    disco desta máquina (o diário de movimentações pode esperar a
+    compactação) ou num serviço compartilhado.
+    """
+
+    local = True
+
+    def load_table(self, key):
+        raise NotImplementedError
+
+    def save_tables(self, tables):
+        """Substitui o conteúdo das tabelas informadas"""
+        raise NotImplementedError
+
+    def load_tables(self, keys=None):
+        keys = list(SHEET_NAMES) if keys is None else list(keys)
+        return {key: self.load_table(key) for key in keys}
+
+    def apply_batch(self, key, operacoes):
+        """Aplica as operações em ordem, com uma única gravação da tabela"""
+        df = self.load_table(key)
+        for operacao in operacoes:
+            df = _aplicar_operacao(df, key, operacao)
+        self.save_tables({key: df})
+
+    def append_rows(self, key, rows):
+        self.apply_batch(key, [('append', rows)])
+
+    def update_rows(self, key, rows, ids=None):
+        """Atualiza as linhas cuja chave está em ids (por padrão, as chaves de rows)"""
+        self.apply_batch(key, [('update', rows, ids)])
+
+    def delete_rows(self, key, ids):
+        self.apply_batch(key, [('delete', list(ids))])
+
+class XlsxBackend(StorageBackend):
+    """inventario.xlsx via openpyxl: lê e grava sempre a pasta de trabalho inteira"""
+
+    def __init__(self, caminho=ARQUIVO_INVENTARIO):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+
+    def load_tables(self, keys=None):
+        keys = list(SHEET_NAMES) if keys is None else list(keys)
+        planilhas = _ler_xlsx(self.caminho)
+        return {key: planilhas.get(SHEET_NAMES[key], pd.DataFrame()) for key in keys}
+
+    def load_table(self, key):
+        return self.load_tables([key])[key]
+
+    def save_tables(self, tables):
+        with self._lock:
+            # O formato não permite gravar uma aba isolada: completa com as atuais
+            atuais = {} if set(SHEET_NAMES) <= set(tables) else self.load_tables()
+            atuais.update(tables)
+            # Grava ao lado e troca de uma vez: quem lê nunca vê o arquivo pela metade
+            base, extensao = os.path.splitext(self.caminho)
+            tmp_path = f'{base}.tmp{extensao}'  # o openpyxl exige a extensão .xlsx
+            try:
+                exportar_xlsx({key: atuais[key] for key in SHEET_NAMES if key in atuais}, tmp_path)
+                os.replace(tmp_path, self.caminho)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+class FeatherBackend(StorageBackend):
+    """Snapshot colunar local (ver SnapshotStore)"""
+
+    def __init__(self, store=None):
+        self.store = store or SnapshotStore()
+
+    def load_tables(self, keys=None):
+        return self.store.load(keys)
+
+    def load_table(self, key):
+        return self.store.load([key])[key]
+
+    def save_tables(self, tables):
+        self.store.save(tables)
+
+class SheetsBackend(StorageBackend):
+    """Google Sheets, lendo pelo cache compartilhado e gravando só as diferenças"""
+
+    local = False
+
+    def load_tables(self, keys=None):
+        return load_sheet_data(keys)
+
+    def load_table(self, key):
+        return load_sheet_data([key])[key]
+
+    def save_tables(self, tables):
+        if not save_data(tables):
+            raise RuntimeError("Falha ao salvar na planilha")
+
+def _q(nome):
+    """Identificador SQL entre aspas"""
+    return '"{}"'.format(str(nome).replace('"', '""'))
+
+def _afinidade(serie):
+    """Texto vira TEXT; números, IDs e colunas mistas ficam NUMERIC"""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = pd.Series(serie.cat.categories)
+    if pd.api.types.infer_dtype(serie, skipna=True) in ('string', 'empty', 'date', 'datetime', 'datetime64'):
+        return 'TEXT'
+    return 'NUMERIC'
+
+class SqliteBackend(StorageBackend):
+    """SQLite embutido: uma tabela por aba, índice único na coluna chave e
+    escritas transacionais por linha"""
+
+    def __init__(self, caminho=ARQUIVO_SQLITE):
+        self.caminho = caminho
+        self._lock = threading.RLock()
+        novo = not os.path.exists(caminho)
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        if novo:
+            self._primeira_carga()
+
+    def _primeira_carga(self):
+        # Primeira execução: importa o inventario.xlsx existente
+        if os.path.exists(ARQUIVO_INVENTARIO):
+            self.save_tables(XlsxBackend().load_tables())
+
+    def _transacao(self):
+        backend = self
+
+        class _Transacao:
+            def __enter__(self):
+                backend._lock.acquire()
+                backend._conn.execute('BEGIN IMMEDIATE')
+                return backend._conn
+
+            def __exit__(self, exc_type, exc, tb):
+                try:
+                    backend._conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+                finally:
+                    backend._lock.release()
+
+        return _Transacao()
+
+    def _colunas(self, key):
+        return [row[1] for row in self._conn.execute(f'PRAGMA table_info({_q(key)})')]
+
+    def _preparar_tabela(self, conn, key, df):
+        """Cria a tabela (e o índice da chave) ou acrescenta colunas novas"""
+        existentes = self._colunas(key)
+        if not existentes:
+            colunas = ', '.join(f'{_q(col)} {_afinidade(df[col])}' for col in df.columns)
+            conn.execute(f'CREATE TABLE {_q(key)} ({colunas})')
+            chave = TABLE_KEYS.get(key)
+            if chave in df.columns:
+                unico = 'UNIQUE ' if df[chave].is_unique else ''
+                conn.execute(f'CREATE {unico}INDEX {_q("ix_" + key)} ON {_q(key)} ({_q(chave)})')
+            return
+        for col in df.columns:
+            if col not in existentes:
+                conn.execute(f'ALTER TABLE {_q(key)} ADD COLUMN {_q(col)} {_afinidade(df[col])}')
+
+    def _inserir(self, conn, key, df):
+        colunas = ', '.join(_q(col) for col in df.columns)
+        marcadores = ', '.join('?' * len(df.columns))
+        conn.executemany(
+            f'INSERT INTO {_q(key)} ({colunas}) VALUES ({marcadores})',
+            [[None if v == '' else v for v in row] for row in _table_rows(df)]
+        )
+
+    def load_table(self, key):
+        with self._lock:
+            if not self._colunas(key):
+                return pd.DataFrame()
+            return pd.read_sql_query(f'SELECT * FROM {_q(key)} ORDER BY rowid', self._conn)
+
+    def save_tables(self, tables):
+        with self._transacao() as conn:
+            for key, df in tables.items():
+                self._executar(conn, key, ('replace', df))
+
+    def apply_batch(self, key, operacoes):
+        # Todas as operações do lote na mesma transação
+        with self._transacao() as conn:
+            for operacao in operacoes:
+                self._executar(conn, key, operacao)
+
+    def _executar(self, conn, key, operacao):
+        tipo = operacao[0]
+        if tipo == 'replace':
+            df = operacao[1]
+            conn.execute(f'DROP TABLE IF EXISTS {_q(key)}')
+            if not df.columns.empty:
+                self._preparar_tabela(conn, key, df)
+                self._inserir(conn, key, df)
+        elif tipo == 'append':
+            self._preparar_tabela(conn, key, operacao[1])
+            self._inserir(conn, key, operacao[1])
+        elif tipo == 'update':
+            rows = operacao[1]
+            chave = _coluna_chave(key, rows)
+            ids = rows[chave].tolist() if operacao[2] is None else list(operacao[2])
+            atribuicoes = ', '.join(f'{_q(col)} = ?' for col in rows.columns)
+            self._preparar_tabela(conn, key, rows)
+            conn.executemany(
+                f'UPDATE {_q(key)} SET {atribuicoes} WHERE {_q(chave)} = ?',
+                [[None if v == '' else v for v in row] + [_cell_value(id_)]
+                 for row, id_ in zip(_table_rows(rows), ids)]
+            )
+        elif tipo == 'delete':
+            if self._colunas(key):
+                conn.executemany(
+                    f'DELETE FROM {_q(key)} WHERE {_q(TABLE_KEYS[key])} = ?',
+                    [[_cell_value(id_)] for id_ in operacao[1]]
+                )
+        else:
+            raise ValueError(f"Operação desconhecida: {tipo}")
+
+# --- RÉPLICA LOCAL SINCRONIZADA ---
+SYNC_INTERVALO = 30  # segundos entre sincronizações sem alterações locais
+SYNC_JANELA = 2.0  # segundos de espera após uma gravação local, para juntar a rajada
+MAX_CONFLITOS = 200  # conflitos lembrados para exibição
+
+def _carimbos_linhas(colunas, linhas, key):
+    """Carimbo de revisão (hash do conteúdo normalizado) de cada linha, pela
+    chave; None se a tabela não tem coluna chave única"""
+    coluna = TABLE_KEYS.get(key)
+    if coluna not in colunas:
+        return None
+    idx = colunas.index(coluna)
+    carimbos = {
+        str(linha[idx]): hashlib.blake2b(repr(tuple(linha)).encode(), digest_size=8).hexdigest()
+        for linha in linhas
+    }
+    return carimbos if len(carimbos) == len(linhas) else None
+
+def _carimbos(df, key):
+    return _carimbos_linhas([str(col) for col in df.columns], _table_rows(df), key)
+
+def _carimbos_atualizados(carimbos, anterior, df, key, chaves):
+    """Carimbos de df a partir dos da versão anterior, recalculando só as
+    linhas das chaves tocadas (None: todas)"""
+    if carimbos is None or chaves is None or list(df.columns) != list(anterior.columns):
+        return _carimbos(df, key)
+    coluna = TABLE_KEYS[key]
+    novos = {chave: carimbo for chave, carimbo in carimbos.items() if chave not in chaves}
+    novos.update(_carimbos(df[df[coluna].astype(str).isin(chaves)], key) or {})
+    return novos if len(novos) == len(df) else _carimbos(df, key)
+
+def _carimbos_grade(values, key):
+    """Carimbos direto da grade bruta da API, já no formato de _table_rows"""
+    if not values:
+        return None
+    colunas = [str(col).strip() for col in values[0]]
+    largura = len(colunas)
+    linhas = [list(linha[:largura]) + [''] * (largura - len(linha)) for linha in values[1:]]
+    return _carimbos_linhas(colunas, linhas, key)
+
+def _operacoes_diferenca(key, atual, novo):
+    """Operações por chave que levam a tabela atual ao conteúdo de novo"""
+    if list(atual.columns) != list(novo.columns):
+        return [('replace', novo)] if len(atual.columns) or len(novo.columns) else []
+    excluidas, alteradas, novas, _ = diff_table(atual, novo, TABLE_KEYS.get(key))
+    if not (excluidas or alteradas or novas):
+        return []
+    coluna = TABLE_KEYS.get(key)
+    if not (coluna in novo.columns and novo[coluna].is_unique and atual[coluna].is_unique):
+        return [('replace', novo)]
+    operacoes = []
+    if excluidas:
+        operacoes.append(('delete', atual[coluna].iloc[excluidas].tolist()))
+    if alteradas:
+        operacoes.append(('update', pd.DataFrame([linha for _, linha in alteradas], columns=novo.columns), None))
+    if novas:
+        operacoes.append(('append', pd.DataFrame(novas, columns=novo.columns)))
+    return operacoes
+
+def _operacoes_json(operacoes):
+    """Serializa operações para o log de alterações (valores como na planilha)"""
+    itens = []
+    for operacao in operacoes:
+        item = {'tipo': operacao[0]}
+        if operacao[0] == 'delete':
+            item['ids'] = [_cell_value(i) for i in operacao[1]]
+        else:
+            item['colunas'] = [str(col) for col in operacao[1].columns]
+            item['linhas'] = _table_rows(operacao[1])
+            if operacao[0] == 'update':
+                item['ids'] = None if operacao[2] is None else [_cell_value(i) for i in operacao[2]]
+        itens.append(item)
+    return json.dumps(itens, ensure_ascii=False, default=str)
+
+def _operacoes_de_json(texto):
+    operacoes = []
+    for item in json.loads(texto):
+        if item['tipo'] == 'delete':
+            operacoes.append(('delete', item['ids']))
+            continue
+        linhas = pd.DataFrame(item['linhas'], columns=item['colunas'])
+        if item['tipo'] == 'update':
+            operacoes.append(('update', linhas, item['ids']))
+        else:
+            operacoes.append((item['tipo'], linhas))
+    return operacoes
+
+def _aplicar_na_planilha(df, key, operacao):
+    """Como _aplicar_operacao, mas alterar ou excluir numa aba sem a coluna
+    chave (apagada ou esvaziada na planilha) não tem efeito"""
+    if operacao[0] in ('update', 'delete') and TABLE_KEYS.get(key) not in df.columns:
+        return df
+    return _aplicar_operacao(df, key, operacao)
+
+def _mesclar_journal(movimentacoes, produtos, entradas):
+    """Aplica o diário de movimentações às tabelas lidas da planilha"""
+    if 'Quantidade em Estoque' in produtos.columns:
+        # Na grade bruta células vazias vêm como '', que não somam
+        produtos = produtos.assign(**{
+            'Quantidade em Estoque': pd.to_numeric(produtos['Quantidade em Estoque'], errors='coerce')
+        })
+    return aplicar_journal(movimentacoes, produtos, entradas)
+
+def _movimentos_colididos(movimentacoes, entradas):
+    """IDs do diário que já estão na aba com outro produto, tipo ou quantidade:
+    não é o mesmo movimento já gravado, e sim outro registro com o mesmo ID
+    (ex.: linha incluída à mão), que aplicar_journal descartaria"""
+    if not entradas or 'ID Movimentação' not in movimentacoes.columns:
+        return []
+    gravados = {}
+    for linha in movimentacoes.to_dict('records'):
+        gravados.setdefault(str(linha['ID Movimentação']), linha)
+    campos = [c for c in ('ID Produto', 'Tipo', 'Quantidade') if c in movimentacoes.columns]
+    return [
+        str(entrada['ID Movimentação']) for entrada in entradas
+        if str(entrada['ID Movimentação']) in gravados and any(
+            str(_cell_value(gravados[str(entrada['ID Movimentação'])][c])) != str(_cell_value(entrada.get(c)))
+            for c in campos
+        )
+    ]
+
+def _abrir_planilha():
+    return get_sheets_client().planilha()
+
+class ReplicaBackend(SqliteBackend):
+    """Réplica SQLite local do Google Sheets.
+
+    Leituras e escritas são locais. Cada escrita é anotada, na mesma
+    transação, num log de alterações (tabela _alteracoes) que o
+    SincronizadorReplica envia à planilha em segundo plano; _revisoes guarda
+    o carimbo de cada linha na última sincronização.
+    """
+
+    def __init__(self, caminho=ARQUIVO_REPLICA, abrir_planilha=None, journal=None, automatico=True):
+        novo = not os.path.exists(caminho)
+        super().__init__(caminho)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS _alteracoes '
+            '(seq INTEGER PRIMARY KEY AUTOINCREMENT, tabela TEXT, operacoes TEXT)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS _revisoes '
+            '(tabela TEXT, chave TEXT, carimbo TEXT, PRIMARY KEY (tabela, chave))'
+        )
+        self.sincronizador = SincronizadorReplica(
+            self, abrir_planilha or _abrir_planilha,
+            get_movement_journal() if journal is None else journal
+        )
+        if novo:
+            # Primeira execução: a réplica nasce da planilha (ou vazia, se offline)
+            try:
+                self.sincronizador.sincronizar(invalidar=False)
+            except Exception as e:
+                self.sincronizador.erro = e
+        if automatico:
+            self.sincronizador.iniciar()
+
+    def _primeira_carga(self):
+        pass  # povoada pela primeira sincronização
+
+    def save_tables(self, tables):
+        # Só as diferenças entram no log: regravar uma tabela igual não gera envio
+        with self._transacao() as conn:
+            for key, df in tables.items():
+                self._registrar(conn, key, _operacoes_diferenca(key, self.load_table(key), df))
+        self.sincronizador.agendar()
+
+    def apply_batch(self, key, operacoes):
+        with self._transacao() as conn:
+            self._registrar(conn, key, operacoes)
+        self.sincronizador.agendar()
+
+    def _registrar(self, conn, key, operacoes):
+        """Aplica as operações na réplica e as anota no log, na mesma transação"""
+        if not operacoes:
+            return
+        for operacao in operacoes:
+            self._executar(conn, key, operacao)
+        conn.execute(
+            'INSERT INTO _alteracoes (tabela, operacoes) VALUES (?, ?)',
+            (key, _operacoes_json(operacoes))
+        )
+
+    def pendentes(self):
+        """Alterações locais ainda não enviadas: [(seq, tabela, operações)]"""
+        with self._lock:
+            linhas = self._conn.execute('SELECT seq, tabela, operacoes FROM _alteracoes ORDER BY seq').fetchall()
+        return [(seq, key, _operacoes_de_json(texto)) for seq, key, texto in linhas]
+
+    def contar_pendentes(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM _alteracoes').fetchone()[0]
+
+    def carimbos(self, key):
+        with self._lock:
+            return dict(self._conn.execute('SELECT chave, carimbo FROM _revisoes WHERE tabela = ?', (key,)))
+
+    def concluir(self, ate, tabelas, carimbos):
+        """Fecha um ciclo de sincronização numa única transação.
+
+        tabelas: {tabela: (conteúdo da planilha após o envio, chaves)}; cada
+        uma passa a ser esse conteúdo mais as alterações locais anotadas
+        depois de `ate`, gravando só as linhas que diferem (se chaves não é
+        None, só essas linhas podem diferir). carimbos substitui os carimbos
+        de revisão; o log até `ate` é descartado. Retorna as tabelas locais
+        que mudaram.
+        """
+        alteradas = []
+        with self._transacao() as conn:
+            posteriores = {}
+            for seq, key, texto in conn.execute('SELECT seq, tabela, operacoes FROM _alteracoes WHERE seq > ? ORDER BY seq', (ate,)).fetchall():
+                posteriores.setdefault(key, []).extend(_operacoes_de_json(texto))
+            for key, (df, chaves) in tabelas.items():
+                for operacao in posteriores.get(key, []):
+                    df = _aplicar_na_planilha(df, key, operacao)
+                atual = self.load_table(key)
+                if chaves is not None and list(atual.columns) == list(df.columns):
+                    coluna = TABLE_KEYS[key]
+                    atual = atual[atual[coluna].astype(str).isin(chaves)]
+                    df = df[df[coluna].astype(str).isin(chaves)]
+                operacoes = _operacoes_diferenca(key, atual, df)
+                for operacao in operacoes:
+                    self._executar(conn, key, operacao)
+                if operacoes:
+                    alteradas.append(key)
+            for key, novos in carimbos.items():
+                atuais = dict(conn.execute('SELECT chave, carimbo FROM _revisoes WHERE tabela = ?', (key,)))
+                novos = novos or {}
+                conn.executemany(
+                    'DELETE FROM _revisoes WHERE tabela = ? AND chave = ?',
+                    [(key, chave) for chave in atuais if chave not in novos]
+                )
+                conn.executemany(
+                    'INSERT OR REPLACE INTO _revisoes (tabela, chave, carimbo) VALUES (?, ?, ?)',
+                    [(key, chave, carimbo) for chave, carimbo in novos.items() if atuais.get(chave) != carimbo]
+                )
+            conn.execute('DELETE FROM _alteracoes WHERE seq <= ?', (ate,))
+        return alteradas
+
+class SincronizadorReplica:
+    """Sincroniza a réplica local com a planilha numa thread em segundo plano.
+
+    Cada ciclo lê todas as abas numa chamada em lote, aplica sobre elas o log
+    de alterações locais e o diário de movimentações, envia as diferenças
+    (um batch_update por aba) e traz para a réplica o que mudou na planilha.
+    Conflitos são detectados pela chave da linha e pelo carimbo de revisão da
+    última sincronização: se a mesma linha mudou nos dois lados, vence a
+    planilha e o conflito fica registrado. Sem conexão, o ciclo falha e o log
+    espera pelo próximo.
+    """
+
+    def __init__(self, replica, abrir_planilha, journal=None, intervalo=SYNC_INTERVALO, janela=SYNC_JANELA):
+        self.replica = replica
+        self.journal = journal
+        self.intervalo = intervalo
+        self.janela = janela
+        self._abrir_planilha = abrir_planilha
+        self.ciclos = 0
+        self.envios = 0           # batch_updates enviados
+        self.recebidas = 0        # tabelas locais atualizadas com mudanças da planilha
+        self.falhas = 0
+        self.ultima = None        # time.time() da última sincronização completa
+        self.duracao = 0.0
+        self.erro = None
+        self.conflitos = deque(maxlen=MAX_CONFLITOS)
+        self._colisoes = set()    # IDs do diário já anotados como colididos
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._executar, name='sync-replica', daemon=True)
+        self._thread.start()
+
+    def agendar(self):
+        """Pede um ciclo logo (após uma gravação local ou pelo botão)"""
+        self._acordar.set()
+
+    def status(self):
+        return {
+            'pendentes': self.replica.contar_pendentes(),
+            'ultima': self.ultima,
+            'duracao': self.duracao,
+            'erro': None if self.erro is None else str(self.erro),
+            'ciclos': self.ciclos,
+            'envios': self.envios,
+            'recebidas': self.recebidas,
+            'falhas': self.falhas,
+            'conflitos': list(self.conflitos)
+        }
+
+    def _executar(self):
+        while True:
+            if self._acordar.wait(self.intervalo):
+                time.sleep(self.janela)
+            self._acordar.clear()
+            try:
+                self.sincronizar()
+            except Exception as e:
+                self.erro = e
+                self.falhas += 1
+
+    def sincronizar(self, invalidar=True):
+        """Executa um ciclo completo; levanta a exceção se a planilha falhar"""
+        with self._lock:
+            inicio = time.perf_counter()
+            pendentes = self.replica.pendentes()
+            ate = pendentes[-1][0] if pendentes else 0
+            operacoes = {}
+            for _, key, lista in pendentes:
+                operacoes.setdefault(key, []).extend(lista)
+            tocadas = {key: _chaves_tocadas(key, lista) for key, lista in operacoes.items()}
+            entradas = self.journal.read() if self.journal is not None else []
+
+            planilha = self._abrir_planilha()
+            grades, _, erros = fetch_sheet_grids(planilha, SHEET_NAMES.values())
+            if erros:
+                raise next(iter(erros.values()))
+
+            bases = {key: self.replica.carimbos(key) for key in SHEET_NAMES}
+            remotos, carimbos_remotos, novos, conflitos = {}, {}, {}, []
+            for key, nome in SHEET_NAMES.items():
+                remotos[key] = grid_to_dataframe(grades.get(nome) or [])
+                carimbos_remotos[key] = _carimbos_grade(grades.get(nome), key)
+                novos[key] = self._mesclar(
+                    key, remotos[key], carimbos_remotos[key], bases[key], operacoes.get(key, []), conflitos
+                )
+            # Não deveria ocorrer com uma faixa de IDs por réplica; se ocorrer, fica à vista
+            colididos = set(_movimentos_colididos(novos['movimentacoes'], entradas)) - self._colisoes
+            self._colisoes |= colididos
+            conflitos.extend(
+                {'Quando': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'Tabela': SHEET_NAMES['movimentacoes'],
+                 'Chave': chave, 'Operação': 'diário: ID já usado, movimento não aplicado'}
+                for chave in sorted(colididos)
+            )
+            diario = {}  # chaves das linhas que o diário acrescentou ou alterou
+            if entradas:
+                movimentacoes, produtos = _mesclar_journal(novos['movimentacoes'], novos['produtos'], entradas)
+                if movimentacoes is not novos['movimentacoes']:
+                    acrescentadas = movimentacoes.iloc[len(novos['movimentacoes']):]
+                    diario['movimentacoes'] = set(acrescentadas['ID Movimentação'].astype(str))
+                    if produtos is not novos['produtos']:
+                        diario['produtos'] = set(acrescentadas['ID Produto'].astype(str))
+                    novos['movimentacoes'], novos['produtos'] = movimentacoes, produtos
+
+            atualizar, carimbos = {}, {}
+            tabelas_em_conflito = {conflito['Tabela'] for conflito in conflitos}
+            for key, nome in SHEET_NAMES.items():
+                gravado, carimbos[key] = remotos[key], carimbos_remotos[key]
+                if novos[key] is not remotos[key]:
+                    gravado = self._enviar(planilha, key, nome, grades.get(nome) is not None, remotos[key], novos[key])
+                    chaves = tocadas.get(key, set())
+                    chaves = None if chaves is None else chaves | diario.get(key, set())
+                    carimbos[key] = _carimbos_atualizados(carimbos_remotos[key], remotos[key], gravado, key, chaves)
+                # A réplica já é base + log; só precisa ser refeita se a planilha
+                # mudou por fora ou houve conflito, ou nas linhas que o diário trouxe
+                if carimbos_remotos[key] is None or carimbos_remotos[key] != bases[key] or nome in tabelas_em_conflito:
+                    atualizar[key] = (gravado, None)
+                elif key in diario:
+                    atualizar[key] = (gravado, diario[key])
+            carimbos = {key: c for key, c in carimbos.items() if (c or {}) != bases[key]}
+            alteradas = self.replica.concluir(ate, atualizar, carimbos)
+
+            self.conflitos.extend(conflitos)
+            self.recebidas += len(alteradas)
+            self.ciclos += 1
+            self.ultima = time.time()
+            self.duracao = time.perf_counter() - inicio
+            self.erro = None
+        if invalidar and alteradas:
+            get_table_store().invalidar(alteradas)
+        return alteradas
+
+    def _enviar(self, planilha, key, nome, existe, remoto, df):
+        """Grava df na aba com um único batch_update; retorna o conteúdo gravado"""
+        snapshot = remoto if existe else None
+        try:
+            aba = planilha.worksheet(nome)
+        except gspread.WorksheetNotFound:
+            aba = planilha.add_worksheet(title=nome, rows=100, cols=max(1, len(df.columns)))
+            snapshot = None
+        requisicoes, gravado = plan_table_write(
+            aba.id, snapshot, df, TABLE_KEYS.get(key),
+            grid_rows=aba.row_count, grid_cols=aba.col_count
+        )
+        if requisicoes:
+            planilha.batch_update({'requests': requisicoes})
+            self.envios += 1
+        return gravado
+
+    def _mesclar(self, key, remoto, carimbos_remotos, base, operacoes, conflitos):
+        """Aplica as operações locais sobre a aba lida, descartando as que
+        tocam linhas alteradas na planilha desde a última sincronização"""
+        if not operacoes:
+            return remoto
+        if carimbos_remotos is None:
+            # Sem chave única não há como casar linhas: as alterações locais valem
+            for operacao in operacoes:
+                remoto = _aplicar_na_planilha(remoto, key, operacao)
+            return remoto
+        mudadas = {k for k in base.keys() | carimbos_remotos.keys() if base.get(k) != carimbos_remotos.get(k)}
+        coluna = TABLE_KEYS[key]
+        resultado = remoto
+        for operacao in operacoes:
+            if operacao[0] == 'replace':
+                etapas = self._replace_por_linhas(key, resultado, operacao[1], base)
+                if etapas is None:
+                    resultado = operacao[1]
+                    continue
+            else:
+                etapas = [operacao]
+            for etapa in etapas:
+                etapa = self._sem_conflitos(key, coluna, etapa, mudadas, conflitos)
+                if etapa is not None:
+                    resultado = _aplicar_na_planilha(resultado, key, etapa)
+        return resultado
+
+    def _replace_por_linhas(self, key, resultado, tabela, base):
+        """Traduz a substituição da tabela inteira nas linhas que mudaram
+        localmente desde a última sincronização"""
+        carimbos = _carimbos(tabela, key)
+        if carimbos is None:
+            return None
+        coluna = TABLE_KEYS[key]
+        chaves = tabela[coluna].astype(str)
+        linhas = tabela[[carimbos[chave] != base.get(chave) for chave in chaves]]
+        presentes = set(resultado[coluna].astype(str)) if coluna in resultado.columns else set()
+        na_planilha = linhas[coluna].astype(str).isin(presentes).to_numpy()
+        etapas = []
+        excluidas = [chave for chave in base if chave not in carimbos]
+        if excluidas:
+            etapas.append(('delete', excluidas))
+        if na_planilha.any():
+            etapas.append(('update', linhas[na_planilha], None))
+        if (~na_planilha).any():
+            etapas.append(('append', linhas[~na_planilha]))
+        return etapas
+
+    def _sem_conflitos(self, key, coluna, operacao, mudadas, conflitos):
+        """Retira da operação as linhas alteradas na planilha (a planilha
+        prevalece), anotando cada uma em conflitos; None se nada sobra"""
+        tipo = operacao[0]
+        if tipo == 'delete':
+            em_conflito = [str(i) in mudadas for i in operacao[1]]
+            conflitantes = [i for i, c in zip(operacao[1], em_conflito) if c]
+            ids = [i for i, c in zip(operacao[1], em_conflito) if not c]
+            restante = ('delete', ids) if ids else None
+        else:
+            linhas = operacao[1]
+            if coluna not in linhas.columns:
+                return operacao
+            chaves = linhas[coluna].astype(str).tolist()
+            em_conflito = [chave in mudadas for chave in chaves]
+            if tipo == 'update' and operacao[2] is not None:
+                em_conflito = [c or str(i) in mudadas for c, i in zip(em_conflito, operacao[2])]
+            conflitantes = [chave for chave, c in zip(chaves, em_conflito) if c]
+            manter = [not c for c in em_conflito]
+            linhas = linhas[manter]
+            if linhas.empty:
+                restante = None
+            elif tipo == 'update':
+                ids = None if operacao[2] is None else [i for i, m in zip(operacao[2], manter) if m]
+                restante = ('update', linhas, ids)
+            else:
+                restante = (tipo, linhas)
+        quando = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conflitos.extend(
+            {'Quando': quando, 'Tabela': SHEET_NAMES.get(key, key), 'Chave': str(chave), 'Operação': tipo}
+            for chave in conflitantes
+        )
+        return restante
+
+BACKENDS = {
+    'xlsx': XlsxBackend,
+    'feather': FeatherBackend,
+    'sqlite': SqliteBackend,
+    'sheets': SheetsBackend,
+    'replica': ReplicaBackend
+}
+
+@st.cache_resource
+def get_storage_backend():
+    """Backend configurado em STORAGE_BACKEND, compartilhado pelas sessões"""
+    if STORAGE_BACKEND not in BACKENDS:
+        st.error(f"❌ STORAGE_BACKEND inválido: {STORAGE_BACKEND}. Use: {', '.join(BACKENDS)}")
+        st.stop()
+    return BACKENDS[STORAGE_BACKEND]()
+
+def salvar_tabelas(tables):
+    """Grava as tabelas inteiras no backend configurado"""
     try:
-        with pd.ExcelWriter('inventario.xlsx', engine='openpyxl') as writer:
-            movimentacoes.to_excel(writer, sheet_name='movimentacoes', index=False)
-            produtos.to_excel(writer, sheet_name='produtos', index=False)
-            responsaveis.to_excel(writer, sheet_name='responsaveis', index=False)
-            unidades.to_excel(writer, sheet_name='unidades', index=False)
-            usuarios.to_excel(writer, sheet_name='usuarios', index=False)
+        get_storage_backend().save_tables(tables)
         st.success("Dados salvos com sucesso!")
+        return True
     except Exception as e:
         st.error(f"Erro ao salvar planilhas: {e}")
+        return False
+
+def salvar_linhas(key, novas=None, alteradas=None, ids=None, excluidas=None, tabela=None, revisao=None):
+    """Enfileira a gravação das linhas afetadas de uma tabela.
+
+    alteradas são casadas pela coluna chave (ou pelas chaves antigas em ids,
+    quando a própria chave mudou); excluidas é a lista de chaves a remover;
+    tabela substitui a tabela inteira. Retorna sem esperar pela gravação.
+
+    A gravação é condicional à revisão lida (padrão: revisao_lida): se outra
+    sessão alterou depois dela algum dos mesmos registros, levanta
+    ConflitoEdicao; alterações em outros registros são mescladas.
+    """
+    operacoes = []
+    if tabela is not None:
+        operacoes.append(('replace', tabela.copy()))
+    if excluidas:
+        operacoes.append(('delete', list(excluidas)))
+    if alteradas is not None and not alteradas.empty:
+        operacoes.append(('update', alteradas.copy(), None if ids is None else list(ids)))
+    if novas is not None and not novas.empty:
+        operacoes.append(('append', novas.copy()))
+        if TABLE_KEYS.get(key) in novas.columns:
+            get_id_allocator().observar(key, novas[TABLE_KEYS[key]])
+    if operacoes:
+        store = get_table_store()
+        revisao = revisao_lida(key) if revisao is None else revisao
+        tocadas = _chaves_tocadas(key, operacoes)
+        so_anexos = all(operacao[0] == 'append' for operacao in operacoes)
+        # Verificar, enfileirar e publicar juntos: nenhuma outra escrita entra no meio
+        with store.lock:
+            if store.conflita(key, revisao, tocadas, so_anexos):
+                raise ConflitoEdicao(
+                    f"Os dados de '{SHEET_NAMES.get(key, key)}' foram alterados por outra sessão "
+                    "depois que você os abriu. Confira os valores atuais e tente de novo."
+                )
+            get_write_queue().enviar(key, operacoes)
+            store.alterar(lambda snapshot: {key: _aplicar_operacoes(snapshot[key], key, operacoes)}, {key: tocadas})
+    return True
+
+# --- IDENTIFICADORES ---
+ARQUIVO_IDS = 'ids.json'
+BLOCO_IDS = 50  # IDs reservados por gravação do arquivo
+# Com a réplica, cada servidor gera só IDs com ID % REPLICAS_MAX == REPLICA_ID;
+# cada réplica deve ter seu REPLICA_ID (0 a REPLICAS_MAX - 1) nos secrets
+REPLICAS_MAX = 10
+REPLICA_ID = int(st.secrets.get("REPLICA_ID", 0))
+
+class IdAllocator:
+    """Gera IDs numéricos por tabela sem percorrer a tabela a cada cadastro.
+
+    Cada tabela tem o próximo ID em memória e um limite já gravado em disco
+    (reserva em blocos de BLOCO_IDS): só quando o limite é alcançado o
+    arquivo é regravado. IDs nunca são reutilizados, nem os de registros
+    excluídos, que podem continuar referenciados nas movimentações; após um
+    reinício a contagem segue do limite gravado. A cada versão nova da
+    tabela recebida (linhas gravadas por outros processos ou à mão na
+    planilha) a contagem sobe para depois do maior ID existente.
+
+    Com `passo` > 1 só são gerados IDs com ID % passo == deslocamento: cada
+    réplica fica com sua faixa e duas réplicas nunca geram o mesmo ID.
+    """
+
+    def __init__(self, path=ARQUIVO_IDS, bloco=BLOCO_IDS, passo=1, deslocamento=0):
+        self.path = path
+        self.bloco = bloco
+        self.passo = passo
+        self.deslocamento = deslocamento % passo
+        self._lock = threading.Lock()
+        self._proximo = {}
+        self._limite = {}
+        self._vistas = {}  # tabela -> referência fraca à última versão observada
+        self._carregar()
+
+    def _carregar(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._limite = {key: int(v) for key, v in json.load(f).items()}
+        except (OSError, ValueError, AttributeError):
+            self._limite = {}
+        self._proximo = {key: self._alinhar(v) for key, v in self._limite.items()}
+
+    def _alinhar(self, valor):
+        """Menor ID >= valor que pertence à faixa deste alocador"""
+        return valor + (self.deslocamento - valor) % self.passo
+
+    def _salvar(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._limite, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _maior_id(ids):
+        ids = pd.to_numeric(pd.Series(ids), errors='coerce').dropna()
+        return 0 if ids.empty else int(ids.max())
+
+    def _subir(self, key, maior):
+        if maior >= self._proximo[key]:
+            self._proximo[key] = self._alinhar(maior + 1)
+            if self._proximo[key] > self._limite[key]:
+                self._limite[key] = self._proximo[key]
+                self._salvar()
+
+    def _iniciar(self, key, tabela):
+        """Sobe a contagem para depois do maior ID da tabela, uma vez por
+        versão (cada versão publicada é um DataFrame novo)"""
+        if key not in self._proximo:
+            self._proximo[key] = self._limite[key] = self._alinhar(1)
+        if tabela is None:
+            return
+        vista = self._vistas.get(key)
+        if vista is not None and vista() is tabela:
+            return
+        coluna = TABLE_KEYS.get(key)
+        if coluna in tabela.columns:
+            self._subir(key, self._maior_id(tabela[coluna]))
+        self._vistas[key] = weakref.ref(tabela)
+
+    def proximo(self, key, tabela=None):
+        """ID que o próximo `alocar` deve retornar (não reserva)"""
+        with self._lock:
+            self._iniciar(key, tabela)
+            return self._proximo[key]
+
+    def alocar(self, key, tabela=None):
+        """Reserva e retorna um novo ID, maior que todos os de `tabela`"""
+        with self._lock:
+            self._iniciar(key, tabela)
+            novo_id = self._proximo[key]
+            self._proximo[key] = novo_id + self.passo
+            if self._proximo[key] > self._limite[key]:
+                self._limite[key] = novo_id + self.bloco * self.passo
+                self._salvar()
+            return novo_id
+
+    def alocar_bloco(self, key, quantidade, tabela=None):
+        """Reserva `quantidade` IDs com uma só gravação; retorna o array de IDs"""
+        with self._lock:
+            self._iniciar(key, tabela)
+            primeiro = self._proximo[key]
+            self._proximo[key] = primeiro + quantidade * self.passo
+            if self._proximo[key] > self._limite[key]:
+                self._limite[key] = self._proximo[key] + (self.bloco - 1) * self.passo
+                self._salvar()
+            return np.arange(primeiro, self._proximo[key], self.passo)
+
+    def observar(self, key, ids):
+        """Garante que IDs gravados por fora do alocador não sejam gerados de novo"""
+        maior = self._maior_id(ids)
+        with self._lock:
+            if key in self._proximo:
+                self._subir(key, maior)
+
+@st.cache_resource
+def get_id_allocator():
+    """Alocador compartilhado: sessões simultâneas nunca recebem o mesmo ID"""
+    if STORAGE_BACKEND == 'replica':
+        return IdAllocator(passo=REPLICAS_MAX, deslocamento=REPLICA_ID)
+    return IdAllocator()
+
+# --- ÍNDICE POR CHAVE PRIMÁRIA ---
+class PrimaryKeyIndex:
+    """Posição de cada registro pela chave primária (TABLE_KEYS) e, para as
+    colunas em `por`, as chaves de cada valor (ex.: nome -> IDs).
+
+    Vale para um DataFrame específico (a tabela publicada no snapshot),
+    guardado por referência fraca, e nunca muda depois de montado: as
+    edições de `atualizar` vão para uma cópia e só chegam ao índice quando
+    salvar_linhas publica a nova versão, que `indice_chave` reindexa.
+    """
+
+    def __init__(self, key, df, por=()):
+        self.coluna = _coluna_chave(key, df)
+        self._tabela = weakref.ref(df)
+        self.tamanho = len(df)
+        chaves = df[self.coluna].tolist()
+        self._posicoes = {}
+        self.duplicadas = set()
+        for posicao, chave in enumerate(chaves):
+            if chave in self._posicoes:
+                self.duplicadas.add(chave)
+            else:
+                self._posicoes[chave] = posicao
+        self._por = {}
+        for coluna in por:
+            mapa = {}
+            for chave, valor in zip(chaves, df[coluna].tolist()):
+                mapa.setdefault(valor, []).append(chave)
+            self._por[coluna] = mapa
+
+    def valido_para(self, df):
+        return self._tabela() is df and len(df) == self.tamanho
+
+    def contem(self, chave):
+        return chave in self._posicoes
+
+    def posicao(self, chave):
+        return self._posicoes.get(chave)
+
+    def chaves(self, coluna, valor):
+        """Chaves dos registros com `valor` na coluna (consulta por hash)"""
+        return list(self._por[coluna].get(valor, []))
+
+    def existe(self, coluna, valor):
+        return bool(self._por[coluna].get(valor))
+
+    def linha(self, df, chave):
+        return df.iloc[[self._posicoes[chave]]]
+
+    def atualizar(self, df, chave, valores):
+        """Altera o registro em df, uma cópia da tabela indexada, sem varrer colunas.
+
+        O índice não muda: se a gravação for recusada ou falhar, ele segue
+        valendo para a tabela publicada. Recusa (ValueError) trocar a chave
+        por uma já existente. Retorna a linha alterada como DataFrame,
+        pronta para salvar_linhas.
+        """
+        posicao = self._posicoes[chave]
+        nova = valores.get(self.coluna, chave)
+        if nova != chave and nova in self._posicoes:
+            raise ValueError(f"Já existe um registro com {self.coluna} = {nova}")
+        
+        for coluna, valor in valores.items():
+            serie = df[coluna]
+            if isinstance(serie.dtype, pd.CategoricalDtype) and not pd.isna(valor) and valor not in serie.cat.categories:
+                df[coluna] = serie.cat.add_categories([valor])
+            df.iat[posicao, df.columns.get_loc(coluna)] = valor
+        return df.iloc[[posicao]]
+
+    def excluir(self, df, chaves):
+        """Retorna a tabela sem os registros das chaves"""
+        posicoes = [self._posicoes[chave] for chave in chaves if chave in self._posicoes]
+        return df.drop(index=df.index[posicoes])
+
+def indice_chave(key, df, por=()):
+    """Índice por chave da tabela do snapshot, reaproveitado enquanto ela não muda"""
+    indices = st.session_state.setdefault('indices_chave', {})
+    indice = indices.get(key)
+    if indice is None or not indice.valido_para(df):
+        indice = PrimaryKeyIndex(key, df, por)
+        indices[key] = indice
+    elif not set(por) <= set(indice._por):
+        indice = PrimaryKeyIndex(key, df, sorted(set(por) | set(indice._por)))
+        indices[key] = indice
+    return indice
+
+# --- IMPORTAÇÃO EM LOTE ---
+TAMANHO_BLOCO_IMPORTACAO = 2000  # linhas validadas por vez
+
+COLUNAS_IMPORTACAO = {
+    'produtos': ['Nome do Produto', 'Quantidade em Estoque', 'Unidade de Medida', 'Categoria'],
+    'movimentacoes': ['Produto', 'Responsável', 'Unidade', 'Tipo', 'Quantidade', 'Data', 'Fornecedor', 'Razão']
+}
+OBRIGATORIAS_IMPORTACAO = {
+    'produtos': ['Nome do Produto', 'Quantidade em Estoque'],
+    'movimentacoes': ['Produto', 'Responsável', 'Unidade', 'Tipo', 'Quantidade', 'Data']
+}
+TIPOS_MOVIMENTACAO = {'entrada': 'Entrada', 'saida': 'Saída'}
+
+def ler_em_blocos(arquivo, nome, tamanho=TAMANHO_BLOCO_IMPORTACAO):
+    """Lê um CSV ou XLSX em DataFrames de até `tamanho` linhas, sem carregar o arquivo inteiro"""
+    if nome.lower().endswith('.xlsx'):
+        from openpyxl import load_workbook
+        livro = load_workbook(arquivo, read_only=True, data_only=True)
+        try:
+            linhas = livro.worksheets[0].iter_rows(values_only=True)
+            cabecalho = ['' if c is None else str(c).strip() for c in next(linhas, ())]
+            bloco = []
+            for linha in linhas:
+                bloco.append(linha)
+                if len(bloco) == tamanho:
+                    yield pd.DataFrame(bloco, columns=cabecalho, dtype=object)
+                    bloco = []
+            if bloco:
+                yield pd.DataFrame(bloco, columns=cabecalho, dtype=object)
+        finally:
+            livro.close()
+    else:
+        primeira_linha = arquivo.readline()
+        arquivo.seek(0)
+        if isinstance(primeira_linha, bytes):
+            primeira_linha = primeira_linha.decode('utf-8', errors='ignore')
+        separador = ';' if primeira_linha.count(';') > primeira_linha.count(',') else ','
+        for bloco in pd.read_csv(arquivo, sep=separador, dtype=str, keep_default_na=False,
+                                 chunksize=tamanho, encoding='utf-8-sig', skipinitialspace=True):
+            bloco.columns = [str(c).strip() for c in bloco.columns]
+            yield bloco
+
+def _texto(coluna):
+    return coluna.fillna('').astype(str).str.strip()
+
+def _mapa_nomes(tabela, coluna_nome, coluna_id):
+    """Nome (e ID em texto) -> ID, para validar referências por hash"""
+    mapa = {}
+    if coluna_id in tabela.columns:
+        mapa.update((str(i), i) for i in tabela[coluna_id].tolist())
+    if coluna_nome in tabela.columns and coluna_id in tabela.columns:
+        mapa.update(zip(_texto(tabela[coluna_nome]).tolist(), tabela[coluna_id].tolist()))
+    return mapa
+
+class ImportacaoLote:
+    """Valida um arquivo bloco a bloco e grava as linhas aceitas de uma vez.
+
+    Referências (produto, responsável, unidade) e nomes repetidos são
+    conferidos em dicionários montados uma só vez; cada linha rejeitada
+    vai para o relatório com o número da linha no arquivo e o motivo.
+    """
+
+    def __init__(self, key, produtos, responsaveis, unidades):
+        self.key = key
+        self.aceitas = []
+        self.rejeitadas = []
+        self.linhas_lidas = 0
+        self._originais = []  # movimentações aceitas como vieram do arquivo, para o relatório
+        if key == 'produtos':
+            self._nomes = set(_texto(produtos['Nome do Produto']).tolist())
+        else:
+            self._produtos = _mapa_nomes(produtos, 'Nome do Produto', 'ID Produto')
+            self._responsaveis = _mapa_nomes(responsaveis, 'Nome do Responsável', 'ID Responsavel')
+            self._unidades = _mapa_nomes(unidades, 'Nome da Unidade', 'ID Unidade')
+
+    @property
+    def total_aceitas(self):
+        return sum(len(bloco) for bloco in self.aceitas)
+
+    def processar(self, bloco):
+        """Valida um bloco; as linhas do arquivo são numeradas a partir de 2 (1 = cabeçalho)"""
+        bloco = bloco.reset_index(drop=True)
+        linhas = pd.RangeIndex(self.linhas_lidas + 2, self.linhas_lidas + 2 + len(bloco))
+        self.linhas_lidas += len(bloco)
+        
+        faltando = [c for c in OBRIGATORIAS_IMPORTACAO[self.key] if c not in bloco.columns]
+        if faltando:
+            motivo = pd.Series(f"Coluna ausente: {', '.join(faltando)}", index=bloco.index)
+            self._rejeitar(bloco, linhas, motivo)
+            return
+        for coluna in COLUNAS_IMPORTACAO[self.key]:
+            if coluna not in bloco.columns:
+                bloco[coluna] = ''
+        
+        validar = self._validar_produtos if self.key == 'produtos' else self._validar_movimentacoes
+        limpo, motivo = validar(bloco)
+        self._rejeitar(bloco, linhas, motivo)
+        validas = motivo.isna()
+        # O índice das linhas aceitas é o número da linha no arquivo
+        aceitas = limpo[validas].set_axis(linhas[validas.to_numpy()])
+        if not aceitas.empty:
+            self.aceitas.append(aceitas)
+            if self.key == 'produtos':
+                self._nomes.update(aceitas['Nome do Produto'].tolist())
+            else:
+                self._originais.append(bloco[validas].set_axis(aceitas.index))
+
+    def _rejeitar(self, bloco, linhas, motivo):
+        rejeitadas = motivo.notna()
+        if rejeitadas.any():
+            relatorio = bloco[rejeitadas].astype(object).copy()
+            relatorio.insert(0, 'Motivo', motivo[rejeitadas])
+            relatorio.insert(0, 'Linha', linhas[rejeitadas.to_numpy()])
+            self.rejeitadas.append(relatorio)
+
+    @staticmethod
+    def _primeiro_motivo(motivo, falha, texto):
+        return motivo.mask(motivo.isna() & falha, texto)
+
+    @staticmethod
+    def _inteiro(coluna):
+        numero = pd.to_numeric(_texto(coluna).str.replace(',', '.', regex=False), errors='coerce')
+        return numero, numero.isna() | (numero != numero.round())
+
+    def _validar_produtos(self, bloco):
+        motivo = pd.Series(None, index=bloco.index, dtype=object)
+        nome = _texto(bloco['Nome do Produto'])
+        quantidade, invalida = self._inteiro(bloco['Quantidade em Estoque'])
+        unidade = _texto(bloco['Unidade de Medida']).replace('', 'un')
+        
+        motivo = self._primeiro_motivo(motivo, nome == '', "Nome do Produto vazio")
+        motivo = self._primeiro_motivo(motivo, invalida | (quantidade < 0), "Quantidade em Estoque inválida")
+        motivo = self._primeiro_motivo(motivo, nome.isin(self._nomes), "Produto já cadastrado")
+        motivo = self._primeiro_motivo(motivo, nome.duplicated(), "Nome repetido no arquivo")
+        
+        limpo = pd.DataFrame({
+            'Nome do Produto': nome,
+            'Quantidade em Estoque': quantidade.fillna(0).astype('int64'),
+            'Unidade de Medida': unidade,
+            'Categoria': _texto(bloco['Categoria'])
+        })
+        return limpo, motivo
+
+    def _validar_movimentacoes(self, bloco):
+        motivo = pd.Series(None, index=bloco.index, dtype=object)
+        produto = _texto(bloco['Produto']).map(self._produtos)
+        responsavel = _texto(bloco['Responsável']).map(self._responsaveis)
+        unidade = _texto(bloco['Unidade']).map(self._unidades)
+        tipo = _texto(bloco['Tipo']).map(_dobrar).map(TIPOS_MOVIMENTACAO)
+        quantidade, invalida = self._inteiro(bloco['Quantidade'])
+        data = _ler_datas(bloco['Data'])
+        
+        motivo = self._primeiro_motivo(motivo, produto.isna(), "Produto não encontrado")
+        motivo = self._primeiro_motivo(motivo, responsavel.isna(), "Responsável não encontrado")
+        motivo = self._primeiro_motivo(motivo, unidade.isna(), "Unidade não encontrada")
+        motivo = self._primeiro_motivo(motivo, tipo.isna(), "Tipo deve ser Entrada ou Saída")
+        motivo = self._primeiro_motivo(motivo, invalida | (quantidade <= 0), "Quantidade inválida")
+        motivo = self._primeiro_motivo(motivo, data.isna(), "Data inválida")
+        
+        limpo = pd.DataFrame({
+            'ID Produto': produto,
+            'ID Responsavel': responsavel,
+            'ID Unidade': unidade,
+            'Tipo': tipo,
+            'Quantidade': quantidade.fillna(0).astype('int64'),
+            'Fornecedor': _texto(bloco['Fornecedor']),
+            'Razão': _texto(bloco['Razão']),
+            'Data': data.dt.date
+        })
+        return limpo, motivo
+
+    def relatorio(self):
+        """Linhas rejeitadas (Linha, Motivo e os valores originais)"""
+        if not self.rejeitadas:
+            return pd.DataFrame(columns=['Linha', 'Motivo'])
+        return pd.concat(self.rejeitadas).sort_values('Linha', kind='stable', ignore_index=True)
+
+    def concluir(self, movimentacoes, produtos):
+        """Reserva os IDs em bloco e grava as linhas aceitas.
+
+        Produtos vão numa gravação só; movimentações passam por
+        registrar_movimentacoes (conferência de saldo e diário), e as
+        recusadas ali entram no relatório. Retorna (movimentacoes, produtos)
+        já com as linhas importadas.
+        """
+        if not self.aceitas:
+            return movimentacoes, produtos
+        novas = pd.concat(self.aceitas)
+        tabela = produtos if self.key == 'produtos' else movimentacoes
+        coluna_id = TABLE_KEYS[self.key]
+        novas.insert(0, coluna_id, get_id_allocator().alocar_bloco(self.key, len(novas), tabela))
+        
+        if self.key == 'produtos':
+            salvar_linhas('produtos', novas=novas.reset_index(drop=True))
+            return movimentacoes, pd.concat([produtos, novas], ignore_index=True)
+        
+        motivo = registrar_movimentacoes(novas)
+        originais = pd.concat(self._originais)
+        self._rejeitar(originais, originais.index, motivo)
+        self.aceitas = [novas[motivo.isna()]]
+        snapshot = get_table_store().atual()
+        return snapshot['movimentacoes'], snapshot['produtos']
+
+# --- GRAVAÇÃO EM SEGUNDO PLANO ---
+JANELA_AGRUPAMENTO = 0.3  # segundos de espera para juntar edições em rajada
+MAX_TENTATIVAS = 5
+ESPERA_INICIAL = 0.5  # segundos; dobra a cada nova tentativa
+
+class WriteBehindQueue:
+    """Fila write-behind: as páginas enfileiram operações e uma única thread
+    as grava no backend.
+
+    Operações que chegam juntas são agrupadas por tabela numa só chamada a
+    apply_batch; falhas são repetidas com backoff exponencial e, esgotadas
+    as tentativas, ficam em `falhas` até serem reenviadas ou descartadas.
+    A mesma thread compacta o diário de movimentações quando pedido.
+    """
+
+    def __init__(self, backend_factory, janela=JANELA_AGRUPAMENTO, max_tentativas=MAX_TENTATIVAS):
+        self._backend_factory = backend_factory
+        self.janela = janela
+        self.max_tentativas = max_tentativas
+        self.gravadas = 0
+        self.falhas = []          # (tabela, operações, erro)
+        self.lock_gravacao = threading.Lock()
+        self._cond = threading.Condition()
+        self._fila = []           # (tabela, operação), na ordem de envio
+        self._em_andamento = []
+        self._compactar = False   # compactação do diário pedida
+        self._compactando = False
+        self.erro_compactacao = None
+        self._thread = threading.Thread(target=self._executar, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def enviar(self, key, operacoes):
+        with self._cond:
+            self._fila.extend((key, operacao) for operacao in operacoes)
+            self._cond.notify_all()
+
+    def pedir_compactacao(self):
+        """Agenda a compactação do diário; pedidos em rajada viram uma só"""
+        with self._cond:
+            self._compactar = True
+            self._cond.notify_all()
+
+    def pendentes(self):
+        with self._cond:
+            return self._em_andamento + self._fila
+
+    def status(self):
+        with self._cond:
+            return {
+                'pendentes': len(self._em_andamento) + len(self._fila),
+                'falhas': [(key, str(erro)) for key, _, erro in self.falhas],
+                'gravadas': self.gravadas,
+                'erro_compactacao': None if self.erro_compactacao is None else str(self.erro_compactacao)
+            }
+
+    def aplicar_pendentes(self, tables):
+        """Sobrepõe às tabelas carregadas as operações ainda não gravadas"""
+        for key, operacao in self.pendentes():
+            if key in tables:
+                tables[key] = _aplicar_operacao(tables[key], key, operacao)
+        return tables
+
+    def reenviar_falhas(self):
+        with self._cond:
+            keys = [key for key, _, _ in self.falhas]
+            for key, operacoes, _ in self.falhas:
+                self._fila.extend((key, operacao) for operacao in operacoes)
+            self.falhas = []
+            self._cond.notify_all()
+        get_table_store().invalidar(keys)
+
+    def descartar_falhas(self):
+        with self._cond:
+            self.falhas = []
+
+    def aguardar(self, timeout=None):
+        """Bloqueia até a fila esvaziar; retorna False se o tempo acabar"""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._fila and not self._em_andamento and not self._compactar and not self._compactando,
+                timeout
+            )
+
+    def _executar(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._fila or self._compactar)
+            time.sleep(self.janela)
+            with self._cond:
+                self._em_andamento, self._fila = self._fila, []
+                lote = {}
+                for key, operacao in self._em_andamento:
+                    lote.setdefault(key, []).append(operacao)
+            
+            for key, operacoes in lote.items():
+                with self.lock_gravacao:
+                    erro = self._gravar(key, operacoes)
+                    # Ainda sob o lock: quem recarrega vê a operação no backend
+                    # ou entre as pendentes, nunca nos dois nem em nenhum
+                    with self._cond:
+                        if erro is None:
+                            self.gravadas += len(operacoes)
+                        else:
+                            self.falhas.append((key, operacoes, erro))
+                        self._em_andamento = [item for item in self._em_andamento if item[0] != key]
+                if erro is not None:
+                    # A tabela volta a não ter essas operações: relida do backend
+                    get_table_store().invalidar([key])
+            
+            with self._cond:
+                compactar, self._compactar = self._compactar, False
+                self._compactando = compactar
+            if compactar:
+                # Com falha o diário fica intacto; o próximo pedido tenta de novo
+                with self.lock_gravacao:
+                    self.erro_compactacao = self._tentar(compactar_journal)
+            
+            with self._cond:
+                self._compactando = False
+                self._cond.notify_all()
+
+    def _gravar(self, key, operacoes):
+        return self._tentar(lambda: self._backend_factory().apply_batch(key, operacoes))
+
+    def _tentar(self, funcao):
+        espera = ESPERA_INICIAL
+        erro = None
+        for _ in range(self.max_tentativas):
+            try:
+                funcao()
+                return None
+            except Exception as e:
+                erro = e
+                time.sleep(espera * (1 + random.random()))
+                espera *= 2
+        return erro
+
+@st.cache_resource
+def get_write_queue():
+    """Fila única, compartilhada por todas as sessões"""
+    return WriteBehindQueue(get_storage_backend)
+
+def mostrar_status_gravacao():
+    """Mostra na barra lateral as gravações pendentes ou com falha"""
+    fila = get_write_queue()
+    status = fila.status()
+    if status['pendentes']:
+        st.sidebar.info(f"⏳ {status['pendentes']} alteração(ões) sendo gravada(s)...")
+    if status['falhas']:
+        st.sidebar.error(f"❌ {len(status['falhas'])} gravação(ões) falharam.")
+        for key, erro in status['falhas']:
+            st.sidebar.caption(f"{key}: {erro}")
+        col1, col2 = st.sidebar.columns(2)
+        if col1.button("Tentar novamente", key="btn_reenviar_falhas"):
+            fila.reenviar_falhas()
+            st.rerun()
+        if col2.button("Descartar", key="btn_descartar_falhas"):
+            fila.descartar_falhas()
+            st.rerun()
+    if status['erro_compactacao']:
+        st.sidebar.warning(f"⚠️ Movimentações ainda não enviadas ao armazenamento: {status['erro_compactacao']}")
+
+def mostrar_status_replica():
+    """Estado da sincronização da réplica local com a planilha"""
+    if STORAGE_BACKEND != 'replica':
+        return
+    sincronizador = get_storage_backend().sincronizador
+    status = sincronizador.status()
+    if status['erro']:
+        st.sidebar.warning(f"📴 Sem conexão com a planilha. {status['pendentes']} alteração(ões) "
+                           "salvas localmente aguardando envio.")
+    elif status['pendentes']:
+        st.sidebar.info(f"🔄 {status['pendentes']} alteração(ões) aguardando sincronização...")
+    if st.session_state.get('nivel_acesso') != "Gerente":
+        return
+    with st.sidebar.expander("Sincronização"):
+        if status['ultima'] is None:
+            st.caption("Ainda não sincronizada.")
+        else:
+            st.caption(f"Última sincronização: {datetime.fromtimestamp(status['ultima']):%d/%m/%Y %H:%M:%S} "
+                       f"({status['duracao']:.1f} s)")
+        col1, col2 = st.columns(2)
+        col1.metric("Envios", status['envios'])
+        col2.metric("Recebidas", status['recebidas'])
+        col1.metric("Ciclos", status['ciclos'])
+        col2.metric("Falhas", status['falhas'])
+        if status['erro']:
+            st.caption(f"Último erro: {status['erro']}")
+        if status['conflitos']:
+            st.caption("Conflitos (prevaleceu a planilha):")
+            st.dataframe(pd.DataFrame(status['conflitos']), hide_index=True)
+        if st.button("Sincronizar agora", key="btn_sincronizar_replica"):
+            sincronizador.agendar()
+
+def mostrar_metricas_sheets():
+    """Chamadas à API do Sheets, repetições e espera imposta pelas cotas (só gerentes)"""
+    if STORAGE_BACKEND not in ('sheets', 'replica') or st.session_state.get('nivel_acesso') != "Gerente":
+        return
+    with st.sidebar.expander("Google Sheets"):
+        metricas = get_sheets_client().metricas()
+        col1, col2 = st.columns(2)
+        col1.metric("Leituras", metricas['chamadas'].get('leitura', 0))
+        col2.metric("Escritas", metricas['chamadas'].get('escrita', 0))
+        col1.metric("Repetições", metricas['repeticoes'])
+        col2.metric("Falhas", metricas['falhas'])
+        st.caption(f"Espera pela cota: {metricas['tempo_limitado']:.1f} s; "
+                   f"antes de repetir: {metricas['tempo_repeticoes']:.1f} s")
+        if metricas['tempos']:
+            st.dataframe(pd.DataFrame(
+                [{'Chamada': nome, 'Vezes': n, 'Média (ms)': round(media * 1000, 1)}
+                 for nome, (n, media) in sorted(metricas['tempos'].items())]
+            ), hide_index=True)
+        cache = get_table_cache().stats()
+        if cache['hits'] or cache['misses']:
+            st.caption(f"Cache das abas: {cache['hits']} acerto(s), {cache['misses']} falta(s) "
+                       f"({cache['hits'] / (cache['hits'] + cache['misses']):.0%} de acertos)")
+        if cache['tempos']:
+            st.caption("Última carga de cada aba:")
+            st.dataframe(pd.DataFrame(
+                [{'Aba': SHEET_NAMES.get(key, key), 'Tempo (ms)': round(segundos * 1000, 1)}
+                 for key, segundos in cache['tempos'].items()]
+            ), hide_index=True)
+        renovador = get_renovador_token()
+        st.caption(f"Token: {renovador.renovacoes} renovação(ões) em segundo plano, "
+                   f"expira em {renovador.segundos_restantes() / 60:.0f} min")
+
+# --- SALDOS DE ESTOQUE ---
+ARQUIVO_CHECKPOINT_ESTOQUE = 'estoque.checkpoint.json'
+
+def _deltas_movimentacoes(movimentacoes):
+    """Quantidade com sinal de cada movimentação (Entrada soma, Saída subtrai)"""
+    quantidade = pd.to_numeric(movimentacoes['Quantidade'], errors='coerce').astype('float64').fillna(0)
+    return quantidade.where(movimentacoes['Tipo'] == 'Entrada', -quantidade)
+
+COLUNAS_SALDO = ['ID Movimentação', 'ID Produto', 'ID Unidade', 'Tipo', 'Quantidade']
+
+def _hash_linhas(movimentacoes):
+    """Hash de cada movimentação, nas colunas que entram nos saldos"""
+    colunas = [c for c in COLUNAS_SALDO if c in movimentacoes.columns]
+    return pd.util.hash_pandas_object(movimentacoes[colunas], index=False).to_numpy()
+
+def _hash_prefixo(hashes):
+    """Combina os hashes das linhas pesados pela posição (módulo 2**64):
+    editar, excluir ou reordenar qualquer linha muda o resultado"""
+    pesos = np.arange(1, 2 * len(hashes), 2, dtype=np.uint64)
+    return int((hashes * pesos).sum(dtype=np.uint64))
+
+class StockLedger:
+    """Saldos por produto e por produto/unidade derivados das movimentações.
+
+    Guarda um checkpoint (quantas movimentações já foram processadas e um
+    hash de todo esse trecho) para que cada atualização some apenas as
+    novas. Se qualquer linha já processada mudar, os saldos são
+    recalculados do zero. A tabela de um snapshot nunca é alterada: a
+    mesma tabela conferida de novo não é nem lida.
+    """
+
+    def __init__(self, path=ARQUIVO_CHECKPOINT_ESTOQUE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset()
+        self._carregar()
+
+    def _reset(self):
+        self.processados = 0
+        self.prefixo = None
+        self._conferida = None  # weakref da última tabela de movimentações aplicada
+        self.por_produto = pd.Series(dtype='float64')
+        self.por_unidade = pd.Series(
+            dtype='float64',
+            index=pd.MultiIndex.from_tuples([], names=['ID Produto', 'ID Unidade'])
+        )
+
+    def _checkpoint_valido(self, hashes):
+        if self.processados == 0:
+            return True
+        if len(hashes) < self.processados:
+            return False
+        return _hash_prefixo(hashes[:self.processados]) == self.prefixo
+
+    def atualizar(self, movimentacoes):
+        """Aplica as movimentações posteriores ao checkpoint e retorna os saldos por produto"""
+        with self._lock:
+            if self._conferida is not None and self._conferida() is movimentacoes:
+                return self.por_produto.copy()
+            if movimentacoes.empty or not {'ID Produto', 'Tipo', 'Quantidade'} <= set(movimentacoes.columns):
+                self._reset()
+                return self.por_produto.copy()
+            hashes = _hash_linhas(movimentacoes)
+            if not self._checkpoint_valido(hashes):
+                self._reset()
+            
+            novas = movimentacoes.iloc[self.processados:]
+            if not novas.empty:
+                delta = _deltas_movimentacoes(novas)
+                produto = novas['ID Produto'].astype(str)
+                self.por_produto = self.por_produto.add(delta.groupby(produto).sum(), fill_value=0)
+                if 'ID Unidade' in novas.columns:
+                    unidade = novas['ID Unidade'].astype(str)
+                    por_unidade = delta.groupby([produto.rename('ID Produto'), unidade.rename('ID Unidade')]).sum()
+                    self.por_unidade = self.por_unidade.add(por_unidade, fill_value=0)
+                
+                self.processados = len(movimentacoes)
+                self.prefixo = _hash_prefixo(hashes)
+                self._salvar()
+            self._conferida = weakref.ref(movimentacoes)
+            return self.por_produto.copy()
+
+    def verificar(self, produtos, movimentacoes):
+        """Compara a coluna armazenada com o saldo calculado.
+
+        Retorna só os produtos em que os valores divergem.
+        """
+        saldos = self.atualizar(movimentacoes)
+        armazenado = pd.to_numeric(produtos['Quantidade em Estoque'], errors='coerce').fillna(0)
+        calculado = produtos['ID Produto'].astype(str).map(saldos).fillna(0)
+        divergentes = armazenado != calculado
+        return pd.DataFrame({
+            'ID Produto': produtos['ID Produto'],
+            'Nome do Produto': produtos['Nome do Produto'],
+            'Armazenado': armazenado,
+            'Calculado': calculado,
+            'Diferença': armazenado - calculado
+        })[divergentes]
+
+    def _salvar(self):
+        estado = {
+            'processados': self.processados,
+            'prefixo': self.prefixo,
+            'por_produto': self.por_produto.to_dict(),
+            'por_unidade': [[p, u, v] for (p, u), v in self.por_unidade.items()]
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(estado, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _carregar(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                estado = json.load(f)
+            self.processados = estado['processados']
+            self.prefixo = estado['prefixo']
+            self.por_produto = pd.Series(estado['por_produto'], dtype='float64')
+            if estado['por_unidade']:
+                p, u, v = zip(*estado['por_unidade'])
+                self.por_unidade = pd.Series(
+                    v, index=pd.MultiIndex.from_arrays([p, u], names=['ID Produto', 'ID Unidade']), dtype='float64'
+                )
+        except (OSError, ValueError, KeyError):
+            self._reset()
+
+@st.cache_resource
+def get_stock_ledger():
+    """Saldos compartilhados por todas as sessões"""
+    return StockLedger()
+
+# Função para carregar as planilhas
+def carregar_planilhas():
+    """Tabelas do snapshot lido por esta sessão (inventário, fila e diário), sem cópias"""
+    try:
+        snapshot = get_table_store().obter(st.session_state.get('versao_tabelas'))
+        return tuple(snapshot[key] for key in SHEET_NAMES)
+    except Exception as e:
+        st.error(f"Erro ao carregar planilhas: {e}")
+        return tuple(pd.DataFrame() for _ in SHEET_NAMES)
+
+# Função para salvar as planilhas
+def salvar_planilhas(movimentacoes, produtos, responsaveis, unidades, usuarios):
+    return salvar_tabelas(dict(zip(SHEET_NAMES, (movimentacoes, produtos, responsaveis, unidades, usuarios))))
 # Executar o aplicativo
 if __name__ == "__main__":
     main()
@@ -0,0 +1,107 @@
+"""Carrega as definições de app.py para os testes.
+
+app.py é um script do Streamlit: ao ser importado ele valida os secrets e
+desenha a tela de login. Aqui só as importações, classes, funções e
+constantes são executadas; os valores lidos de st.secrets recebem padrões
+de teste.
+"""
+import ast
+import os
+import types
+
+import pandas as pd
+import pytest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+SECRETS_PADRAO = {
+    'SPREADSHEET_ID': 'x' * 44,
+    'STORAGE_BACKEND': 'xlsx',
+    'CREDS': None,
+    'CLIENT_EMAIL': 'teste@example.com',
+    'REPLICA_ID': 0,
+}
+
+
+def carregar_app():
+    with open(APP, encoding='utf-8') as f:
+        arvore = ast.parse(f.read(), APP)
+    corpo = []
+    for no in arvore.body:
+        if isinstance(no, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)):
+            corpo.append(no)
+        elif isinstance(no, ast.Assign) and 'st.secrets' not in ast.unparse(no):
+            corpo.append(no)
+    modulo = types.ModuleType('app')
+    modulo.__file__ = APP
+    modulo.__dict__.update(SECRETS_PADRAO)
+    exec(compile(ast.Module(body=corpo, type_ignores=[]), APP, 'exec'), modulo.__dict__)
+    return modulo
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """Módulo novo a cada teste, rodando num diretório temporário"""
+    monkeypatch.chdir(tmp_path)
+    return carregar_app()
+
+
+@pytest.fixture
+def ambiente(app, monkeypatch):
+    """Backend em memória, fila, diário e armazém ligados como no app"""
+
+    class MemoriaBackend(app.StorageBackend):
+        local = False
+
+        def __init__(self):
+            self.tabelas = {
+                'movimentacoes': pd.DataFrame({
+                    'ID Movimentação': [1], 'ID Produto': [1], 'Tipo': ['Entrada'],
+                    'Quantidade': [10], 'Data': ['2024-01-01 10:00:00']
+                }),
+                'produtos': pd.DataFrame({'ID Produto': [1, 2], 'Nome do Produto': ['a', 'b'],
+                                          'Quantidade em Estoque': [10, 5]}),
+            }
+
+        def load_table(self, key):
+            return self.tabelas.get(key, pd.DataFrame()).copy()
+
+        def save_tables(self, tables):
+            self.tabelas.update({key: df.copy() for key, df in tables.items()})
+
+    backend = MemoriaBackend()
+    journal = app.MovementJournal('diario.jsonl')
+    fila = app.WriteBehindQueue(lambda: backend, janela=0)
+    store = app.TableStore(app._carregar_tabelas)
+    monkeypatch.setattr(app, 'get_storage_backend', lambda: backend)
+    monkeypatch.setattr(app, 'get_movement_journal', lambda: journal)
+    monkeypatch.setattr(app, 'get_write_queue', lambda: fila)
+    monkeypatch.setattr(app, 'get_table_store', lambda: store)
+    return backend, journal, fila, store
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true',
+                     help='roda também os benchmarks (marcados com benchmark), que são lentos')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: medição de desempenho; só roda com --benchmark')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark'):
+        return
+    pular = pytest.mark.skip(reason='benchmark: use --benchmark')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(pular)
+
+
+@pytest.fixture
+def relatar(capsys):
+    """Escreve no terminal mesmo com a saída capturada"""
+    def relatar(texto):
+        with capsys.disabled():
+            print(texto)
+    return relatar
@@ -0,0 +1,182 @@
+"""Planilha falsa, em memória, com a parte da API do gspread usada pelo app.
+
+Guarda cada aba como uma lista de linhas e interpreta as requisições de
+batch_update que o app monta (deleteDimension, updateCells, appendCells e
+appendDimension). Erros da API podem ser programados com `falhar`.
+"""
+import json
+
+import gspread
+import requests
+
+
+def erro_api(status, retry_after=None):
+    """APIError do gspread com a resposta HTTP informada"""
+    resposta = requests.Response()
+    resposta.status_code = status
+    resposta._content = json.dumps({'error': {'code': status, 'message': 'erro simulado'}}).encode()
+    if retry_after is not None:
+        resposta.headers['Retry-After'] = str(retry_after)
+    return gspread.exceptions.APIError(resposta)
+
+
+def _aparar(linhas):
+    """Como a API: sem células vazias no fim das linhas nem linhas vazias no fim"""
+    saida = []
+    for linha in linhas:
+        linha = list(linha)
+        while linha and linha[-1] == '':
+            linha.pop()
+        saida.append(linha)
+    while saida and not saida[-1]:
+        saida.pop()
+    return saida
+
+
+def _coluna(letras):
+    posicao = 0
+    for letra in letras:
+        posicao = posicao * 26 + ord(letra) - 64
+    return posicao - 1
+
+
+class FakeWorksheet:
+    def __init__(self, planilha, titulo, sheet_id):
+        self.planilha = planilha
+        self._properties = {
+            'title': titulo, 'sheetId': sheet_id,
+            'gridProperties': {'rowCount': 1000, 'columnCount': 26}
+        }
+
+    title = property(lambda self: self._properties['title'])
+    id = property(lambda self: self._properties['sheetId'])
+    row_count = property(lambda self: self._properties['gridProperties']['rowCount'])
+    col_count = property(lambda self: self._properties['gridProperties']['columnCount'])
+
+    def get_all_values(self, **kwargs):
+        self.planilha._registrar('get_all_values')
+        return [list(linha) for linha in _aparar(self.planilha.grades[self.title])]
+
+
+class FakeSpreadsheet:
+    title = 'inventario'
+
+    def __init__(self):
+        self.grades = {}       # título -> linhas
+        self.abas = {}         # título -> FakeWorksheet
+        self.chamadas = []
+        self.offline = False
+        self._falhas = []
+
+    # --- preparação ---
+    def definir(self, titulo, df):
+        self.grades[titulo] = [list(df.columns)] + [list(linha) for linha in df.itertuples(index=False, name=None)]
+        if titulo not in self.abas:
+            self.abas[titulo] = FakeWorksheet(self, titulo, len(self.abas) + 1)
+
+    def tabela(self, titulo):
+        """Conteúdo atual da aba como DataFrame (valores como a API os devolve)"""
+        import pandas as pd
+        linhas = _aparar(self.grades[titulo])
+        largura = len(linhas[0])
+        return pd.DataFrame([linha + [''] * (largura - len(linha)) for linha in linhas[1:]], columns=linhas[0])
+
+    def falhar(self, *erros):
+        """Próximas chamadas levantam estes erros, na ordem"""
+        self._falhas.extend(erros)
+
+    def _registrar(self, nome):
+        self.chamadas.append(nome)
+        if self.offline:
+            raise ConnectionError('rede indisponível')
+        if self._falhas:
+            raise self._falhas.pop(0)
+
+    # --- API ---
+    def values_batch_get(self, ranges, params=None):
+        self._registrar('values_batch_get')
+        resultado = []
+        for intervalo in ranges:
+            titulo, _, colunas = intervalo.partition('!')
+            titulo = titulo[1:-1].replace("''", "'")
+            if titulo not in self.grades:
+                raise erro_api(400)
+            linhas = self.grades[titulo]
+            if colunas:
+                inicio, fim = (_coluna(c) for c in colunas.split(':'))
+                linhas = [linha[inicio:fim + 1] for linha in linhas]
+            linhas = _aparar(linhas)
+            resultado.append({'values': [list(linha) for linha in linhas]} if linhas else {})
+        return {'valueRanges': resultado}
+
+    def worksheet(self, titulo):
+        self._registrar('worksheet')
+        if titulo not in self.abas:
+            raise gspread.WorksheetNotFound(titulo)
+        return self.abas[titulo]
+
+    def worksheets(self):
+        self._registrar('worksheets')
+        return list(self.abas.values())
+
+    def add_worksheet(self, title, rows, cols, **kwargs):
+        self._registrar('add_worksheet')
+        aba = FakeWorksheet(self, title, len(self.abas) + 1)
+        aba._properties['gridProperties'] = {'rowCount': rows, 'columnCount': cols}
+        self.abas[title], self.grades[title] = aba, []
+        return aba
+
+    @staticmethod
+    def _valor(celula):
+        valor = celula.get('userEnteredValue')
+        if not valor:
+            return ''
+        (tipo, x), = valor.items()
+        if tipo == 'numberValue' and float(x).is_integer():
+            return int(x)
+        return x
+
+    def batch_update(self, corpo):
+        self._registrar('batch_update')
+        por_id = {aba.id: titulo for titulo, aba in self.abas.items()}
+        for requisicao in corpo['requests']:
+            (tipo, r), = requisicao.items()
+            if tipo == 'deleteDimension':
+                grade = self.grades[por_id[r['range']['sheetId']]]
+                del grade[r['range']['startIndex']:r['range']['endIndex']]
+            elif tipo == 'appendDimension':
+                grade = self.abas[por_id[r['sheetId']]]._properties['gridProperties']
+                grade['rowCount' if r['dimension'] == 'ROWS' else 'columnCount'] += r['length']
+            elif tipo == 'updateCells':
+                intervalo = r['range']
+                grade = self.grades[por_id[intervalo['sheetId']]]
+                for i in range(intervalo['startRowIndex'], intervalo['endRowIndex']):
+                    while len(grade) <= i:
+                        grade.append([])
+                    k = i - intervalo['startRowIndex']
+                    celulas = r['rows'][k]['values'] if k < len(r['rows']) else []
+                    for j in range(intervalo['startColumnIndex'], intervalo['endColumnIndex']):
+                        while len(grade[i]) <= j:
+                            grade[i].append('')
+                        c = j - intervalo['startColumnIndex']
+                        grade[i][j] = self._valor(celulas[c]) if c < len(celulas) else ''
+            elif tipo == 'appendCells':
+                titulo = por_id[r['sheetId']]
+                self.grades[titulo] = _aparar(self.grades[titulo])
+                self.grades[titulo].extend([self._valor(c) for c in linha['values']] for linha in r['rows'])
+            else:
+                raise ValueError(tipo)
+        if corpo.get('includeSpreadsheetInResponse'):
+            return {'updatedSpreadsheet': {'sheets': [{'properties': dict(aba._properties)} for aba in self.abas.values()]}}
+        return {}
+
+
+class FakeGspreadClient:
+    """Cliente do gspread que abre sempre a mesma planilha falsa"""
+
+    def __init__(self, planilha):
+        self.planilha = planilha
+
+    def open_by_key(self, chave):
+        self.planilha._registrar('open_by_key')
+        return self.planilha
@@ -0,0 +1,101 @@
+"""Contrato comum dos backends de armazenamento: o que um grava, o mesmo
+backend devolve, e apply_batch equivale a aplicar as operações em memória."""
+import pandas as pd
+import pytest
+
+from fake_sheets import FakeGspreadClient, FakeSpreadsheet
+
+BACKENDS = ['xlsx', 'feather', 'sqlite', 'sheets', 'replica']
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, app, monkeypatch):
+    monkeypatch.setattr(app, 'get_table_store', lambda: app.TableStore(lambda keys: {}))
+    if request.param == 'xlsx':
+        return app.XlsxBackend('inventario.xlsx')
+    if request.param == 'feather':
+        return app.FeatherBackend(app.SnapshotStore('snapshot'))
+    if request.param == 'sqlite':
+        return app.SqliteBackend('inventario.db')
+    planilha = FakeSpreadsheet()
+    if request.param == 'replica':
+        return app.ReplicaBackend('replica.db', abrir_planilha=lambda: planilha, automatico=False)
+    cliente = app.SheetsClient(lambda: FakeGspreadClient(planilha), 'x' * 44, dormir=lambda s: None)
+    cache = app.TableCache()
+    monkeypatch.setattr(app, 'get_sheets_client', lambda: cliente)
+    monkeypatch.setattr(app, 'get_table_cache', lambda: cache)
+    return app.SheetsBackend()
+
+
+def produtos():
+    return pd.DataFrame({
+        'ID Produto': [1, 2, 3], 'Nome do Produto': ['Caneta', 'Lápis', 'Borracha'],
+        'Quantidade em Estoque': [10, 0, 7], 'Categoria': ['Escritório', 'Escritório', 'Escola']
+    })
+
+
+def unidades():
+    return pd.DataFrame({'ID Unidade': [1, 2], 'Nome da Unidade': ['Centro', 'Norte']})
+
+
+def linhas(app, df):
+    """Conteúdo comparável entre backends: tipos do esquema, valores como na planilha"""
+    return app._table_rows(app.tipar_tabelas({'produtos': df})['produtos'])
+
+
+def test_grava_e_le_de_volta(app, backend):
+    backend.save_tables({'produtos': produtos(), 'unidades': unidades()})
+    lidas = backend.load_tables(['produtos', 'unidades'])
+    assert linhas(app, lidas['produtos']) == linhas(app, produtos())
+    assert app._table_rows(lidas['unidades']) == app._table_rows(unidades())
+
+
+def test_gravar_uma_tabela_preserva_as_outras(app, backend):
+    backend.save_tables({'produtos': produtos(), 'unidades': unidades()})
+    backend.save_tables({'unidades': unidades().iloc[:1]})
+    assert linhas(app, backend.load_table('produtos')) == linhas(app, produtos())
+    assert len(backend.load_table('unidades')) == 1
+
+
+def test_tabela_inexistente_vem_vazia(backend):
+    assert backend.load_table('responsaveis').empty
+
+
+def test_apply_batch_equivale_as_operacoes_em_memoria(app, backend):
+    backend.save_tables({'produtos': produtos()})
+    operacoes = [
+        ('append', pd.DataFrame({'ID Produto': [4], 'Nome do Produto': ['Régua'],
+                                 'Quantidade em Estoque': [3], 'Categoria': ['Escola']})),
+        ('update', pd.DataFrame({'ID Produto': [2], 'Quantidade em Estoque': [5]}), None),
+        ('delete', [1]),
+    ]
+    backend.apply_batch('produtos', operacoes)
+    esperado = app._aplicar_operacoes(produtos(), 'produtos', operacoes)
+    assert linhas(app, backend.load_table('produtos')) == linhas(app, esperado)
+
+
+def test_replace_troca_a_tabela_inteira(app, backend):
+    backend.save_tables({'produtos': produtos()})
+    backend.apply_batch('produtos', [('replace', produtos().iloc[[2]])])
+    assert linhas(app, backend.load_table('produtos')) == linhas(app, produtos().iloc[[2]])
+
+
+def test_xlsx_grava_num_temporario_e_troca_o_arquivo(app, monkeypatch):
+    backend = app.XlsxBackend('inventario.xlsx')
+    backend.save_tables({'produtos': produtos()})
+    exportar = app.exportar_xlsx
+
+    def falhar_no_meio(tables, destino):
+        assert destino != 'inventario.xlsx' and destino.endswith('.xlsx')
+        with open(destino, 'wb') as f:
+            f.write(b'PK\x03\x04 incompleto')
+        raise OSError('disco cheio')
+    monkeypatch.setattr(app, 'exportar_xlsx', falhar_no_meio)
+    with pytest.raises(OSError):
+        backend.save_tables({'produtos': produtos().iloc[:1]})
+    # Quem lê durante ou depois da falha vê o arquivo anterior inteiro
+    assert linhas(app, backend.load_table('produtos')) == linhas(app, produtos())
+
+    monkeypatch.setattr(app, 'exportar_xlsx', exportar)
+    backend.save_tables({'produtos': produtos().iloc[:1]})
+    assert len(backend.load_table('produtos')) == 1
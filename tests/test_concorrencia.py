@@ -0,0 +1,156 @@
+import gc
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def sessoes(app, ambiente, monkeypatch):
+    """Armazém carregado; devolve a revisão de produtos que duas sessões leram"""
+    backend, journal, fila, store = ambiente
+    monkeypatch.setattr(app, 'get_id_allocator', lambda alocador=app.IdAllocator('ids.json'): alocador)
+    return store.atual().versoes['produtos']
+
+
+def produto(id_produto, nome, estoque=0):
+    return pd.DataFrame({'ID Produto': [id_produto], 'Nome do Produto': [nome], 'Quantidade em Estoque': [estoque]})
+
+
+def nomes(tabela):
+    return dict(zip(tabela['ID Produto'].astype(int), tabela['Nome do Produto']))
+
+
+def test_registros_diferentes_sao_mesclados(app, ambiente, sessoes):
+    backend, journal, fila, store = ambiente
+    app.salvar_linhas('produtos', alteradas=produto(1, 'a2', 10), revisao=sessoes)
+    app.salvar_linhas('produtos', alteradas=produto(2, 'b2', 5), revisao=sessoes)  # leu antes da primeira
+    assert nomes(store.atual()['produtos']) == {1: 'a2', 2: 'b2'}
+    assert fila.aguardar(5)
+    assert nomes(backend.tabelas['produtos']) == {1: 'a2', 2: 'b2'}
+
+
+def test_mesmo_registro_conflita(app, ambiente, sessoes):
+    backend, journal, fila, store = ambiente
+    app.salvar_linhas('produtos', alteradas=produto(1, 'a2', 10), revisao=sessoes)
+    versao = store.atual().versao
+    with pytest.raises(app.ConflitoEdicao):
+        app.salvar_linhas('produtos', alteradas=produto(1, 'a3', 10), revisao=sessoes)
+    with pytest.raises(app.ConflitoEdicao):
+        app.salvar_linhas('produtos', excluidas=[1], revisao=sessoes)
+    assert store.atual().versao == versao  # nada publicado
+    assert fila.aguardar(5)
+    assert nomes(backend.tabelas['produtos']) == {1: 'a2', 2: 'b'}
+    # Relendo a tabela (revisão atual) a mesma edição passa
+    app.salvar_linhas('produtos', alteradas=produto(1, 'a3', 10), revisao=store.atual().versoes['produtos'])
+    assert nomes(store.atual()['produtos'])[1] == 'a3'
+
+
+def test_operacao_na_tabela_inteira_conflita(app, ambiente, sessoes):
+    backend, journal, fila, store = ambiente
+    substituta = store.atual()['produtos'].assign(**{'Nome do Produto': ['x', 'y']})
+    app.salvar_linhas('produtos', tabela=substituta, revisao=sessoes)
+    with pytest.raises(app.ConflitoEdicao):
+        app.salvar_linhas('produtos', alteradas=produto(2, 'b2', 5), revisao=sessoes)
+    
+    # E a substituição conflita com qualquer alteração anterior
+    revisao = store.atual().versoes['produtos']
+    app.salvar_linhas('produtos', alteradas=produto(2, 'b2', 5), revisao=revisao)
+    with pytest.raises(app.ConflitoEdicao):
+        app.salvar_linhas('produtos', tabela=substituta, revisao=revisao)
+
+
+def test_anexos_nunca_conflitam(app, ambiente, sessoes):
+    backend, journal, fila, store = ambiente
+    substituta = store.atual()['produtos'].iloc[:1]
+    app.salvar_linhas('produtos', tabela=substituta, revisao=sessoes)
+    app.salvar_linhas('produtos', alteradas=produto(1, 'a2', 10), revisao=store.atual().versoes['produtos'])
+    app.salvar_linhas('produtos', novas=produto(3, 'c'), revisao=sessoes)
+    assert nomes(store.atual()['produtos']) == {1: 'a2', 3: 'c'}
+    assert fila.aguardar(5)
+    assert nomes(backend.tabelas['produtos']) == {1: 'a2', 3: 'c'}
+
+
+def test_historico_esquecido_conflita_exceto_anexos(app, ambiente, sessoes, monkeypatch):
+    backend, journal, fila, store = ambiente
+    monkeypatch.setattr(app, 'MAX_ALTERACOES', 2)
+    for nome in ('a2', 'a3', 'a4'):
+        app.salvar_linhas('produtos', alteradas=produto(1, nome, 10), revisao=store.atual().versoes['produtos'])
+    # A primeira alteração depois da revisão lida saiu do histórico: não dá para saber o que tocou
+    assert store.conflita('produtos', sessoes, {'2'})
+    with pytest.raises(app.ConflitoEdicao):
+        app.salvar_linhas('produtos', alteradas=produto(2, 'b2', 5), revisao=sessoes)
+    app.salvar_linhas('produtos', novas=produto(3, 'c'), revisao=sessoes)
+    # Revisão ainda coberta pelo histórico: só as chaves contam
+    recente = store.atual().versoes['produtos'] - 1
+    assert not store.conflita('produtos', recente, {'2'})
+    assert store.conflita('produtos', recente, {'3'})
+
+
+def test_releitura_so_nao_conflita_com_anexos(app, ambiente, sessoes):
+    backend, journal, fila, store = ambiente
+    backend.tabelas['produtos'] = backend.tabelas['produtos'].assign(**{'Nome do Produto': ['a', 'b à mão']})
+    store.invalidar(['produtos'])
+    assert nomes(store.atual()['produtos'])[2] == 'b à mão'
+    with pytest.raises(app.ConflitoEdicao):
+        app.salvar_linhas('produtos', alteradas=produto(1, 'a2', 10), revisao=sessoes)
+    app.salvar_linhas('produtos', novas=produto(3, 'c'), revisao=sessoes)
+
+
+def test_outras_tabelas_nao_conflitam(app, ambiente, sessoes):
+    backend, journal, fila, store = ambiente
+    revisao = store.atual().versoes.get('movimentacoes', 0)
+    app.salvar_linhas('produtos', tabela=store.atual()['produtos'].iloc[:1], revisao=sessoes)
+    assert not store.conflita('movimentacoes', revisao, None)
+
+
+class Carregador:
+    def __init__(self, tabelas):
+        self.tabelas = tabelas
+        self.pedidos = []
+
+    def __call__(self, keys):
+        self.pedidos.append(sorted(keys))
+        return {key: self.tabelas[key].copy() for key in keys}
+
+
+@pytest.fixture
+def carregador(app):
+    return Carregador({key: pd.DataFrame({'ID': [1], 'valor': [key]}) for key in app.SHEET_NAMES})
+
+
+def test_armazem_rele_so_o_invalidado(app, carregador):
+    store = app.TableStore(carregador, ttl=300)
+    primeiro = store.atual()
+    assert carregador.pedidos == [sorted(app.SHEET_NAMES)]
+    assert store.atual() is primeiro  # dentro do TTL: nada relido
+    
+    store.invalidar(['produtos'])
+    assert store.atual() is primeiro  # relido, mas igual: nenhuma versão nova
+    assert carregador.pedidos[-1] == ['produtos']
+    
+    carregador.tabelas['produtos'] = pd.DataFrame({'ID': [1], 'valor': ['novo']})
+    store.invalidar(['produtos'])
+    segundo = store.atual()
+    assert segundo.versao == primeiro.versao + 1
+    assert segundo.versoes['produtos'] == segundo.versao
+    assert segundo['usuarios'] is primeiro['usuarios']  # tabelas sem mudança são compartilhadas
+    assert primeiro['produtos']['valor'].tolist() == ['produtos']  # o snapshot antigo não muda
+
+
+def test_armazem_rele_tudo_com_o_ttl_vencido(app, carregador):
+    store = app.TableStore(carregador, ttl=0)
+    store.atual()
+    store.atual()
+    assert carregador.pedidos == [sorted(app.SHEET_NAMES)] * 2
+
+
+def test_snapshots_antigos_saem_da_memoria(app, carregador):
+    store = app.TableStore(carregador, ttl=300)
+    antigo = store.atual()
+    store.alterar(lambda snapshot: {'produtos': snapshot['produtos'].assign(valor='x')}, {'produtos': {'1'}})
+    assert [s.versao for s in store.residentes()] == [1, 2]
+    assert store.obter(1) is antigo
+    del antigo
+    gc.collect()
+    assert [s.versao for s in store.residentes()] == [2]
+    assert store.obter(1).versao == 2  # não residente: a versão atual
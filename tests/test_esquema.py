@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_datas_dia_mes_nunca_trocadas(app):
+    serie = pd.Series(['05/02/2024', '25/12/2023 10:30:00', '01/03/2024 08:15', '', None])
+    datas = app._converter_coluna(serie, 'datetime')
+    assert datas.dtype == 'datetime64[ns]'
+    assert datas.tolist()[:3] == [pd.Timestamp('2024-02-05'), pd.Timestamp('2023-12-25 10:30'),
+                                  pd.Timestamp('2024-03-01 08:15')]
+    assert datas[3:].isna().all()  # células em branco viram NaT
+
+
+def test_datas_iso_e_do_excel(app):
+    serie = pd.Series(['2024-02-05 10:00:00', pd.Timestamp('2024-02-06 11:00'), '2024-02-07', '06/02/2024'],
+                      dtype=object)
+    assert app._converter_coluna(serie, 'datetime').tolist() == [
+        pd.Timestamp('2024-02-05 10:00'), pd.Timestamp('2024-02-06 11:00'),
+        pd.Timestamp('2024-02-07'), pd.Timestamp('2024-02-06')]
+
+
+def test_data_ilegivel_mantem_a_coluna(app):
+    serie = pd.Series(['05/02/2024', 'ontem'])
+    assert app._converter_coluna(serie, 'datetime') is serie
+
+
+def test_importacao_e_planilha_leem_igual(app):
+    serie = pd.Series(['05/02/2024', '2024-02-05', '13/02/2024'])
+    assert app._ler_datas(serie).dt.date.tolist() == app._converter_coluna(serie, 'datetime').dt.date.tolist()
+
+
+def test_data_reescrita_pelo_xlsx_nao_muda(app):
+    backend = app.XlsxBackend('teste.xlsx')
+    tabela = pd.DataFrame({'ID Movimentação': [1, 2], 'Data': ['05/02/2024', '03/04/2024 09:00:00']})
+    backend.save_tables({'movimentacoes': app.tipar_tabela('movimentacoes', tabela)})
+    lidas = app.tipar_tabela('movimentacoes', backend.load_table('movimentacoes'))
+    backend.save_tables({'movimentacoes': lidas})
+    assert app.tipar_tabela('movimentacoes', backend.load_table('movimentacoes'))['Data'].tolist() == [
+        pd.Timestamp('2024-02-05'), pd.Timestamp('2024-04-03 09:00')]
+
+
+@pytest.mark.parametrize('valores, tipo, esperado', [
+    ([1, 2, 3], 'int', 'int32'),
+    ([1, 2, 2 ** 31], 'int', 'int64'),
+    (['1', '2', ''], 'int', 'Int32'),
+    ([1.0, None, 3.0], 'id', 'Int64'),
+    (['10', '20'], 'id', 'int64'),
+])
+def test_larguras_inteiras(app, valores, tipo, esperado):
+    convertida = app._converter_coluna(pd.Series(valores, dtype=object), tipo)
+    assert str(convertida.dtype) == esperado
+    assert convertida.dropna().tolist() == [int(v) for v in valores if str(v) not in ('', 'None', 'nan')]
+
+
+@pytest.mark.parametrize('valores', [
+    [1, 2, 'DESCONHECIDO'],  # ID de produto excluído
+    [1, 2.5],                # fração não é ID
+])
+def test_coluna_de_id_mista_fica_como_esta(app, valores):
+    serie = pd.Series(valores, dtype=object)
+    assert app._converter_coluna(serie, 'id') is serie
+
+
+def test_tipar_tabela(app):
+    tabela = pd.DataFrame({
+        'ID Produto': ['1', '2', '3', '4'], 'Quantidade em Estoque': [10, '', 5, 7],
+        'Categoria': ['a', 'a', 'b', 'a'], 'Extra': [object(), None, 1, 'x'],
+    })
+    tipada = app.tipar_tabela('produtos', tabela)
+    assert tipada.dtypes.astype(str).tolist() == ['int64', 'Int32', 'category', 'object']
+    assert app.tipar_tabela('produtos', tipada) is tipada  # já tipada: nada a converter
+    assert np.array_equal(tipada['Extra'], tabela['Extra'])
@@ -0,0 +1,43 @@
+import os
+import time
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+def historico_com_ids_em_branco():
+    return pd.DataFrame({
+        'ID Produto': pd.array([1, None, 3], dtype='Int64'),
+        'Nome do Produto': ['Caneta', None, 'Lápis'],
+        'Quantidade': pd.array([5, 2, None], dtype='Int32'),
+        'Data': pd.to_datetime(['2024-01-01', '2024-01-02', None]),
+    })
+
+
+def test_parquet_com_inteiros_anulaveis(app):
+    tabela = historico_com_ids_em_branco()
+    caminho = app.exportar_historico(tabela, [0, 1, 2], list(tabela.columns), 'parquet')
+    lido = pq.read_table(caminho).to_pandas()
+    assert lido['ID Produto'].tolist()[::2] == [1, 3] and pd.isna(lido['ID Produto'][1])
+    assert pd.isna(lido['Quantidade'][2])
+    assert lido['Nome do Produto'].tolist() == ['Caneta', None, 'Lápis']
+
+
+def test_parquet_em_varios_blocos(app, monkeypatch):
+    blocos = app.blocos_historico
+    monkeypatch.setattr(app, 'blocos_historico', lambda *args: blocos(*args, tamanho=1))
+    tabela = historico_com_ids_em_branco()
+    caminho = app.exportar_historico(tabela, [2, 1, 0], ['ID Produto', 'Quantidade'], 'parquet')
+    lido = pq.read_table(caminho).to_pandas()
+    assert lido['ID Produto'].isna().tolist() == [False, True, False]
+    assert lido['Quantidade'].isna().tolist() == [True, False, False]
+
+
+def test_exportacoes_antigas_sao_apagadas(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'PASTA_EXPORTACOES', str(tmp_path / 'exportacoes'))
+    tabela = historico_com_ids_em_branco()
+    antigo = app.exportar_historico(tabela, [0], ['ID Produto'], 'csv')
+    os.utime(antigo, (time.time() - app.VALIDADE_EXPORTACAO - 1,) * 2)
+    recente = app.exportar_historico(tabela, [1], ['ID Produto'], 'csv')
+    assert not os.path.exists(antigo)
+    assert os.path.exists(recente)
@@ -0,0 +1,15 @@
+import gspread
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2.credentials import Credentials
+
+
+def test_cliente_montado_com_o_gspread_fixado(app, monkeypatch):
+    monkeypatch.setattr(app, 'CREDS', Credentials(token='token-de-teste'))
+    monkeypatch.setattr(app, 'get_renovador_token', lambda: None)
+    app.get_gs_client.clear()
+
+    gc = app.get_gs_client()
+    assert isinstance(gc, gspread.Client)
+    sessao = gc.http_client.session
+    assert isinstance(sessao, AuthorizedSession)
+    assert sessao.get_adapter('https://sheets.googleapis.com')._pool_maxsize == app.HTTP_CONEXOES
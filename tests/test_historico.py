@@ -0,0 +1,188 @@
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def datas_aleatorias(n, semente=0):
+    """Datas em dois anos, fora de ordem, com alguns NaT"""
+    gerador = np.random.default_rng(semente)
+    segundos = gerador.integers(0, 2 * 365 * 86400, n)
+    datas = (np.datetime64('2023-01-01T00:00:00') + segundos.astype('timedelta64[s]')).astype('datetime64[ns]')
+    datas[gerador.random(n) < 0.01] = np.datetime64('NaT')
+    return datas
+
+
+def varredura(datas, inicio, fim):
+    """Filtro antigo: compara todas as linhas"""
+    inicio = np.datetime64(inicio, 'D').astype('datetime64[ns]')
+    fim = (np.datetime64(fim, 'D') + 1).astype('datetime64[ns]')
+    return np.flatnonzero((datas >= inicio) & (datas < fim))
+
+
+PERIODOS = [
+    (datetime.date(2023, 3, 15), datetime.date(2023, 3, 15)),   # um dia
+    (datetime.date(2023, 1, 31), datetime.date(2023, 2, 1)),    # virada de mês
+    (datetime.date(2023, 5, 10), datetime.date(2024, 2, 20)),   # vários meses
+    (datetime.date(2020, 1, 1), datetime.date(2030, 1, 1)),     # tudo
+    (datetime.date(2026, 1, 1), datetime.date(2026, 12, 31)),   # sem dados
+]
+
+
+@pytest.mark.parametrize('inicio, fim', PERIODOS)
+def test_periodo_igual_a_varredura(app, inicio, fim):
+    datas = datas_aleatorias(20_000)
+    indice = app.DateIndex().adicionar(datas, np.arange(len(datas)))
+    posicoes = indice.posicoes(inicio, fim)
+    assert np.array_equal(np.sort(posicoes), varredura(datas, inicio, fim))
+    assert (np.diff(datas[posicoes]) >= np.timedelta64(0)).all()  # em ordem de data
+
+
+def test_linhas_anexadas_e_copia_independente(app):
+    datas = datas_aleatorias(10_000)
+    base = app.DateIndex().adicionar(datas[:8_000], np.arange(8_000))
+    copia = base.copiar().adicionar(datas[8_000:], np.arange(8_000, 10_000))
+    inicio, fim = PERIODOS[2]
+    assert np.array_equal(np.sort(copia.posicoes(inicio, fim)), varredura(datas, inicio, fim))
+    assert np.array_equal(np.sort(base.posicoes(inicio, fim)), varredura(datas[:8_000], inicio, fim))
+    validas = datas[~np.isnat(datas)]
+    assert copia.intervalo() == (validas.min(), validas.max())
+
+
+def test_indice_por_unidade_igual_a_varredura(app):
+    n = 5_000
+    gerador = np.random.default_rng(1)
+    datas = datas_aleatorias(n, semente=1)
+    movimentacoes = pd.DataFrame({
+        'ID Movimentação': np.arange(1, n + 1), 'ID Produto': 1, 'ID Responsavel': 1,
+        'ID Unidade': gerador.integers(1, 4, n), 'Data': datas,
+    })
+    produtos = pd.DataFrame({'ID Produto': [1], 'Nome do Produto': ['a']})
+    responsaveis = pd.DataFrame({'ID Responsavel': [1], 'Nome do Responsável': ['r']})
+    unidades = pd.DataFrame({'ID Unidade': [1, 2], 'Nome da Unidade': ['u1', 'u2']})  # 3 fica sem nome
+    vista = app.HistoryView((1, 1, 1, 1), movimentacoes.iloc[:4_000], produtos, responsaveis, unidades)
+    vista = vista.atualizar((2, 1, 1, 1), movimentacoes, produtos, responsaveis, unidades)
+    
+    inicio, fim = PERIODOS[2]
+    dentro = np.zeros(n, dtype=bool)
+    dentro[varredura(datas, inicio, fim)] = True
+    for nome in ('u1', 'u2', 'nan'):
+        esperado = np.flatnonzero(dentro & (vista.tabela['Nome da Unidade'].astype(str) == nome).to_numpy())
+        assert np.array_equal(np.sort(vista.por_unidade[nome].posicoes(inicio, fim)), esperado)
+
+
+def test_periodo_curto_nao_varre_a_tabela(app):
+    """Versão reduzida de test_benchmark_historico: a margem exigida aqui é
+    folgada de propósito"""
+    datas = datas_aleatorias(500_000)
+    indice = app.DateIndex().adicionar(datas, np.arange(len(datas)))
+    inicio, fim = datetime.date(2023, 6, 1), datetime.date(2023, 6, 18)
+    
+    def melhor_tempo(funcao):
+        tempos = []
+        for _ in range(5):
+            comeco = time.perf_counter()
+            funcao()
+            tempos.append(time.perf_counter() - comeco)
+        return min(tempos)
+    
+    com_indice = melhor_tempo(lambda: indice.posicoes(inicio, fim))
+    sem_indice = melhor_tempo(lambda: varredura(datas, inicio, fim))
+    assert com_indice * 5 < sem_indice, (com_indice, sem_indice)
+
+
+def test_movimento_registrado_so_anexa_ao_historico(app, ambiente, monkeypatch):
+    backend, journal, fila, store = ambiente
+    backend.tabelas['movimentacoes'] = backend.tabelas['movimentacoes'].assign(**{'ID Responsavel': 1, 'ID Unidade': 1})
+    backend.tabelas['responsaveis'] = pd.DataFrame({'ID Responsavel': [1], 'Nome do Responsável': ['r']})
+    backend.tabelas['unidades'] = pd.DataFrame({'ID Unidade': [1], 'Nome da Unidade': ['u']})
+    monkeypatch.setattr(app, 'get_index_cache', lambda cache=app.IndexCache(): cache)
+    construidas = []
+    original = app.HistoryView.__init__
+    monkeypatch.setattr(app.HistoryView, '__init__',
+                        lambda self, *args: construidas.append(1) or original(self, *args))
+    
+    def historico():
+        snapshot = app.tabelas_sessao()
+        return app.historico_materializado(*(snapshot[key] for key in app.FONTES_HISTORICO))
+    
+    antes = historico()
+    app.registrar_movimentacao({'ID Movimentação': 2, 'ID Produto': 1, 'Tipo': 'Saída', 'Quantidade': 3,
+                                'Data': '2024-01-02 10:00:00', 'ID Responsavel': 1, 'ID Unidade': 1})
+    depois = historico()
+    assert depois is not antes
+    assert len(construidas) == 1  # o estoque mudou, mas a junção não foi refeita
+    assert depois.tabela['Nome do Produto'].tolist() == ['a', 'a']
+    assert len(depois.datas.posicoes(datetime.date(2024, 1, 2), datetime.date(2024, 1, 2))) == 1
+    
+    backend.tabelas['produtos'].loc[0, 'Nome do Produto'] = 'z'
+    store.invalidar(['produtos'])
+    assert historico().tabela['Nome do Produto'].tolist() == ['z', 'z']
+    assert len(construidas) == 2
+
+
+def tabelas_historico(n, unidades=30, anos=5):
+    """Movimentações, produtos, responsáveis e unidades, com n movimentações
+    espalhadas por `anos` e `unidades`"""
+    gerador = np.random.default_rng(2)
+    segundos = gerador.integers(0, anos * 365 * 86400, n)
+    movimentacoes = pd.DataFrame({
+        'ID Movimentação': np.arange(1, n + 1), 'ID Produto': gerador.integers(1, 500, n),
+        'ID Responsavel': gerador.integers(1, 20, n), 'ID Unidade': gerador.integers(1, unidades + 1, n),
+        'Tipo': gerador.choice(['Entrada', 'Saída'], n), 'Quantidade': gerador.integers(1, 50, n),
+        'Data': np.datetime64('2020-01-01T00:00:00', 'ns') + segundos.astype('timedelta64[s]'),
+    })
+    produtos = pd.DataFrame({'ID Produto': np.arange(1, 500), 'Nome do Produto': [f'p{i}' for i in range(1, 500)]})
+    responsaveis = pd.DataFrame({'ID Responsavel': np.arange(1, 20), 'Nome do Responsável': [f'r{i}' for i in range(1, 20)]})
+    nomes = pd.DataFrame({'ID Unidade': np.arange(1, unidades + 1), 'Nome da Unidade': [f'u{i}' for i in range(1, unidades + 1)]})
+    return movimentacoes, produtos, responsaveis, nomes
+
+
+@pytest.mark.benchmark
+def test_benchmark_historico(app, relatar):
+    """Filtros da página de histórico com e sem índice, em 1M de movimentações.
+    
+    pytest tests/test_historico.py --benchmark -k benchmark
+    """
+    movimentacoes, *nomes = tabelas_historico(1_000_010)
+    comeco = time.perf_counter()
+    vista = app.HistoryView((1,), movimentacoes.iloc[:1_000_000], *nomes)
+    relatar(f"\nconstrução da visão: {time.perf_counter() - comeco:.2f}s")
+    comeco = time.perf_counter()
+    vista = vista.atualizar((2,), movimentacoes, *nomes)
+    relatar(f"anexo de 10 movimentações: {time.perf_counter() - comeco:.3f}s")
+    datas = vista.tabela['Data'].to_numpy()
+    unidade = vista.tabela['Nome da Unidade']
+    
+    def medir(funcao, vezes=5):
+        tempos = []
+        for _ in range(vezes):
+            comeco = time.perf_counter()
+            resultado = funcao()
+            tempos.append(time.perf_counter() - comeco)
+        return min(tempos), resultado
+    
+    casos = [
+        ('18 dias, todas as unidades', datetime.date(2022, 6, 1), datetime.date(2022, 6, 18), None),
+        ('2 anos, uma unidade', datetime.date(2021, 1, 1), datetime.date(2022, 12, 31), 'u7'),
+        ('período inteiro', datetime.date(2020, 1, 1), datetime.date(2024, 12, 31), None),
+    ]
+    for nome, inicio, fim, filtro in casos:
+        def varrer():
+            dentro = (datas >= np.datetime64(inicio, 'ns')) & (datas < np.datetime64(fim + datetime.timedelta(days=1), 'ns'))
+            if filtro is not None:
+                dentro &= (unidade.astype(str) == filtro).to_numpy()
+            return vista.tabela[dentro]
+        
+        def indexar():
+            indice = vista.datas if filtro is None else vista.por_unidade[filtro]
+            return vista.tabela.iloc[indice.posicoes(inicio, fim)]
+        
+        sem_indice, esperado = medir(varrer)
+        com_indice, obtido = medir(indexar)
+        assert sorted(obtido.index) == list(esperado.index)
+        relatar(f"{nome:>28}: varredura {sem_indice * 1000:8.1f}ms, índice {com_indice * 1000:8.1f}ms "
+                f"({len(obtido)} linhas)")
+    
\ No newline at end of file
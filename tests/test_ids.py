@@ -0,0 +1,28 @@
+import pandas as pd
+
+
+def produtos(*ids):
+    return pd.DataFrame({'ID Produto': list(ids), 'Nome do Produto': [f'p{i}' for i in ids]})
+
+
+def test_linhas_gravadas_por_fora_sao_respeitadas(app):
+    ids = app.IdAllocator('ids.json')
+    assert ids.alocar('produtos', produtos(1, 2)) == 3
+    # Outro processo gravou os IDs 4 e 5; a nova versão da tabela os traz
+    assert ids.alocar('produtos', produtos(1, 2, 3, 4, 5)) == 6
+    assert ids.alocar('produtos', produtos(1, 2, 3, 4, 5)) == 7
+
+
+def test_mesma_versao_lida_uma_vez(app, monkeypatch):
+    ids = app.IdAllocator('ids.json')
+    tabela = produtos(1, 2)
+    lidas = []
+    maior_id = app.IdAllocator._maior_id
+    monkeypatch.setattr(app.IdAllocator, '_maior_id', staticmethod(lambda s: lidas.append(1) or maior_id(s)))
+    assert [ids.alocar('produtos', tabela) for _ in range(3)] == [3, 4, 5]
+    assert len(lidas) == 1
+
+
+def test_reinicio_segue_do_limite_gravado(app):
+    app.IdAllocator('ids.json', bloco=10).alocar('produtos', produtos(1))
+    assert app.IdAllocator('ids.json').alocar('produtos', produtos(1)) == 12
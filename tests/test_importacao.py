@@ -0,0 +1,51 @@
+import io
+
+import pandas as pd
+
+
+def importar(app, csv):
+    responsaveis = pd.DataFrame({'ID Responsavel': [1], 'Nome do Responsável': ['r']})
+    unidades = pd.DataFrame({'ID Unidade': [1], 'Nome da Unidade': ['u']})
+    snapshot = app.get_table_store().atual()
+    importacao = app.ImportacaoLote('movimentacoes', snapshot['produtos'], responsaveis, unidades)
+    for bloco in app.ler_em_blocos(io.BytesIO(csv.encode()), 'movimentos.csv', tamanho=2):
+        importacao.processar(bloco)
+    movimentacoes, produtos = importacao.concluir(snapshot['movimentacoes'], snapshot['produtos'])
+    return importacao, movimentacoes, produtos
+
+
+def test_saidas_importadas_respeitam_o_saldo(app, ambiente):
+    backend, journal, fila, store = ambiente
+    importacao, movimentacoes, produtos = importar(app, (
+        "Produto,Responsável,Unidade,Tipo,Quantidade,Data\n"
+        "b,r,u,Saída,4,2024-03-01\n"
+        "b,r,u,Saída,3,2024-03-02\n"
+        "b,r,u,Entrada,2,2024-03-03\n"
+        "z,r,u,Entrada,1,2024-03-04\n"
+    ))
+    relatorio = importacao.relatorio()
+    assert relatorio['Linha'].tolist() == [3, 5]
+    assert relatorio['Motivo'].str.startswith('Estoque insuficiente').tolist() == [True, False]
+    assert importacao.total_aceitas == 2
+    assert produtos['Quantidade em Estoque'].tolist() == [10, 3]
+    assert len(movimentacoes) == 3
+
+    # Movimentos e estoque seguem juntos pelo diário até o backend
+    assert fila.aguardar(5)
+    assert backend.tabelas['produtos']['Quantidade em Estoque'].tolist() == [10, 3]
+    assert backend.tabelas['movimentacoes']['Quantidade'].tolist() == [10, 4, 2]
+    assert len(journal) == 0
+
+
+def test_produtos_importados_em_uma_gravacao(app, ambiente):
+    backend, journal, fila, store = ambiente
+    snapshot = store.atual()
+    importacao = app.ImportacaoLote('produtos', snapshot['produtos'], None, None)
+    csv = "Nome do Produto,Quantidade em Estoque\nc,1\nb,2\nd,x\ne,4\n"
+    for bloco in app.ler_em_blocos(io.BytesIO(csv.encode()), 'produtos.csv', tamanho=3):
+        importacao.processar(bloco)
+    _, produtos = importacao.concluir(snapshot['movimentacoes'], snapshot['produtos'])
+    assert importacao.relatorio()['Linha'].tolist() == [3, 4]
+    assert produtos['Nome do Produto'].tolist() == ['a', 'b', 'c', 'e']
+    assert fila.aguardar(5)
+    assert backend.tabelas['produtos']['ID Produto'].tolist() == [1, 2, 3, 4]
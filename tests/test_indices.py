@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+
+def responsaveis():
+    return pd.DataFrame({'ID Responsavel': [1, 2], 'Nome do Responsável': ['Ana', 'Bia']})
+
+
+def test_edicao_recusada_nao_altera_o_indice(app):
+    tabela = responsaveis()
+    indice = app.PrimaryKeyIndex('responsaveis', tabela, por=['Nome do Responsável'])
+    copia = tabela.copy()
+    alterada = indice.atualizar(copia, 1, {'ID Responsavel': 3, 'Nome do Responsável': 'Cris'})
+    assert alterada.values.tolist() == [[3, 'Cris']]
+    # A gravação não aconteceu (ex.: ConflitoEdicao): o índice segue a tabela publicada
+    assert indice.chaves('Nome do Responsável', 'Ana') == [1]
+    assert not indice.existe('Nome do Responsável', 'Cris')
+    assert indice.contem(1) and not indice.contem(3)
+    assert tabela['Nome do Responsável'].tolist() == ['Ana', 'Bia']
+
+
+def test_chave_repetida_e_recusada(app):
+    tabela = responsaveis()
+    indice = app.PrimaryKeyIndex('responsaveis', tabela)
+    with pytest.raises(ValueError):
+        indice.atualizar(tabela.copy(), 1, {'ID Responsavel': 2})
+
+
+def test_busca_da_versao_antiga_nao_muda(app):
+    cache = app.IndexCache()
+    v1 = pd.DataFrame({'ID Produto': [1, 2], 'Nome do Produto': ['Caneta azul', 'Lápis'], 'Categoria': ['x', 'y']})
+    v2 = pd.DataFrame({'ID Produto': [2, 3], 'Nome do Produto': ['Lápis', 'Caneta preta'], 'Categoria': ['y', 'x']})
+
+    def obter(versao, produtos):
+        return cache.obter('busca', versao, lambda: app.ProductSearchIndex().atualizar(produtos),
+                           lambda anterior: anterior.copiar().atualizar(produtos))
+    antigo = obter(1, v1)
+    novo = obter(2, v2)
+    assert novo is not antigo
+    assert antigo.buscar('caneta').tolist() == [0]
+    assert antigo.buscar('lapis').tolist() == [1]
+    assert novo.buscar('caneta').tolist() == [1]
+    assert novo.buscar('lapis').tolist() == [0]
@@ -0,0 +1,122 @@
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+
+def movimento(id_, id_produto, tipo, quantidade):
+    return {'ID Movimentação': id_, 'ID Produto': id_produto, 'Tipo': tipo,
+            'Quantidade': quantidade, 'Data': datetime(2024, 2, 1, 9, 30)}
+
+
+def test_backend_compartilhado_recebe_cada_movimento_pela_fila(app, ambiente):
+    backend, journal, fila, store = ambiente
+    store.atual()
+    assert app.registrar_movimentacao(movimento(2, 2, 'Saída', 3)) == 2
+    assert fila.aguardar(5)
+    assert backend.tabelas['movimentacoes']['ID Movimentação'].tolist() == [1, 2]
+    assert backend.tabelas['produtos']['Quantidade em Estoque'].tolist() == [10, 2]
+    assert len(journal) == 0
+
+
+def test_compactacao_com_falha_mantem_o_diario(app, ambiente, monkeypatch):
+    backend, journal, fila, store = ambiente
+    fila.max_tentativas = 1
+
+    def falhar(tables):
+        raise OSError('disco cheio')
+    monkeypatch.setattr(backend, 'save_tables', falhar)
+    journal.append(movimento(2, 1, 'Entrada', 1))
+    fila.pedir_compactacao()
+    assert fila.aguardar(5)
+    assert len(journal) == 1
+    assert 'disco cheio' in fila.status()['erro_compactacao']
+
+
+def test_recarga_nao_ve_a_mesma_operacao_no_backend_e_na_fila(app, ambiente, monkeypatch):
+    backend, journal, fila, store = ambiente
+    gravou, liberar = threading.Event(), threading.Event()
+    apply_batch = backend.apply_batch
+
+    def gravar_e_esperar(key, operacoes):
+        apply_batch(key, operacoes)
+        gravou.set()
+        liberar.wait(5)  # a operação já está no backend e ainda entre as pendentes
+    monkeypatch.setattr(backend, 'apply_batch', gravar_e_esperar)
+
+    nova = pd.DataFrame({'ID Movimentação': [2], 'ID Produto': [2], 'Tipo': ['Entrada'],
+                         'Quantidade': [1], 'Data': ['2024-02-01 09:30:00']})
+    fila.enviar('movimentacoes', [('append', nova)])
+    assert gravou.wait(5)
+    resultado = {}
+    leitura = threading.Thread(target=lambda: resultado.update(app._carregar_tabelas(['movimentacoes'])))
+    leitura.start()
+    leitura.join(0.2)
+    liberar.set()
+    leitura.join(5)
+    assert resultado['movimentacoes']['ID Movimentação'].tolist() == [1, 2]
+
+
+def test_compactacao_roda_na_fila_sob_o_lock_de_gravacao(app, ambiente, monkeypatch):
+    backend, journal, fila, store = ambiente
+    monkeypatch.setattr(type(backend), 'local', True)
+    monkeypatch.setattr(app, 'JOURNAL_COMPACTAR_A_CADA', 2)
+    gravacoes = []
+    save_tables = backend.save_tables
+
+    def registrar(tables):
+        gravacoes.append((threading.current_thread().name, fila.lock_gravacao.locked()))
+        save_tables(tables)
+    monkeypatch.setattr(backend, 'save_tables', registrar)
+
+    store.atual()
+    app.registrar_movimentacao(movimento(2, 1, 'Saída', 1))
+    assert fila.aguardar(5) and gravacoes == []
+    app.registrar_movimentacao(movimento(3, 2, 'Entrada', 4))
+    assert fila.aguardar(5)
+    assert gravacoes == [('write-behind', True)]
+    assert len(journal) == 0
+    assert backend.tabelas['produtos']['Quantidade em Estoque'].tolist() == [9, 9]
+
+
+def test_estoque_em_branco_conta_como_zero(app, ambiente):
+    backend, journal, fila, store = ambiente
+    backend.tabelas['produtos']['Quantidade em Estoque'] = [10, None]
+    store.atual()
+    assert app.registrar_movimentacao(movimento(2, 2, 'Entrada', 3)) == 3
+    with pytest.raises(app.EstoqueInsuficiente):
+        app.registrar_movimentacao(movimento(3, 2, 'Saída', 4))
+    assert fila.aguardar(5)
+    assert backend.tabelas['produtos']['Quantidade em Estoque'].tolist() == [10, 3]
+
+
+def test_contagem_certa_com_truncate_durante_a_gravacao(app):
+    class Diario(app.MovementJournal):
+        """Dispara um truncate (como a fila) logo depois de a contagem ser lida"""
+        gatilho = None
+
+        def _no_meio(self):
+            if self.gatilho:
+                self.gatilho, thread = None, self.gatilho
+                thread.start()
+                thread.join(0.2)  # com o lock tomado, o truncate só roda depois da escrita
+
+        def __len__(self):
+            n = super().__len__()
+            self._no_meio()
+            return n
+
+        def _contar(self):
+            n = super()._contar()
+            self._no_meio()
+            return n
+
+    journal = Diario('diario.jsonl')
+    journal.estender([{'ID Movimentação': i} for i in range(3)])
+    thread = threading.Thread(target=journal.truncate, args=(2,))
+    journal.gatilho = thread
+    journal.append({'ID Movimentação': 3})
+    thread.join()
+    assert [e['ID Movimentação'] for e in journal.read()] == [2, 3]
+    assert len(journal) == 2
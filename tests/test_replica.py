@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+from fake_sheets import FakeSpreadsheet
+
+
+@pytest.fixture
+def planilha(app, monkeypatch):
+    """Planilha compartilhada pelas réplicas, com uma movimentação e dois produtos"""
+    monkeypatch.setattr(app, 'get_table_store', lambda: app.TableStore(lambda keys: {}))
+    planilha = FakeSpreadsheet()
+    planilha.definir('movimentacoes', pd.DataFrame({
+        'ID Movimentação': [1], 'ID Produto': [1], 'Tipo': ['Entrada'],
+        'Quantidade': [10], 'Data': ['2024-01-01 10:00:00']
+    }))
+    planilha.definir('produtos', pd.DataFrame({
+        'ID Produto': [1, 2], 'Nome do Produto': ['a', 'b'], 'Quantidade em Estoque': [10, 20]
+    }))
+    planilha.definir('responsaveis', pd.DataFrame({'ID Responsavel': [1], 'Nome do Responsável': ['r']}))
+    planilha.definir('unidades', pd.DataFrame({'ID Unidade': [1], 'Nome da Unidade': ['u']}))
+    planilha.definir('usuarios', pd.DataFrame({'username': ['adm'], 'senha': ['h'], 'nivel_acesso': ['Gerente']}))
+    return planilha
+
+
+def replica(app, planilha, nome, numero, passo=10):
+    """Réplica com diário e alocador próprios, como num servidor separado"""
+    journal = app.MovementJournal(f'{nome}.jsonl')
+    backend = app.ReplicaBackend(f'{nome}.db', abrir_planilha=lambda: planilha, journal=journal, automatico=False)
+    ids = app.IdAllocator(f'{nome}.ids.json', passo=passo, deslocamento=numero)
+    return backend, journal, ids
+
+
+def saida(id_, id_produto, quantidade):
+    return {'ID Movimentação': id_, 'ID Produto': id_produto, 'Tipo': 'Saída',
+            'Quantidade': quantidade, 'Data': '2024-02-01 09:30:00'}
+
+
+def test_duas_replicas_convergem(app, planilha):
+    a, _, _ = replica(app, planilha, 'a', 0)
+    b, _, _ = replica(app, planilha, 'b', 1)
+    a.apply_batch('produtos', [('update', pd.DataFrame({'ID Produto': [1], 'Quantidade em Estoque': [11]}), None)])
+    b.apply_batch('unidades', [('append', pd.DataFrame({'ID Unidade': [2], 'Nome da Unidade': ['v']}))])
+    a.sincronizador.sincronizar()
+    b.sincronizador.sincronizar()
+    a.sincronizador.sincronizar()
+    for key in ('produtos', 'unidades'):
+        remoto = app._table_rows(planilha.tabela(key))
+        assert app._table_rows(a.load_table(key)) == remoto == app._table_rows(b.load_table(key))
+    assert planilha.tabela('unidades')['Nome da Unidade'].tolist() == ['u', 'v']
+
+
+def test_replicas_nao_geram_o_mesmo_id(app, planilha):
+    a, diario_a, ids_a = replica(app, planilha, 'a', 0)
+    b, diario_b, ids_b = replica(app, planilha, 'b', 1)
+    # Sem sincronizar entre si, as duas partem da mesma aba
+    id_a = ids_a.alocar('movimentacoes', a.load_table('movimentacoes'))
+    id_b = ids_b.alocar('movimentacoes', b.load_table('movimentacoes'))
+    assert id_a != id_b
+    diario_a.append(saida(id_a, 2, 3))
+    diario_b.append(saida(id_b, 2, 4))
+    a.sincronizador.sincronizar()
+    b.sincronizador.sincronizar()
+    assert sorted(planilha.tabela('movimentacoes')['ID Movimentação'].tolist()) == sorted([1, id_a, id_b])
+    assert planilha.tabela('produtos')['Quantidade em Estoque'].tolist() == [10, 13]
+    assert not b.sincronizador.conflitos
+
+
+def test_faixa_acompanha_a_versao_da_tabela(app, planilha):
+    a, _, ids = replica(app, planilha, 'a', 3)
+    assert ids.alocar('movimentacoes', a.load_table('movimentacoes')) == 3
+    # Linha incluída à mão na planilha com um ID maior, trazida pela sincronização
+    planilha.grades['movimentacoes'].append([25, 1, 'Entrada', 1, '2024-01-02 10:00:00'])
+    a.sincronizador.sincronizar()
+    assert ids.alocar('movimentacoes', a.load_table('movimentacoes')) == 33
+
+
+def test_id_colidido_fica_registrado(app, planilha):
+    a, diario, _ = replica(app, planilha, 'a', 0)
+    planilha.grades['movimentacoes'].append([2, 1, 'Entrada', 5, '2024-01-02 10:00:00'])
+    diario.append(saida(2, 2, 3))
+    a.sincronizador.sincronizar()
+    a.sincronizador.sincronizar()
+    conflitos = list(a.sincronizador.conflitos)
+    assert [(c['Tabela'], c['Chave']) for c in conflitos] == [('movimentacoes', '2')]
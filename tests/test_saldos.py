@@ -0,0 +1,50 @@
+import pandas as pd
+
+
+def movimentacoes():
+    return pd.DataFrame({
+        'ID Movimentação': [1, 2, 3], 'ID Produto': [1, 1, 2], 'ID Unidade': [1, 1, 1],
+        'Tipo': ['Entrada', 'Saída', 'Entrada'], 'Quantidade': [10, 4, 5]
+    })
+
+
+def test_novas_movimentacoes_somam_ao_checkpoint(app):
+    ledger = app.StockLedger('saldos.json')
+    assert ledger.atualizar(movimentacoes()).to_dict() == {'1': 6, '2': 5}
+    novas = pd.concat([movimentacoes(), pd.DataFrame({
+        'ID Movimentação': [4], 'ID Produto': [2], 'ID Unidade': [1], 'Tipo': ['Saída'], 'Quantidade': [1]
+    })], ignore_index=True)
+    # Retomado do arquivo, como após um reinício
+    assert app.StockLedger('saldos.json').atualizar(novas).to_dict() == {'1': 6, '2': 4}
+
+
+def test_edicao_de_linha_antiga_recalcula(app):
+    ledger = app.StockLedger('saldos.json')
+    ledger.atualizar(movimentacoes())
+    editada = movimentacoes()
+    editada.loc[0, 'Quantidade'] = 20  # só a última linha era conferida antes
+    assert ledger.atualizar(editada).to_dict() == {'1': 16, '2': 5}
+
+
+def test_exclusao_no_meio_recalcula(app):
+    ledger = app.StockLedger('saldos.json')
+    ledger.atualizar(movimentacoes())
+    # A saída 2 foi excluída e outra linha ocupou o lugar; a última linha segue igual
+    alterada = movimentacoes()
+    alterada.loc[1] = [5, 2, 1, 'Entrada', 1]
+    assert ledger.atualizar(alterada).to_dict() == {'1': 10, '2': 6}
+
+
+def test_mesma_tabela_nao_e_relida(app, monkeypatch):
+    ledger = app.StockLedger('saldos.json')
+    tabela = movimentacoes()
+    ledger.atualizar(tabela)
+    lidas = []
+    hash_linhas = app._hash_linhas
+    monkeypatch.setattr(app, '_hash_linhas', lambda df: lidas.append(len(df)) or hash_linhas(df))
+    # Nova execução da página sem movimentos novos: o snapshot é o mesmo
+    assert ledger.atualizar(tabela).to_dict() == {'1': 6, '2': 5}
+    assert lidas == []
+    # Nova versão (mesmo conteúdo, outro DataFrame): conferida por inteiro
+    assert ledger.atualizar(movimentacoes()).to_dict() == {'1': 6, '2': 5}
+    assert lidas == [3]
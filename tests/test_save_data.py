@@ -0,0 +1,44 @@
+import pandas as pd
+
+from fake_sheets import FakeGspreadClient, FakeSpreadsheet
+
+
+def preparar(app, monkeypatch):
+    planilha = FakeSpreadsheet()
+    planilha.definir('produtos', pd.DataFrame({
+        'ID Produto': [1, 2, 3, 4, 5],
+        'Nome do Produto': ['a', 'b', 'c', 'd', 'e'],
+    }))
+    cliente = app.SheetsClient(lambda: FakeGspreadClient(planilha), 'x' * 44, dormir=lambda s: None)
+    cache = app.TableCache()
+    monkeypatch.setattr(app, 'get_sheets_client', lambda: cliente)
+    monkeypatch.setattr(app, 'get_table_cache', lambda: cache)
+    # A sessão lê a aba: o snapshot fica em cache
+    cache.publish({'produtos': planilha.tabela('produtos')})
+    return planilha, cache
+
+
+def test_snapshot_valido_envia_so_as_diferencas(app, monkeypatch):
+    planilha, cache = preparar(app, monkeypatch)
+    df = cache.snapshot('produtos').copy()
+    df.loc[2, 'Nome do Produto'] = 'C'
+    assert app.save_data({'produtos': df})
+    assert planilha.tabela('produtos')['Nome do Produto'].tolist() == ['a', 'b', 'C', 'd', 'e']
+    assert planilha.chamadas.count('get_all_values') == 0
+
+
+def test_linhas_movidas_na_planilha_nao_desalinham_a_gravacao(app, monkeypatch):
+    planilha, cache = preparar(app, monkeypatch)
+    # Depois da leitura, alguém inclui uma linha no meio e exclui outra à mão
+    planilha.grades['produtos'].insert(2, [9, 'manual'])
+    del planilha.grades['produtos'][5]  # ID 4
+    df = cache.snapshot('produtos').copy()
+    df.loc[2, 'Nome do Produto'] = 'C'
+    df = df[df['ID Produto'] != 2]
+    assert app.save_data({'produtos': df})
+    gravado = planilha.tabela('produtos')
+    assert dict(zip(gravado['ID Produto'], gravado['Nome do Produto'])) == {1: 'a', 3: 'C', 4: 'd', 5: 'e'}
+
+
+def test_coluna_a1(app):
+    assert [app._coluna_a1(i) for i in (0, 25, 26, 27, 701, 702)] == ['A', 'Z', 'AA', 'AB', 'ZZ', 'AAA']
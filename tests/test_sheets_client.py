@@ -0,0 +1,101 @@
+import gspread
+import pandas as pd
+import pytest
+
+from fake_sheets import FakeGspreadClient, FakeSpreadsheet, erro_api
+
+
+class Relogio:
+    """Tempo simulado: dormir só avança o relógio"""
+
+    def __init__(self):
+        self.agora = 0.0
+        self.esperas = []
+
+    def __call__(self):
+        return self.agora
+
+    def dormir(self, segundos):
+        self.esperas.append(segundos)
+        self.agora += segundos
+
+
+@pytest.fixture
+def planilha():
+    planilha = FakeSpreadsheet()
+    planilha.definir('produtos', pd.DataFrame({'ID Produto': [1], 'Nome do Produto': ['a']}))
+    return planilha
+
+
+def cliente(app, planilha, relogio, **opcoes):
+    return app.SheetsClient(lambda: FakeGspreadClient(planilha), 'x' * 44,
+                            dormir=relogio.dormir, relogio=relogio, **opcoes)
+
+
+def ler(sheets):
+    return sheets.planilha().values_batch_get(["'produtos'"])
+
+
+def test_balde_libera_a_rajada_e_depois_impoe_o_ritmo(app):
+    relogio = Relogio()
+    balde = app.TokenBucket(por_segundo=1, capacidade=3, relogio=relogio, dormir=relogio.dormir)
+    assert [balde.retirar() for _ in range(5)] == [0, 0, 0, 1, 1]
+    relogio.agora += 10  # parado, o balde enche só até a capacidade
+    assert [balde.retirar() for _ in range(4)] == [0, 0, 0, 1]
+
+
+def test_leituras_e_escritas_tem_cotas_separadas(app, planilha):
+    relogio = Relogio()
+    sheets = cliente(app, planilha, relogio, por_minuto={'leitura': 60, 'escrita': 60}, rajada=2)
+    aba = sheets.planilha().worksheet('produtos')  # open_by_key + worksheets: a rajada de leitura acaba
+    sheets.planilha().batch_update({'requests': [{'appendDimension': {
+        'sheetId': aba.id, 'dimension': 'ROWS', 'length': 1}}]})
+    assert relogio.esperas == []
+    ler(sheets)
+    assert relogio.esperas == [1.0]
+    assert sheets.metricas()['chamadas'] == {'leitura': 3, 'escrita': 1}
+
+
+def test_429_e_5xx_sao_repetidos_com_espera_exponencial(app, planilha, monkeypatch):
+    monkeypatch.setattr(app.random, 'random', lambda: 0.5)  # jitter neutro
+    relogio = Relogio()
+    sheets = cliente(app, planilha, relogio, espera_inicial=1.0)
+    sheets.planilha()
+    planilha.falhar(erro_api(429), erro_api(503), erro_api(500))
+    assert ler(sheets)['valueRanges']
+    assert relogio.esperas == [1.0, 2.0, 4.0]
+    assert sheets.metricas()['repeticoes'] == 3
+    assert sheets.metricas()['falhas'] == 0
+
+
+def test_retry_after_da_api_e_respeitado(app, planilha):
+    relogio = Relogio()
+    sheets = cliente(app, planilha, relogio)
+    sheets.planilha()
+    planilha.falhar(erro_api(429, retry_after=7), erro_api(429, retry_after=3600))
+    ler(sheets)
+    assert relogio.esperas == [7.0, app.SHEETS_ESPERA_MAXIMA]
+
+
+def test_desiste_depois_das_tentativas(app, planilha, monkeypatch):
+    monkeypatch.setattr(app.random, 'random', lambda: 0.5)
+    relogio = Relogio()
+    sheets = cliente(app, planilha, relogio, max_tentativas=3, espera_inicial=1.0)
+    sheets.planilha()
+    planilha.falhar(*(erro_api(503) for _ in range(3)))
+    with pytest.raises(gspread.exceptions.APIError):
+        ler(sheets)
+    assert relogio.esperas == [1.0, 2.0]
+    assert sheets.metricas()['falhas'] == 1
+    assert planilha.chamadas.count('values_batch_get') == 3
+
+
+def test_erro_nao_repetivel_sobe_na_hora(app, planilha):
+    relogio = Relogio()
+    sheets = cliente(app, planilha, relogio)
+    sheets.planilha()
+    planilha.falhar(erro_api(403))
+    with pytest.raises(gspread.exceptions.APIError):
+        ler(sheets)
+    assert relogio.esperas == []
+    assert sheets.metricas()['repeticoes'] == 0
@@ -0,0 +1,103 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def movimentacoes(n):
+    """Tabela de movimentações sintética, com as colunas do app"""
+    gerador = np.random.default_rng(0)
+    return pd.DataFrame({
+        'ID Movimentação': np.arange(1, n + 1),
+        'ID Produto': gerador.integers(1, 500, n),
+        'Tipo': gerador.choice(['Entrada', 'Saída'], n),
+        'Quantidade': gerador.integers(1, 50, n),
+        'Data': pd.Timestamp('2024-01-01') + pd.to_timedelta(np.arange(n), unit='min'),
+        'ID Responsavel': gerador.integers(1, 20, n),
+        'ID Unidade': gerador.integers(1, 30, n),
+        'Valor': gerador.random(n) * 100,
+        'Observação': gerador.choice(['', 'ajuste', 'devolução'], n),
+    })
+
+
+def tabelas(n):
+    return {
+        'movimentacoes': movimentacoes(n),
+        'produtos': pd.DataFrame({'ID Produto': [1, 2], 'Nome do Produto': ['a', 'b'],
+                                  'Quantidade em Estoque': [10, 5]}),
+        'responsaveis': pd.DataFrame({'ID Responsavel': [1], 'Nome do Responsável': ['r']}),
+        'unidades': pd.DataFrame({'ID Unidade': [1], 'Nome da Unidade': ['u']}),
+        'usuarios': pd.DataFrame({'Email': ['teste@example.com'], 'Perfil': ['gestor']}),
+    }
+
+
+def test_snapshot_preserva_os_tipos(app):
+    store = app.SnapshotStore()
+    originais = tabelas(100)
+    originais['movimentacoes']['ID Produto'] = originais['movimentacoes']['ID Produto'].astype(object)
+    originais['movimentacoes'].loc[0, 'ID Produto'] = 'DESCONHECIDO'
+    store.save(originais)
+    lidas = app.SnapshotStore().load()
+    mov = lidas['movimentacoes']
+    assert mov['Data'].dtype == 'datetime64[ns]'
+    assert mov['Quantidade'].dtype == originais['movimentacoes']['Quantidade'].dtype
+    assert mov['Valor'].dtype == np.float64
+    assert mov['ID Produto'].tolist()[:2] == ['DESCONHECIDO', str(originais['movimentacoes'].loc[1, 'ID Produto'])]
+    pd.testing.assert_frame_equal(lidas['produtos'], originais['produtos'])
+
+
+def test_snapshot_regrava_so_as_tabelas_alteradas(app):
+    store = app.SnapshotStore()
+    dados = tabelas(100)
+    assert sorted(store.save(dados)) == sorted(app.SHEET_NAMES)
+    assert store.save(dados) == []
+    
+    lidas = app.SnapshotStore().load()
+    outra = app.SnapshotStore()
+    outra.load()
+    lidas['produtos'].loc[0, 'Quantidade em Estoque'] = 11
+    assert outra.save(lidas) == ['produtos']
+
+
+def test_primeira_leitura_importa_o_xlsx(app):
+    app.exportar_xlsx(tabelas(10))
+    lidas = app.SnapshotStore().load()
+    assert len(lidas['movimentacoes']) == 10
+    assert lidas['produtos']['Nome do Produto'].tolist() == ['a', 'b']
+
+
+def test_snapshot_e_bem_mais_rapido_que_o_xlsx(app, tmp_path):
+    """Versão reduzida de test_benchmark_snapshot_xlsx: a margem exigida aqui
+    é folgada de propósito"""
+    dados = tabelas(5_000)
+    xlsx = sum(cronometrar(app.XlsxBackend(str(tmp_path / 'bench.xlsx')), dados))
+    feather = sum(cronometrar(app.FeatherBackend(app.SnapshotStore(str(tmp_path / 'bench_snapshot'))), dados))
+    assert feather * 5 < xlsx, (feather, xlsx)
+
+
+def cronometrar(backend, dados):
+    """(segundos da gravação, segundos da leitura)"""
+    inicio = time.perf_counter()
+    backend.save_tables(dados)
+    meio = time.perf_counter()
+    lidas = backend.load_tables()
+    assert len(lidas['movimentacoes']) == len(dados['movimentacoes'])
+    return meio - inicio, time.perf_counter() - meio
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('linhas', [1_000, 100_000, 1_000_000])
+@pytest.mark.parametrize('formato', ['xlsx', 'feather'])
+def test_benchmark_snapshot_xlsx(app, tmp_path, relatar, formato, linhas):
+    """Gravação e leitura das cinco tabelas, só as movimentações crescendo.
+    
+    pytest tests/test_snapshot.py --benchmark -k benchmark
+    (o xlsx com 1M de linhas leva vários minutos)
+    """
+    if formato == 'xlsx':
+        backend = app.XlsxBackend(str(tmp_path / 'bench.xlsx'))
+    else:
+        backend = app.FeatherBackend(app.SnapshotStore(str(tmp_path / 'bench_snapshot')))
+    gravacao, leitura = cronometrar(backend, tabelas(linhas))
+    relatar(f"\n{formato:>7} {linhas:>9} linhas: gravação {gravacao:8.3f}s, leitura {leitura:8.3f}s")
@@ -0,0 +1,62 @@
+import pandas as pd
+
+
+def usuarios(app):
+    return pd.DataFrame({
+        'username': ['Ana', ' bia ', 'ana'],
+        'senha': ['123', app.gerar_hash_senha('segredo'), 456],
+        'nivel_acesso': ['gestor', 'usuario', 'usuario'],
+    })
+
+
+def test_busca_pelo_username_normalizado(app):
+    indice = app.UserIndex(usuarios(app))
+    assert len(indice) == 2
+    assert indice.verificar('  ANA ', '123') == ('Ana', 'gestor')
+    assert indice.verificar('ana', '456') == ('ana', 'usuario')  # mesmo nome, outra senha
+    assert indice.verificar('BIA', ' segredo ') == (' bia ', 'usuario')
+    assert indice.verificar('bia', 'errada') is None
+    assert indice.verificar('cris', '123') is None
+
+
+def test_senhas_em_texto_nao_ficam_no_indice(app):
+    indice = app.UserIndex(usuarios(app))
+    guardadas = [protegida for linhas in indice._usuarios.values() for _, _, protegida in linhas]
+    assert '123' not in guardadas and '456' not in guardadas
+    assert any(p.startswith(app.PREFIXO_HASH + '$') for p in guardadas)
+
+
+def test_colunas_obrigatorias(app):
+    indice = app.UserIndex(pd.DataFrame({'username': ['ana'], 'senha': ['1']}))
+    assert 'nivel_acesso' in indice.erro
+    assert indice.verificar('ana', '1') is None
+
+
+def test_login_le_so_os_usuarios(app, ambiente, monkeypatch):
+    backend, journal, fila, store = ambiente
+    backend.tabelas['usuarios'] = usuarios(app)
+    lidas = []
+    carregar = backend.load_table
+    monkeypatch.setattr(backend, 'load_table', lambda key: lidas.append(key) or carregar(key))
+    monkeypatch.setattr(app, 'get_index_cache', lambda cache=app.IndexCache(): cache)
+    
+    indice = app.indice_usuarios()
+    assert lidas == ['usuarios']
+    assert indice.verificar('ana', '123') == ('Ana', 'gestor')
+    assert app.indice_usuarios() is indice  # nova execução da tela: nada é relido
+    assert lidas == ['usuarios']
+    
+    # Depois do login as demais tabelas são lidas, e os usuários não outra vez
+    snapshot = store.atual()
+    assert sorted(lidas) == sorted(app.SHEET_NAMES)
+    assert snapshot['produtos']['ID Produto'].tolist() == [1, 2]
+
+
+def test_escrita_antes_da_carga_fica_para_a_leitura(app, ambiente):
+    backend, journal, fila, store = ambiente
+    backend.tabelas['usuarios'] = usuarios(app)
+    store.atual(['usuarios'])
+    # Só os usuários estão carregados: o estoque alterado aqui viria de um snapshot sem produtos
+    store.alterar(lambda snapshot: {'produtos': snapshot['produtos'], 'usuarios': snapshot['usuarios'].iloc[:1]})
+    assert len(store.atual(['usuarios'])['usuarios']) == 1
+    assert store.atual()['produtos']['ID Produto'].tolist() == [1, 2]